@@ -0,0 +1,346 @@
+######################################################################################################################
+# Ingest benchmarks on synthetic logger files
+######################################################################################################################
+# Generates TOA5, TOB3 and HOBOcsv files of a given count and time span, then times each stage of the ingest path:
+# file discovery, parsing, database writes and reads, and metadata saves
+# Results are appended to a JSON-lines file, one record per stage and scale, so runs can be compared across commits
+# e.g., python benchmark.py --fileTypes TOA5 TOB3 --files 10 1000 --years 1 10 --output benchmarks.jsonl
+# --startup times imports and database construction in fresh interpreters, which is what each spawned pool worker pays
+# --helpers times the nested dict helpers on synthetic source inventories and flags any that scale worse than linearly
+from dataclasses import dataclass,field
+import subprocess
+import tempfile
+import platform
+import argparse
+import datetime
+import shutil
+import copy
+import time
+import sys
+import json
+import csv
+import os
+import numpy as np
+import pandas as pd
+
+import rawDataFile
+import helperFunctions
+from siteInventory import sourceRecord
+from parseFiles.helperFunctions.log import log
+
+stages = ['findFiles','findFilesIndexed','loadRawFile','databaseWrite','databaseRead','databaseSlice','save']
+# modules that headless runs and pool workers should not need to load
+heavyModules = ['geopandas','pyproj','utm','shapely','deepdiff','psutil']
+# seconds between 1970 and 1990, the TOB3 epoch
+csiEpoch = 631152000
+
+@dataclass(kw_only=True)
+class syntheticLogger:
+    # writes nFiles files spanning a number of years at a given frequency, values are random normals
+    rootPath: str
+    fileType: str = 'TOA5'
+    nFiles: int = 10
+    years: int = 1
+    frequency: str = '30min'
+    variables: int = 10
+    start: str = '2020-01-01'
+    # files per sub folder, so large runs look like a logger archive rather than one flat directory
+    folderSize: int = 1000
+    tableName: str = 'Met_Data'
+    seed: int = 0
+
+    def __post_init__(self):
+        step = pd.Timedelta(self.frequency)
+        span = pd.Timestamp(self.start)+pd.DateOffset(years=self.years)-pd.Timestamp(self.start)
+        self.rowsPerFile = max(1,int(span/step)//self.nFiles)
+        self.columns = [f'Var_{i}' for i in range(self.variables)]
+        self.rng = np.random.default_rng(self.seed)
+        self.writer = {'TOA5':self.writeTOA5,'TOB3':self.writeTOB3,'HOBOcsv':self.writeHOBO}[self.fileType]
+
+    def generate(self):
+        files = []
+        for i in range(self.nFiles):
+            index = pd.Timestamp(self.start)+pd.Timedelta(self.frequency)*(np.arange(self.rowsPerFile)+i*self.rowsPerFile+1)
+            data = self.rng.normal(size=(self.rowsPerFile,self.variables)).astype('float32')
+            folder = os.path.join(self.rootPath,f'{i//self.folderSize:05d}')
+            os.makedirs(folder,exist_ok=True)
+            fname = os.path.join(folder,f'{self.tableName}{i}.{"csv" if self.fileType == "HOBOcsv" else "dat"}')
+            self.writer(fname,pd.DatetimeIndex(index),data,i)
+            files.append(fname)
+        return(files)
+
+    def matchPattern(self):
+        return(f'*{self.tableName}*')
+
+    def writeTOA5(self,fname,index,data,i):
+        header = [
+            ['TOA5','synthetic','CR1000X','1','CR1000X.Std.07.02','CPU:synthetic.CR1X','1',self.tableName],
+            ['TIMESTAMP','RECORD']+self.columns,
+            ['TS','RN']+['unit']*self.variables,
+            ['','']+['Avg']*self.variables,
+            ]
+        df = pd.DataFrame(data,columns=self.columns)
+        df.insert(0,'RECORD',np.arange(len(index))+i*self.rowsPerFile)
+        df.insert(0,'TIMESTAMP','"'+index.strftime('%Y-%m-%d %H:%M:%S')+'"')
+        with open(fname,'w',newline='') as f:
+            f.write(''.join(','.join(f'"{h}"' for h in line)+'\r\n' for line in header))
+            df.to_csv(f,header=False,index=False,quoting=csv.QUOTE_NONE,lineterminator='\r\n',float_format='%.6g')
+
+    def writeHOBO(self,fname,index,data,i):
+        serial = 20750000+i
+        header = ['#','Date Time, GMT+00:00']+[f'Temp, °C (LGR S/N: {serial}, SEN S/N: {serial}, LBL: {c})' for c in self.columns]
+        df = pd.DataFrame(data,columns=self.columns)
+        df.insert(0,'Date Time',index.strftime('%y/%m/%d %H:%M:%S'))
+        df.insert(0,'#',np.arange(len(index))+1)
+        with open(fname,'w',encoding='utf-8-sig',newline='') as f:
+            f.write(f'"Plot Title: {self.tableName}{i}"\n'+','.join(f'"{h}"' for h in header)+'\n')
+            df.to_csv(f,header=False,index=False,float_format='%.3f')
+
+    def writeTOB3(self,fname,index,data,i):
+        # IEEE4B fields only, frames of a fixed size with a 12 byte header (seconds since 1990, sub-seconds, record) and a 4 byte footer
+        validation = 60223
+        recordSize = 4*self.variables
+        # whole frames only, so every record in the file is valid
+        perFrame = max(1,min(self.rowsPerFile,(976-16)//recordSize))
+        while self.rowsPerFile % perFrame:
+            perFrame -= 1
+        frameSize = 16+perFrame*recordSize
+        nFrames = len(index)//perFrame
+        frame = np.dtype([('seconds','<u4'),('subSeconds','<u4'),('record','<u4'),('data','>f4',(perFrame,self.variables)),('footer','<u4')])
+        frames = np.zeros(nFrames,dtype=frame)
+        first = index[::perFrame]
+        frames['seconds'] = first.asi8//10**9-csiEpoch
+        frames['subSeconds'] = (first.asi8%10**9)//10**5
+        frames['record'] = np.arange(nFrames)*perFrame+i*self.rowsPerFile
+        frames['data'] = data.reshape(nFrames,perFrame,self.variables)
+        frames['footer'] = validation<<16
+        header = [
+            ['TOB3','synthetic','CR1000X','1','CR1000X.Std.07.02','CPU:synthetic.CR1X','1',index[0].strftime('%Y-%m-%d %H:%M:%S')],
+            [self.tableName,csiInterval(self.frequency),str(frameSize),str(nFrames),str(validation),'Sec100Usec','0','0','0'],
+            self.columns,
+            ['unit']*self.variables,
+            ['Smp']*self.variables,
+            ['IEEE4B']*self.variables,
+            ]
+        header = ''.join(','.join(f'"{h}"' for h in line)+'\r\n' for line in header).encode()
+        # the logger pads the header out to a multiple of 512 bytes on the last line
+        pad = -len(header)%512
+        header = header[:-2]+b' '*pad+b'\r\n'
+        with open(fname,'wb') as f:
+            f.write(header)
+            frames.tofile(f)
+
+def csiInterval(frequency):
+    step = pd.Timedelta(frequency)
+    if step % pd.Timedelta('1min') == pd.Timedelta(0):
+        return(f'{int(step/pd.Timedelta("1min"))} MIN')
+    if step % pd.Timedelta('1s') == pd.Timedelta(0):
+        return(f'{int(step/pd.Timedelta("1s"))} SEC')
+    return(f'{int(step/pd.Timedelta("1ms"))} MSEC')
+
+def folderSize(path):
+    return(sum(os.path.getsize(os.path.join(root,f)) for root,dirs,files in os.walk(path) for f in files))
+
+@dataclass(kw_only=True)
+class benchmark:
+    fileType: str = 'TOA5'
+    nFiles: int = 10
+    years: int = 1
+    frequency: str = '30min'
+    variables: int = 10
+    stages: list = field(default_factory=lambda:list(stages))
+    output: str = None
+    workDir: str = None
+    verbose: bool = True
+    results: list = field(default_factory=lambda:[],repr=False)
+
+    def run(self):
+        if self.workDir:
+            os.makedirs(self.workDir,exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=self.workDir,prefix='benchmark_')
+        try:
+            self.stagesIn(tmp)
+        finally:
+            shutil.rmtree(tmp,ignore_errors=True)
+        return(self.results)
+
+    def record(self,stage,seconds,files=None,rows=None,bytes=None):
+        result = {'stage':stage,'fileType':self.fileType,'files':self.nFiles,'years':self.years,'frequency':self.frequency,'variables':self.variables,
+                  'seconds':round(seconds,6),'rows':rows,'bytes':bytes,
+                  'filesPerSecond':round(files/seconds,3) if files and seconds else None,
+                  'rowsPerSecond':round(rows/seconds,3) if rows and seconds else None,
+                  'MBPerSecond':round(bytes/seconds/1e6,3) if bytes and seconds else None}|environment()
+        log(f"{stage:<18}{self.fileType:<9}{self.nFiles:>7} files {self.years:>3} years {seconds:10.3f} s",ln=False,verbose=self.verbose)
+        self.results.append(result)
+        if self.output:
+            with open(self.output,'a') as f:
+                f.write(json.dumps(result)+'\n')
+
+    def stagesIn(self,tmp):
+        rootPath,projectPath = os.path.join(tmp,'raw'),os.path.join(tmp,'project')
+        logger = syntheticLogger(rootPath=rootPath,fileType=self.fileType,nFiles=self.nFiles,years=self.years,frequency=self.frequency,variables=self.variables)
+        t = time.perf_counter()
+        files = logger.generate()
+        self.record('generate',time.perf_counter()-t,files=len(files),bytes=folderSize(rootPath))
+
+        source = sourceRecord(matchPattern=logger.matchPattern(),rootPath=rootPath)
+        indexFile = os.path.join(tmp,'.fileIndex.json')
+        if 'findFiles' in self.stages:
+            t = time.perf_counter()
+            source.__find_files__(fileList={},indexFile=indexFile)
+            self.record('findFiles',time.perf_counter()-t,files=len(source.fileList))
+        if 'findFilesIndexed' in self.stages:
+            # nothing changed since the last search, so the directory index should short-circuit
+            t = time.perf_counter()
+            source.__find_files__(indexFile=indexFile)
+            self.record('findFilesIndexed',time.perf_counter()-t,files=len(source.fileList))
+
+        fileList = source.fileList or {f:{'loaded':False,'parserSettings':{}} for f in files}
+        results = []
+        if {'loadRawFile','databaseWrite','databaseRead','databaseSlice'} & set(self.stages):
+            t = time.perf_counter()
+            results = [rawDataFile.loadRawFile((f,dict(info)),fileType=self.fileType) for f,info in fileList.items()]
+            self.record('loadRawFile',time.perf_counter()-t,files=len(results),rows=sum(len(r['DataFrame']) for r in results),bytes=folderSize(rootPath))
+
+        import dbPipeline
+        path = os.path.join(tmp,'database','synthetic','benchmark')
+        if results and {'databaseWrite','databaseRead','databaseSlice'} & set(self.stages):
+            variableMap = {}
+            for result in results:
+                variableMap = variableMap | result['variableMap']
+            dataIn = pd.concat([result['DataFrame'] for result in results])
+            t = time.perf_counter()
+            dbPipeline.databaseFolder(path=path,dataIn=dataIn,variableMap=variableMap,frequency=self.frequency,verbose=False)
+            self.record('databaseWrite',time.perf_counter()-t,rows=len(dataIn),bytes=folderSize(path))
+            Years = sorted({part.year for part in dbPipeline.gridPartition(dataIn.index,self.frequency)})
+            if 'databaseRead' in self.stages:
+                t = time.perf_counter()
+                dataOut = dbPipeline.databaseFolder(path=path,Years=Years,verbose=False).dataOut
+                self.record('databaseRead',time.perf_counter()-t,rows=len(dataOut),bytes=folderSize(path))
+            if 'databaseSlice' in self.stages:
+                # one week of two variables from the middle of the record
+                start = dataIn.index[len(dataIn)//2]
+                t = time.perf_counter()
+                dataOut = dbPipeline.databaseFolder(path=path,variables=logger.columns[:2],start=str(start),end=str(start+pd.Timedelta('7D')),verbose=False).dataOut
+                self.record('databaseSlice',time.perf_counter()-t,rows=len(dataOut))
+
+        if 'save' in self.stages:
+            # write the source inventory and project metadata of a measurement with nFiles files on record
+            db = dbPipeline.database(projectPath=projectPath,template=False,loadNew=False,enableParallel=False)
+            inventory = {logger.matchPattern():{'matchPattern':logger.matchPattern(),'rootPath':rootPath,'parserSettings':{},
+                                                'fileList':{f:{'loaded':True,'parserSettings':{},'fingerprint':rawDataFile.fileFingerprint(f)} for f in fileList}}}
+            t = time.perf_counter()
+            db.catalog.save('synthetic','benchmark',inventory)
+            db.save()
+            db.flush()
+            self.record('save',time.perf_counter()-t,files=len(fileList))
+            db.close()
+
+def freshInterpreter(code):
+    # run code in a new interpreter with the same module search path, it prints its timing and the heavy modules it loaded
+    env = os.environ|{'PYTHONPATH':os.pathsep.join(p for p in sys.path if p)}
+    code = f"import sys,time\nstart=time.perf_counter()\n{code}\nprint(time.perf_counter()-start)\nprint([m for m in {heavyModules} if m in sys.modules])"
+    out = subprocess.run([sys.executable,'-c',code],env=env,capture_output=True,text=True,cwd=os.path.dirname(os.path.abspath(__file__)))
+    if out.returncode:
+        raise RuntimeError(out.stderr)
+    lines = out.stdout.strip().split('\n')
+    return(float(lines[-2]),json.loads(lines[-1].replace("'",'"')))
+
+def startup(output=None,repeat=3,workDir=None,verbose=True):
+    # best of repeat runs for the imports a pool worker needs and for opening a project with and without the spatial stack
+    if workDir:
+        os.makedirs(workDir,exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=workDir,prefix='benchmark_')
+    tests = {'import rawDataFile':'import rawDataFile',
+             'import dbPipeline':'import dbPipeline'}
+    for headless in [False,True]:
+        tests[f'database(headless={headless})'] = f"import dbPipeline,tempfile\ndbPipeline.database(projectPath=tempfile.mkdtemp(dir={tmp!r}),headless={headless},verbose=False)"
+    results = []
+    for name,code in tests.items():
+        try:
+            runs = [freshInterpreter(code) for i in range(repeat)]
+        finally:
+            shutil.rmtree(tmp,ignore_errors=True)
+            os.makedirs(tmp)
+        result = {'stage':'startup','test':name,'seconds':round(min(r[0] for r in runs),6),'loaded':runs[0][1]}|environment()
+        log(f"{name:<30}{result['seconds']:10.3f} s  loaded: {','.join(result['loaded']) or '-'}",ln=False,verbose=verbose)
+        results.append(result)
+        if output:
+            with open(output,'a') as f:
+                f.write(json.dumps(result)+'\n')
+    shutil.rmtree(tmp,ignore_errors=True)
+    return(results)
+
+def syntheticInventory(leaves):
+    # a source inventory shaped nested dict: sites/measurements/fileList/<file>/{loaded,parserSettings}
+    files = max(1,leaves//(2*10*2))
+    return({f'site{s}':{f'meas{m}':{'fileList':{f'/raw/site{s}/meas{m}/file_{f:06d}.dat':{'loaded':True,'parserSettings':{}} for f in range(files)}}
+                        for m in range(2)} for s in range(10)})
+
+def helpers(output=None,leaves=[1000,10000,100000],repeat=3,verbose=True,maxSlowdown=3):
+    # best of repeat runs of the flat key <-> nested round trip and of merging an inventory into a copy of itself
+    # the time per leaf should stay flat as the inventory grows, a helper whose time per leaf grows by more than
+    # maxSlowdown from the smallest to the largest inventory is reported as a regression
+    tests = {
+        'unpackDict':lambda tree,flat:helperFunctions.unpackDict(tree,format='~'),
+        'packDict':lambda tree,flat:helperFunctions.packDict(flat,format='~'),
+        'updateDict':lambda tree,flat:helperFunctions.updateDict(copy.deepcopy(tree),helperFunctions.packDict(flat,format='~'),overwrite=True),
+        }
+    results = []
+    for n in leaves:
+        tree = syntheticInventory(n)
+        flat = helperFunctions.unpackDict(tree,format='~')
+        for name,test in tests.items():
+            seconds = []
+            for i in range(repeat):
+                t = time.perf_counter()
+                test(tree,flat)
+                seconds.append(time.perf_counter()-t)
+            result = {'stage':'helpers','test':name,'leaves':len(flat),'seconds':round(min(seconds),6),'microsecondsPerLeaf':round(min(seconds)/len(flat)*1e6,3)}|environment()
+            log(f"{name:<12}{len(flat):>9} leaves {result['seconds']:10.4f} s {result['microsecondsPerLeaf']:8.3f} us/leaf",ln=False,verbose=verbose)
+            results.append(result)
+            if output:
+                with open(output,'a') as f:
+                    f.write(json.dumps(result)+'\n')
+    regressions = []
+    for name in tests:
+        perLeaf = [r['microsecondsPerLeaf'] for r in results if r['test'] == name]
+        if len(perLeaf)>1 and perLeaf[-1] > maxSlowdown*perLeaf[0]:
+            regressions.append(name)
+            log(f'{name} scales worse than linearly: {perLeaf[0]} -> {perLeaf[-1]} us/leaf',ln=False,verbose=verbose)
+    return(results,regressions)
+
+def environment():
+    # identify the machine and code version a result was measured on
+    if not hasattr(environment,'cache'):
+        try:
+            commit = subprocess.run(['git','rev-parse','--short','HEAD'],cwd=os.path.dirname(os.path.abspath(__file__)),capture_output=True,text=True).stdout.strip() or None
+        except OSError:
+            commit = None
+        environment.cache = {'commit':commit,'host':platform.node(),'python':platform.python_version(),'numpy':np.__version__,'pandas':pd.__version__}
+    return(environment.cache|{'time':datetime.datetime.now().isoformat(timespec='seconds')})
+
+if __name__ == '__main__':
+    CLI = argparse.ArgumentParser(description='Time the ingest stages on synthetic logger files')
+    CLI.add_argument('--fileTypes',nargs='+',default=['TOA5','TOB3','HOBOcsv'])
+    CLI.add_argument('--files',nargs='+',type=int,default=[10,100,1000])
+    CLI.add_argument('--years',nargs='+',type=int,default=[1])
+    CLI.add_argument('--frequency',default='30min')
+    CLI.add_argument('--variables',type=int,default=10)
+    CLI.add_argument('--stages',nargs='+',default=stages,choices=stages)
+    CLI.add_argument('--output',default='benchmarks.jsonl')
+    CLI.add_argument('--workDir',default=None)
+    CLI.add_argument('--startup',action='store_true',help='only time imports and database construction')
+    CLI.add_argument('--helpers',action='store_true',help='only time the nested dict helpers, exits with 1 if one scales worse than linearly')
+    args = CLI.parse_args()
+    if args.startup:
+        startup(output=args.output,workDir=args.workDir)
+        sys.exit()
+    if args.helpers:
+        results,regressions = helpers(output=args.output)
+        sys.exit(1 if regressions else 0)
+    for fileType in args.fileTypes:
+        for years in args.years:
+            for nFiles in args.files:
+                benchmark(fileType=fileType,nFiles=nFiles,years=years,frequency=args.frequency,variables=args.variables,
+                          stages=args.stages,output=args.output,workDir=args.workDir).run()
@@ -0,0 +1,196 @@
+######################################################################################################################
+# Streaming block statistics
+######################################################################################################################
+# Reduces high frequency data (e.g., 20 Hz Flux) to block statistics per averaging interval as chunks arrive
+# Intervals are labelled by their end time, matching the database grid
+# Partial statistics for intervals at the edges of a chunk are held and combined (Chan et al. parallel algorithm)
+# so intervals that span file boundaries come out the same as if the files had been read as one
+# Intervals still incomplete at the end of a run are kept as moments (see record) and restored by the next run (see restore),
+# so an interval split across two ingests is completed rather than left with the statistics of its first part
+from dataclasses import dataclass,field
+import pandas as pd
+
+@dataclass(kw_only=True)
+class blockAggregator:
+    interval: str = '30min'
+    # None aggregates every numeric column except those in exclude
+    variables: list = None
+    # record counters and other columns that are not measurements
+    exclude: list = field(default_factory=lambda:['RECORD','POSIX_timestamp','sourceModified'])
+    # pairs of variables, e.g., [['Uz','Ts'],['Uz','CO2']]
+    covariances: list = field(default_factory=lambda:[])
+    statistics: list = field(default_factory=lambda:['mean','variance','min','max','count'])
+    pending: dict = field(default_factory=lambda:{},repr=False)
+    # incomplete intervals are held across runs for up to this long behind the newest one
+    holdFor: str = '31D'
+    # source files behind each held interval, and the intervals that received data in this run
+    sources: dict = field(default_factory=lambda:{},repr=False)
+    touched: set = field(default_factory=set,repr=False)
+    # samples in a complete interval, from the sample spacing of the data, intervals with fewer are incomplete
+    fullCount: int = 0
+    held: dict = field(default_factory=lambda:{},repr=False)
+
+    def blockStats(self,DataFrame):
+        # moments for every interval in a chunk, in one grouped pass per statistic
+        if self.variables is None:
+            variables = [c for c in DataFrame.columns if DataFrame[c].dtype.kind in 'biuf' and c not in self.exclude]
+        else:
+            variables = [c for c in self.variables if c in DataFrame.columns]
+        data = DataFrame[variables].astype('float64')
+        labels = self.labels(DataFrame)
+        grouped = data.groupby(labels)
+        n = grouped.count()
+        mean = grouped.mean()
+        stats = {
+            'n':n,
+            'mean':mean,
+            'M2':grouped.var(ddof=0).mul(n),
+            'min':grouped.min(),
+            'max':grouped.max(),
+            }
+        for a,b in self.covariances:
+            if a not in data.columns or b not in data.columns:
+                continue
+            pair = data[[a,b]].dropna()
+            pair['ab'] = pair[a]*pair[b]
+            g = pair.groupby(labels[data[a].notna().values & data[b].notna().values]).agg(['count','mean'])
+            nab = g[(a,'count')]
+            stats[(a,b)] = pd.DataFrame({
+                'n':nab,
+                'meanA':g[(a,'mean')],
+                'meanB':g[(b,'mean')],
+                'C':(g[('ab','mean')]-g[(a,'mean')]*g[(b,'mean')])*nab,
+                })
+        return(stats)
+
+    def labels(self,DataFrame):
+        # the interval (end time) of each row
+        return(DataFrame.index.ceil(self.interval))
+
+    def combine(self,x,y):
+        # merge partial statistics of the same intervals
+        out = {}
+        n = x['n'].add(y['n'],fill_value=0)
+        nx,ny = x['n'].reindex_like(n).fillna(0),y['n'].reindex_like(n).fillna(0)
+        mx,my = x['mean'].reindex_like(n),y['mean'].reindex_like(n)
+        delta = my-mx
+        out['n'] = n
+        out['mean'] = (mx*nx).add(my*ny,fill_value=0).div(n)
+        out['M2'] = x['M2'].add(y['M2'],fill_value=0).add((delta**2*nx*ny/n).fillna(0))
+        out['min'] = pd.concat([x['min'],y['min']]).groupby(level=0).min()
+        out['max'] = pd.concat([x['max'],y['max']]).groupby(level=0).max()
+        for key in [k for k in x if type(k) is tuple]:
+            if key not in y:
+                out[key] = x[key]
+                continue
+            cx,cy = x[key],y[key]
+            idx = cx.index.union(cy.index)
+            cx,cy = cx.reindex(idx),cy.reindex(idx)
+            nxy = cx['n'].fillna(0)+cy['n'].fillna(0)
+            out[key] = pd.DataFrame({
+                'n':nxy,
+                'meanA':(cx['meanA']*cx['n']).fillna(0).add((cy['meanA']*cy['n']).fillna(0)).div(nxy),
+                'meanB':(cx['meanB']*cx['n']).fillna(0).add((cy['meanB']*cy['n']).fillna(0)).div(nxy),
+                'C':cx['C'].fillna(0)+cy['C'].fillna(0)+((cy['meanA']-cx['meanA'])*(cy['meanB']-cx['meanB'])*cx['n']*cy['n']/nxy).fillna(0),
+                })
+        for key in [k for k in y if type(k) is tuple and k not in x]:
+            out[key] = y[key]
+        return(out)
+
+    def subset(self,stats,labels,keep=True):
+        return({k:v.loc[v.index.isin(labels)==keep] for k,v in stats.items()})
+
+    def update(self,DataFrame,source=None):
+        # add a chunk and return the completed intervals
+        if DataFrame.empty:
+            return(pd.DataFrame())
+        DataFrame = DataFrame.sort_index()
+        stats = self.blockStats(DataFrame)
+        labels = stats['n'].index
+        steps = DataFrame.index.to_series().diff()
+        steps = steps[steps > pd.Timedelta(0)]
+        if len(steps):
+            self.fullCount = max(self.fullCount,int(pd.Timedelta(self.interval)/steps.median()))
+        # the first and last intervals of a chunk may continue in another chunk, intervals restored from the last run continue here
+        edges = labels[[0,-1]].unique().union(labels[labels.isin(list(self.pending))])
+        for label in edges:
+            edge = self.subset(stats,[label])
+            self.pending[label] = self.combine(self.pending[label],edge) if label in self.pending else edge
+            self.sources.setdefault(label,set()).add(source)
+            self.touched.add(label)
+        return(self.finalize(self.subset(stats,edges,keep=False)))
+
+    def flush(self):
+        # return the intervals held in this run, those still incomplete are kept for the next (see record)
+        # restored intervals that received no data are already stored as they are, so they are only kept
+        newest = max(self.pending,default=None)
+        self.held = {label:stats for label,stats in self.pending.items()
+                     if int(stats['n'].max(axis=1).max()) < self.fullCount and label >= newest-pd.Timedelta(self.holdFor)}
+        pending = [stats for label,stats in self.pending.items() if label in self.touched]
+        self.pending,self.touched = {},set()
+        self.sources = {label:self.sources.get(label,set()) for label in self.held}
+        if not pending:
+            return(pd.DataFrame())
+        stats = pending[0]
+        for p in pending[1:]:
+            stats = {k:pd.concat([stats[k],p[k]]) if k in stats and k in p else stats.get(k,p.get(k)) for k in set(stats)|set(p)}
+        return(self.finalize(stats))
+
+    def record(self):
+        # the intervals held by the last flush as plain values, for restore in a later run
+        held = {}
+        for label,stats in self.held.items():
+            held[label.isoformat()] = {
+                'sources':sorted(source for source in self.sources.get(label,[]) if source),
+                'moments':{key:stats[key].iloc[0].to_dict() for key in ['n','mean','M2','min','max']},
+                'covariances':[[*key,stats[key].iloc[0].to_dict()] for key in stats if type(key) is tuple],
+                }
+        return({'interval':self.interval,'fullCount':self.fullCount,'held':held})
+
+    def restore(self,record,exclude=()):
+        # hold the intervals of an earlier record again, except those with a source file in exclude (parsed again in full)
+        if not record or record.get('interval') != self.interval:
+            return
+        self.fullCount = max(self.fullCount,record['fullCount'])
+        for key,held in record['held'].items():
+            if set(exclude).intersection(held['sources']):
+                continue
+            label = pd.Timestamp(key)
+            index = pd.DatetimeIndex([label])
+            self.pending[label] = {name:pd.DataFrame([values],index=index) for name,values in held['moments'].items()}
+            for a,b,values in held['covariances']:
+                self.pending[label][(a,b)] = pd.DataFrame([values],index=index)
+            self.sources[label] = set(held['sources'])
+
+    def finalize(self,stats):
+        # convert moments to the output statistics, one column per variable and statistic
+        if stats['n'].empty:
+            return(pd.DataFrame())
+        n = stats['n']
+        out = {}
+        for var in n.columns:
+            if 'mean' in self.statistics:
+                out[f'{var}_mean'] = stats['mean'][var]
+            if 'variance' in self.statistics:
+                out[f'{var}_variance'] = stats['M2'][var]/(n[var]-1).where(n[var]>1)
+            if 'min' in self.statistics:
+                out[f'{var}_min'] = stats['min'][var]
+            if 'max' in self.statistics:
+                out[f'{var}_max'] = stats['max'][var]
+            if 'count' in self.statistics:
+                out[f'{var}_count'] = n[var]
+        for key in [k for k in stats if type(k) is tuple]:
+            c = stats[key]
+            out[f'{key[0]}_{key[1]}_covariance'] = c['C']/(c['n']-1).where(c['n']>1)
+        out = pd.DataFrame(out).sort_index()
+        out.index.name = 'TIMESTAMP'
+        return(out)
+
+    def variableMap(self,DataFrame,sourceMap={}):
+        # entries for the aggregated columns, units are carried over from the source variables where possible
+        vm = {}
+        for col in DataFrame.columns:
+            var,stat = col.rsplit('_',1)
+            unit = sourceMap.get(var,{}).get('unit')
+            vm[col] = {'dtype':'float32','ignore':False,'unit':unit,'variableDescription':f'{self.interval} {stat} of {var}'}
+        return(vm)
@@ -0,0 +1,295 @@
+######################################################################################################################
+# Column files of a database year folder
+######################################################################################################################
+# Columns are written to temporary files and moved into place with an atomic rename, so readers never see a partial file
+# A write is committed by a journal (_commit.json) listing its renames: a write interrupted before the journal is
+# rolled back (its temporary files are removed), one interrupted after it is rolled forward, the next time the lock is taken
+# A lock file serializes writers of the same year folder across threads and processes, readers don't take it but
+# retry a read that overlapped a commit (consistentRead)
+# The size and crc32 of each column are kept in _checksums.json, so truncated or interrupted writes are caught on read
+# Storage backends: raw (default) writes the array as is, chunked compresses fixed-size runs of rows (zlib or lzma)
+# and records the byte offset of each chunk so a time window only decompresses the chunks it touches
+from dataclasses import dataclass,field
+from parseFiles.helperFunctions.log import log
+import threading
+import socket
+import json
+import time
+import zlib
+import lzma
+import os
+import numpy as np
+
+checksumFile = '_checksums.json'
+journalFile = '_commit.json'
+
+@dataclass(kw_only=True)
+class yearLock:
+    # held while a year folder is read, merged, and rewritten
+    path: str
+    timeout: float = 600
+    # a lock older than this (seconds), or held by a process that no longer exists, is broken
+    staleAfter: float = 3600
+    poll: float = 0.05
+    verbose: bool = False
+    token: str = field(default=None,repr=False)
+
+    def __post_init__(self):
+        self.lockFile = os.path.join(self.path,'.lock')
+
+    def __enter__(self):
+        self.acquire()
+        return(self)
+
+    def __exit__(self,*args):
+        self.release()
+
+    def acquire(self):
+        os.makedirs(self.path,exist_ok=True)
+        token = f'{socket.gethostname()} {os.getpid()} {threading.get_ident()} {time.time()}'
+        deadline = time.monotonic()+self.timeout
+        while True:
+            try:
+                fd = os.open(self.lockFile,os.O_CREAT|os.O_EXCL|os.O_WRONLY)
+            except FileExistsError:
+                if self.stale():
+                    continue
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f'Could not lock {self.path} within {self.timeout}s, held by: {self.holder()}')
+                time.sleep(self.poll)
+                continue
+            with os.fdopen(fd,'w') as f:
+                f.write(token)
+            self.token = token
+            # finish a committed write, any other temporary files are left over from a write that never committed
+            rollForward(self.path)
+            for f in os.listdir(self.path):
+                if f.endswith('.tmp'):
+                    os.remove(os.path.join(self.path,f))
+            return
+
+    def release(self):
+        if self.token is not None and self.holder() == self.token:
+            os.remove(self.lockFile)
+        self.token = None
+
+    def holder(self):
+        try:
+            with open(self.lockFile) as f:
+                return(f.read())
+        except FileNotFoundError:
+            return(None)
+
+    def stale(self):
+        holder = self.holder()
+        try:
+            age = time.time()-os.path.getmtime(self.lockFile)
+        except FileNotFoundError:
+            return(True)
+        try:
+            host,pid = holder.split()[:2]
+            dead = host == socket.gethostname() and not pidExists(int(pid))
+        except (AttributeError,ValueError):
+            # the holder may still be writing its token
+            dead = False
+        if not dead and age < self.staleAfter:
+            return(False)
+        log(f'Breaking stale lock on {self.path}: {holder}',ln=False,verbose=self.verbose)
+        # only remove the lock that was judged stale, not one taken in the meantime
+        if self.holder() == holder:
+            try:
+                os.remove(self.lockFile)
+            except FileNotFoundError:
+                pass
+        return(True)
+
+def pidExists(pid):
+    import psutil
+    return(psutil.pid_exists(pid))
+
+def readChecksums(path):
+    fname = os.path.join(path,checksumFile)
+    if not os.path.isfile(fname):
+        return({})
+    with open(fname) as f:
+        return(json.load(f))
+
+def storageBackend(storage=None):
+    # pick a storage backend from a measurement's storage settings, e.g., {'format':'chunked','codec':'lzma'}
+    storage = dict(storage or {})
+    format = storage.pop('format','raw')
+    if format == 'raw':
+        return(rawBackend(**storage))
+    elif format == 'chunked':
+        return(chunkedBackend(**storage))
+    raise ValueError(f'Unknown storage format: {format}')
+
+def backendOf(entry):
+    # the backend a column was written with, columns without an entry are raw
+    entry = entry or {}
+    if entry.get('format','raw') == 'raw':
+        return(rawBackend())
+    return(chunkedBackend(codec=entry['codec'],chunkRows=entry['chunkRows']))
+
+@dataclass(kw_only=True)
+class rawBackend:
+    def encode(self,values):
+        return(values,{'bytes':values.nbytes,'crc32':zlib.crc32(values)})
+
+    def decode(self,fname,dtype,entry=None):
+        values = np.fromfile(fname,dtype=dtype)
+        if entry and (values.nbytes != entry['bytes'] or zlib.crc32(values) != entry['crc32']):
+            raise ValueError(f'{fname} does not match its checksum ({values.nbytes} of {entry["bytes"]} bytes), the last write may have been interrupted')
+        return(values)
+
+    def window(self,fname,dtype,entry,first,last):
+        return(np.memmap(fname,dtype=dtype,mode='r')[first:last])
+
+codecs = {
+    'zlib':(lambda data,level:zlib.compress(data,level),zlib.decompress),
+    'lzma':(lambda data,level:lzma.compress(data,preset=level),lzma.decompress),
+    }
+
+def gridChunkRows(step=None,targetBytes=131072,itemsize=8):
+    # rows per chunk for a grid step (ns): about targetBytes uncompressed, in whole days, hours, minutes, or seconds of the grid
+    # e.g., 16368 rows (341 days) of 30 minute data, 15840 (11 days) of 1 minute data, or 16200 (27 minutes) of 10 Hz data
+    rows = max(1,targetBytes//itemsize)
+    for unit in [86400,3600,60,1] if step else []:
+        perUnit = unit*10**9//step
+        if perUnit and unit*10**9 % step == 0 and perUnit <= rows:
+            return(rows//perUnit*perUnit)
+    return(rows)
+
+@dataclass(kw_only=True)
+class chunkedBackend:
+    codec: str = 'zlib'
+    # rows per chunk, None for about 128 KiB of float64 (databaseFolder fills it from its grid, see gridChunkRows)
+    chunkRows: int = None
+    level: int = 6
+
+    def __post_init__(self):
+        if self.codec not in codecs:
+            raise ValueError(f'Unknown codec: {self.codec}, use one of {list(codecs)}')
+        if not self.chunkRows:
+            self.chunkRows = gridChunkRows()
+
+    def encode(self,values):
+        compress = codecs[self.codec][0]
+        chunks = [compress(values[i:i+self.chunkRows].tobytes(),self.level) for i in range(0,len(values),self.chunkRows)]
+        data = b''.join(chunks)
+        offsets = np.cumsum([0]+[len(chunk) for chunk in chunks]).tolist()
+        return(np.frombuffer(data,dtype='uint8'),{'format':'chunked','codec':self.codec,'chunkRows':self.chunkRows,'rows':len(values),
+                                                  'offsets':offsets,'bytes':len(data),'crc32':zlib.crc32(data)})
+
+    def decode(self,fname,dtype,entry):
+        with open(fname,'rb') as f:
+            data = f.read()
+        if len(data) != entry['bytes'] or zlib.crc32(data) != entry['crc32']:
+            raise ValueError(f'{fname} does not match its checksum ({len(data)} of {entry["bytes"]} bytes), the last write may have been interrupted')
+        return(self.chunks(data,dtype,entry,0,len(entry['offsets'])-1))
+
+    def window(self,fname,dtype,entry,first,last):
+        # read and decompress only the chunks that overlap rows first:last
+        first,last = min(first,entry['rows']),min(last,entry['rows'])
+        if last <= first:
+            return(np.array([],dtype=dtype))
+        c0,c1 = first//self.chunkRows,(last-1)//self.chunkRows+1
+        with open(fname,'rb') as f:
+            f.seek(entry['offsets'][c0])
+            data = f.read(entry['offsets'][c1]-entry['offsets'][c0])
+        offset = c0*self.chunkRows
+        return(self.chunks(data,dtype,entry,c0,c1,entry['offsets'][c0])[first-offset:last-offset])
+
+    def chunks(self,data,dtype,entry,c0,c1,base=0):
+        decompress = codecs[self.codec][1]
+        offsets = entry['offsets']
+        return(np.concatenate([np.frombuffer(decompress(data[offsets[c]-base:offsets[c+1]-base]),dtype=dtype) for c in range(c0,c1)]+[np.array([],dtype=dtype)]))
+
+def tempName(path,name):
+    return(os.path.join(path,f'.{name}.{os.getpid()}.{threading.get_ident()}.tmp'))
+
+def writeColumns(path,columns,storage=None,files=None,verbose=False):
+    # stage every column in a temporary file, commit them with the journal, then move them all into place
+    # files ({name: text}, e.g., the variable map) are committed with the columns
+    # the timestamps are always raw, so a time window is checked against the grid (or binary searched) from a memory map
+    os.makedirs(path,exist_ok=True)
+    checksums = readChecksums(path)
+    backend = storageBackend(storage)
+    staged = []
+    for name,values in columns.items():
+        fname = os.path.join(path,name)
+        log(f'Writing: {fname}',ln=False,verbose=verbose)
+        data,checksums[name] = (rawBackend() if name == 'POSIX_timestamp' else backend).encode(np.ascontiguousarray(values))
+        data.tofile(tempName(path,name))
+        staged.append((tempName(path,name),fname))
+    for name,text in (files or {}).items():
+        with open(tempName(path,name),'w') as f:
+            f.write(text)
+        staged.append((tempName(path,name),os.path.join(path,name)))
+    with open(tempName(path,checksumFile),'w') as f:
+        json.dump(checksums,f)
+    staged.append((tempName(path,checksumFile),os.path.join(path,checksumFile)))
+    with open(tempName(path,journalFile),'w') as f:
+        json.dump([[os.path.basename(tmp),os.path.basename(fname)] for tmp,fname in staged],f)
+    os.replace(tempName(path,journalFile),os.path.join(path,journalFile))
+    rollForward(path)
+    return(sum(checksums[name]['bytes'] for name in columns))
+
+def rollForward(path):
+    # complete the renames of a committed write, returns False if there was nothing to complete
+    try:
+        with open(os.path.join(path,journalFile)) as f:
+            staged = json.load(f)
+    except FileNotFoundError:
+        return(False)
+    for tmp,name in staged:
+        if os.path.exists(os.path.join(path,tmp)):
+            os.replace(os.path.join(path,tmp),os.path.join(path,name))
+    os.remove(os.path.join(path,journalFile))
+    return(True)
+
+def commitState(path):
+    # changes whenever a write is committed to path
+    try:
+        stat = os.stat(os.path.join(path,checksumFile))
+        return(stat.st_ino,stat.st_mtime_ns)
+    except FileNotFoundError:
+        return(None)
+
+def consistentRead(path,read,attempts=10):
+    # a read that overlapped a commit can pair new files with old checksums, it is retried once the commit is done
+    # a commit still in progress (or left by an interrupted write) is waited on (or rolled forward) by taking the lock
+    if os.path.exists(os.path.join(path,journalFile)):
+        with yearLock(path=path):
+            pass
+    for attempt in range(attempts):
+        state = commitState(path)
+        try:
+            return(read())
+        except ValueError:
+            committing = os.path.exists(os.path.join(path,journalFile))
+            if attempt == attempts-1 or (not committing and commitState(path) == state):
+                raise
+            if committing:
+                with yearLock(path=path):
+                    pass
+
+def readColumn(path,name,dtype,checksums=None):
+    # columns written before checksums were kept are read as is
+    entry = (checksums if checksums is not None else readChecksums(path)).get(name)
+    return(backendOf(entry).decode(os.path.join(path,name),dtype,entry))
+
+def columnRows(path,name,dtype,checksums):
+    # rows of a column without reading it, from its checksum entry or its size on disk
+    entry = checksums.get(name)
+    if entry and entry.get('format','raw') != 'raw':
+        return(entry['rows'])
+    return(os.path.getsize(os.path.join(path,name))//np.dtype(dtype).itemsize)
+
+def sliceColumn(path,name,dtype,checksums,first,last):
+    # rows first:last of a column, raw columns are memory-mapped and only get a size check
+    fname = os.path.join(path,name)
+    entry = checksums.get(name)
+    if entry and os.path.getsize(fname) != entry['bytes']:
+        raise ValueError(f'{fname} is {os.path.getsize(fname)} bytes, expected {entry["bytes"]}, the last write may have been interrupted')
+    return(backendOf(entry).window(fname,dtype,entry,first,last))
@@ -1,10 +1,18 @@
 import os
 import sys
 import copy
-# import fnmatch
+import zlib
+import json
+import hashlib
+import time
+import contextlib
+import itertools
+import fnmatch
+import threading
 from pathlib import Path
 from dataclasses import dataclass,field
 from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 from multiprocessing import Pool
 
 import numpy as np
@@ -13,18 +21,213 @@ import pandas as pd
 
 
 import rawDataFile
+from blockAggregator import blockAggregator
+import mergeEngine
+import columnStore
+from ingestScheduler import ingestScheduler
+from ingestMetrics import ingestMetrics,rates,addCounts,peakRSS
+from memoryBudget import memoryBudget,deferred
+from metadataStore import metadataStore
+from sourceCatalog import sourceCatalog
 
 from siteInventory import siteInventory
 from siteInventory import sourceRecord
+from siteInventory import safeFormat
+from siteInventory import discoveryIndex
+from siteInventory import siteMap
 from parseFiles.helperFunctions.log import log
 from parseFiles.helperFunctions.loadDict import loadDict
-from parseFiles.helperFunctions.saveDict import saveDict
 from parseFiles.helperFunctions.asdict_repr import asdict_repr
 
 import datetime
 import yaml
 
 
+# storage partitions of a measurement folder and the pandas period of each
+partitionPeriods = {'year':'Y','month':'M','day':'D'}
+partitionFolders = {'Y':'%Y','M':'%Y/%m','D':'%Y/%m/%d'}
+# most slots a partition can hold, partitions are merged in blocks of float64 columns, so 2**22 slots is 32 MB per column
+maxPartitionSlots = 2**22
+
+def utcIndex(index):
+    # timezone aware indexes are converted to naive UTC, so partitions are assigned in the same time as the grid slots
+    if index.tz is not None:
+        index = index.tz_convert('UTC').tz_localize(None)
+    return(index)
+
+def gridPartition(index,frequency='30min',partition='year'):
+    # the partition (year, month, or day period, UTC) of each timestamp
+    # timestamps mark the end of an interval, so each partition holds (start, end] and 00:00 on Jan 1 belongs to the year before
+    return((utcIndex(index).ceil(frequency)-pd.Timedelta(frequency)).to_period(partitionPeriods[partition]))
+
+def partitionRange(part):
+    # start and end (ns since epoch) of a year (int) or a partition (pd.Period)
+    if isinstance(part,pd.Period):
+        return(part.start_time.value,(part+1).start_time.value)
+    return(pd.Timestamp(str(part)).value,pd.Timestamp(str(part+1)).value)
+
+def partitionFolder(path,part):
+    # <path>/<year>, <path>/<year>/<month>, or <path>/<year>/<month>/<day>
+    if not isinstance(part,pd.Period):
+        return(os.path.join(path,str(part)))
+    return(os.path.join(path,*part.strftime(partitionFolders[part.freqstr[0]]).split('/')))
+
+def yearPartitions(years,partition='year'):
+    # every partition of a list of years
+    return([part for year in years for part in pd.period_range(f'{year}-01-01',f'{year}-12-31',freq=partitionPeriods[partition])])
+
+def isStored(folder):
+    # a partition is on disk once its _variableMap.yml and POSIX_timestamp are
+    return(os.path.isfile(os.path.join(folder,'_variableMap.yml')) and os.path.isfile(os.path.join(folder,'POSIX_timestamp')))
+
+def utcTimestamp(value):
+    # a naive UTC timestamp, for start and end arguments given with or without a timezone
+    value = pd.Timestamp(value)
+    if value.tz is not None:
+        value = value.tz_convert('UTC').tz_localize(None)
+    return(value)
+
+def partitionsBetween(partition,start,end):
+    # every partition holding a timestamp in [start, end] (UTC), by arithmetic rather than from the folders
+    # a partition holds (partition start, partition end], so the first and last are those holding the instant before start and before end
+    first,last = [pd.Period(utcTimestamp(value)-pd.Timedelta(1,'ns'),freq=partitionPeriods[partition]) for value in [start,end]]
+    return(list(pd.period_range(first,last)) if first <= last else [])
+
+def storedPartitions(path,partition=None,start=None,end=None):
+    # partitions on disk between start and end (UTC, either can be open) in year, year/month, or year/month/day folders
+    # given the partition setting and both ends, only the partitions in between are checked, so the cost follows the window rather than the archive
+    if partition is not None and start is not None and end is not None:
+        return([part for part in partitionsBetween(partition,start,end) if isStored(partitionFolder(path,part))])
+    first = (utcTimestamp(start)-pd.Timedelta(1,'ns')).year if start is not None else None
+    last = (utcTimestamp(end)-pd.Timedelta(1,'ns')).year if end is not None else None
+    found = []
+    def walk(folder,names):
+        if names and isStored(folder):
+            found.append(pd.Period('-'.join(names),freq='YMD'[len(names)-1]))
+        elif len(names) < 3 and os.path.isdir(folder):
+            for name in os.listdir(folder):
+                # year folders outside the window are not walked
+                if name.isdigit() and (names or ((first is None or int(name) >= first) and (last is None or int(name) <= last))):
+                    walk(os.path.join(folder,name),names+[name])
+    walk(path,[])
+    ranges = [(part,*partitionRange(part)) for part in sorted(found,key=lambda part:part.start_time)]
+    return([part for part,lo,hi in ranges
+            if (end is None or lo < utcTimestamp(end).value) and (start is None or hi >= utcTimestamp(start).value)])
+
+def storedSetting(path):
+    # the POSIX_timestamp entry of the data in a measurement folder, None if nothing is stored
+    # a folder cannot mix grids or partitions, so the walk stops at the first partition and reads only its map
+    def walk(folder,depth):
+        for name in sorted(name for name in os.listdir(folder) if name.isdigit()):
+            sub = os.path.join(folder,name)
+            if isStored(sub):
+                return(sub)
+            found = walk(sub,depth+1) if depth < 2 and os.path.isdir(sub) else None
+            if found is not None:
+                return(found)
+        return(None)
+    found = walk(path,0) if os.path.isdir(path) else None
+    if found is None:
+        return(None)
+    # folders written before partitions were configurable are by year
+    return({'partition':'year'}|loadDict(os.path.join(found,'_variableMap.yml'))['POSIX_timestamp'])
+
+def gridSize(part,frequency='30min'):
+    # number of slots in the (start, end] grid of a year or partition
+    first,last = partitionRange(part)
+    return((last-first)//pd.Timedelta(frequency).value)
+
+def partitionSlots(partition,frequency='30min'):
+    # slots in the longest partition of a kind (a leap year, a 31 day month, a day)
+    return(gridSize(pd.Period('2024-01-01',freq=partitionPeriods[partition]),frequency))
+
+def defaultPartition(frequency='30min'):
+    # the longest partition that fits maxPartitionSlots, e.g., year for 30min or 1min grids, day for a 50ms (20 Hz) grid
+    fits = [partition for partition in partitionPeriods if partitionSlots(partition,frequency) <= maxPartitionSlots]
+    return(fits[0] if fits else 'day')
+
+def gridTimestamps(part,frequency='30min'):
+    # POSIX timestamps (s) of the (start, end] grid of a year or partition, slot i ends at start+(i+1)*step
+    step = pd.Timedelta(frequency).value
+    return((partitionRange(part)[0]+(np.arange(gridSize(part,frequency),dtype='int64')+1)*step)/1e9)
+
+def gridSlots(t,part,frequency='30min'):
+    # slot of each timestamp (int64 ns since epoch) in the (start, end] grid of a year or partition by integer arithmetic
+    # -1 marks timestamps that are off the grid or outside the partition
+    step = pd.Timedelta(frequency).value
+    offset = np.asarray(t,dtype='int64')-partitionRange(part)[0]
+    slots = offset//step-1
+    return(np.where((offset%step == 0) & (slots >= 0) & (slots < gridSize(part,frequency)),slots,-1))
+
+def toNanoseconds(index):
+    # int64 ns since epoch (UTC) for a DatetimeIndex
+    return(utcIndex(index).as_unit('ns').asi8)
+
+def gridWindow(part,frequency,start=None,end=None):
+    # slots first:last of the (start, end] grid of a partition with timestamps in [start, end] (UTC), by integer arithmetic
+    step,origin,size = pd.Timedelta(frequency).value,partitionRange(part)[0],gridSize(part,frequency)
+    first = 0 if start is None else min(max(-((origin-utcTimestamp(start).value)//step)-1,0),size)
+    last = size if end is None else min(max((utcTimestamp(end).value-origin)//step,first),size)
+    return(int(first),int(last))
+
+def partitionWindow(folder,part,vm,checksums,start=None,end=None):
+    # rows first:last of a partition between start and end (UTC), from the grid without reading the timestamps
+    dtype,frequency = vm['POSIX_timestamp']['dtype'],vm['POSIX_timestamp'].get('frequency')
+    head = columnStore.sliceColumn(folder,'POSIX_timestamp',dtype,checksums,0,1)
+    if (frequency and len(head) and columnStore.columnRows(folder,'POSIX_timestamp',dtype,checksums) == gridSize(part,frequency)
+        and head[0] == (partitionRange(part)[0]+pd.Timedelta(frequency).value)/1e9):
+        return(gridWindow(part,frequency,start,end))
+    # files written before the grid was fixed to (year, year+1], the timestamps are sorted so the window is found by binary search
+    timestamp = columnStore.sliceColumn(folder,'POSIX_timestamp',dtype,checksums,0,None)
+    first = 0 if start is None else np.searchsorted(timestamp,utcTimestamp(start).timestamp(),side='left')
+    last = len(timestamp) if end is None else np.searchsorted(timestamp,utcTimestamp(end).timestamp(),side='right')
+    return(int(first),int(last))
+
+def partitionColumns(folder,vm,variables=None):
+    # the timestamps and the stored variables of a partition (all by default)
+    return(['POSIX_timestamp']+[var for var in (variables if variables is not None else vm) if var in vm and var != 'POSIX_timestamp' and os.path.isfile(os.path.join(folder,var))])
+
+def partitionRows(path,part,variables=None,start=None,end=None):
+    # the variable map, stored variables, and number of rows between start and end (UTC) of one partition, without reading its columns
+    folder = partitionFolder(path,part)
+    def read():
+        vm = loadDict(os.path.join(folder,'_variableMap.yml'))
+        first,last = partitionWindow(folder,part,vm,columnStore.readChecksums(folder),start,end)
+        return(vm,partitionColumns(folder,vm,variables),max(last-first,0))
+    return(columnStore.consistentRead(folder,read))
+
+def partitionSlice(path,part,variables=None,start=None,end=None):
+    # return the rows of one partition between start and end (UTC) without reading the full columns
+    # raw columns are memory-mapped views, chunked columns only decompress the chunks in the window
+    folder = partitionFolder(path,part)
+    def read():
+        vm = loadDict(os.path.join(folder,'_variableMap.yml'))
+        checksums = columnStore.readChecksums(folder)
+        first,last = partitionWindow(folder,part,vm,checksums,start,end)
+        return(vm,{var:columnStore.sliceColumn(folder,var,vm[var]['dtype'],checksums,first,last) for var in partitionColumns(folder,vm,variables)})
+    # without the lock, see columnStore.consistentRead
+    return(columnStore.consistentRead(folder,read))
+
+def sourceAvailable(source):
+    # a source record with a rootPath that exists (e.g., not the template's, or a share that is not mounted)
+    return(bool(source.get('rootPath')) and os.path.isdir(source['rootPath']))
+
+@contextlib.contextmanager
+def released(lock=None):
+    # give up a held semaphore (e.g., a parse slot) for the duration of the block, e.g., while writing
+    if lock is None:
+        yield
+        return
+    lock.release()
+    try:
+        yield
+    finally:
+        lock.acquire()
+
+def recordHash(obj):
+    # content hash of a metadata record
+    return(hashlib.md5(json.dumps(obj,sort_keys=True,default=str).encode()).hexdigest())
+
 def now(fmt='%Y-%m-%dT%H:%M:%S',prefix='',suffix=''):
     return(f"{prefix}{datetime.datetime.now().strftime(fmt)}{suffix}")
 
@@ -37,19 +240,44 @@ class database:
     verbose: bool = False
     template: bool = True
     enableParallel: bool = True
+    nproc: int = None
+    batchImport: bool = True
+    hashBlocks: bool = False
+    # where the raw file inventory is kept: 'yaml' (sourceFiles.yml per measurement) or 'sqlite'
+    catalogBackend: str = 'yaml'
+    # default conflict policy when new data overlap stored values, see mergeEngine.mergePolicies
+    mergePolicy: str = 'keepExisting'
     loadNew: bool = True
     siteIDs: list = field(default_factory=lambda:[])
     Sites: dict = field(default_factory=lambda:{})
     projectInfo: dict = field(default_factory=lambda:yaml.safe_load(Path(os.path.join(os.path.dirname(os.path.abspath(__file__)),'config_files','databaseMetadata.yml')).read_text()))
+    pool: Pool = field(default=None,repr=False)
+    lock: threading.RLock = field(default_factory=threading.RLock,repr=False)
+    # staged metadata of this project, see metadataStore
+    store: metadataStore = field(default_factory=metadataStore,repr=False)
+    # per-stage timings and counts, see ingestMetrics
+    metrics: ingestMetrics = field(default_factory=lambda:ingestMetrics(),repr=False)
+    # skip the spatial stack (UTM projections, GeoDataFrames) and the site map, writeMap renders it on request
+    headless: bool = False
+    # most parsed data and merge blocks (bytes) held in memory at once across the ingest, parsing waits for writes beyond this (no limit if None)
+    maxInflightBytes: int = None
+    # most bytes of a chunked file's pieces staged for one write, partitions are merged in several writes past this (no limit if None)
+    maxStagedBytes: int = 256*2**20
+    budget: memoryBudget = field(default=None,repr=False)
+    workerPeakRSS: int = field(default=0,repr=False)
  
     def __post_init__(self):
+        if self.nproc is None:
+            self.nproc = max(1,os.cpu_count()-2)
+        self.budget = memoryBudget(maxBytes=self.maxInflightBytes)
         if self.projectPath:
             if not os.path.isdir(self.projectPath) or len(os.listdir(self.projectPath)) == 0:
                 self.makeNewProject()
             elif not os.path.isfile(os.path.join(self.projectPath,'projectInfo.yml')):
                 sys.exit('Non-empty, non-project directory provided')
             else:
-                self.projectInfo = loadDict(os.path.join(self.projectPath,'projectInfo.yml'))
+                self.projectInfo = self.store.load(os.path.join(self.projectPath,'projectInfo.yml'))
+            self.catalog = sourceCatalog(self.catalogBackend,self.projectPath,self.store)
             if type(self.siteIDs) != list:
                 self.siteIDs = [self.siteIDs]
             elif self.siteIDs == []:
@@ -62,6 +290,26 @@ class database:
             else:
                 if self.verbose:
                     log('No sites found in project, creating empty project inventory',ln=False)
+    def workerPool(self):
+        # one pool of parser processes, started on first use and reused across sites and measurements
+        if self.pool is None:
+            self.pool = Pool(processes=self.nproc)
+        return(self.pool)
+
+    def close(self):
+        self.flush()
+        self.catalog.close()
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self,*args):
+        self.close()
+
     def makeNewProject(self):
         # make a new database
         self.projectInfo['.dateCreated'] = now()
@@ -69,40 +317,57 @@ class database:
         for d in self.projectInfo:
             if not d.startswith('.'):
                 os.makedirs(os.path.join(self.projectPath,d))
+        self.save()
         
     def save(self,dictObj=None,filename=None,anchors=False):
-        # Saves projectInfo.yml and any other relevant metadata files
+        # Stages projectInfo.yml and any other relevant metadata files, they are written by flush
         if self.projectPath:
-            self.projectInfo['.dateModified'] = now()
-            saveDict(self.projectInfo,os.path.join(self.projectPath,'projectInfo.yml'),sort_keys=True,anchors=anchors)
-            if filename:
-                log(('Saving: ',filename),ln=False,verbose=self.verbose)
-                saveDict(dictObj,filename)
+            with self.lock:
+                self.projectInfo['.dateModified'] = now()
+                self.store.stage(self.projectInfo,os.path.join(self.projectPath,'projectInfo.yml'),sort_keys=True)
+                if filename:
+                    self.store.stage(dictObj,filename,anchors=anchors)
+
+    def flush(self):
+        # Write all staged metadata to disk
+        self.store.verbose = self.verbose
+        self.store.flush()
 
     def projectInventory(self,newSites={},fileSearch=None):
+        # Sites are only rebuilt and saved when their metadata changed since the last inventory, and measurements are
+        # only searched when their record, the directories under their sources, or their loaded files changed, see inventoryState
+        # loaded files are checked against a summary of their stats first, their catalog is only loaded if it differs
+        state = self.inventoryState()
         # Read existing sites
         for siteID in self.siteIDs:
-            self.Sites[siteID] = loadDict(os.path.join(self.projectPath,'Sites',siteID,f"{siteID}_metadata.yml"))
+            self.Sites[siteID] = self.store.load(os.path.join(self.projectPath,'Sites',siteID,f"{siteID}_metadata.yml"))
         # If given a file template for new sites
         if type(newSites) is str and os.path.isfile(newSites):
-            newSites = siteInventory(Sites=newSites).Sites
+            newSites = siteInventory(Sites=newSites,headless=self.headless).Sites
         # otherwise check for manual additions
         elif newSites == {}:
             additions = [siteID for siteID in os.listdir(os.path.join(self.projectPath,'Sites'))
                         if '.' not in siteID and siteID not in self.siteIDs]
             if additions != []:
-                newSites = {new:siteInventory(Sites=os.path.join(self.projectPath,'Sites',new,f"{new}_metadata.yml")).Sites for new in additions}
+                newSites = {new:siteInventory(Sites=os.path.join(self.projectPath,'Sites',new,f"{new}_metadata.yml"),headless=self.headless).Sites for new in additions}
         self.Sites = self.Sites | newSites
         if len(self.Sites)>1 and '.siteID' in self.Sites:
             self.Sites.pop('.siteID')
-        self.Sites = siteInventory(Sites=self.Sites)
-        self.spatialInventory = self.Sites.spatialInventory
-        self.webMap = self.Sites.mapTemplate
-        self.Sites = {siteID:self.Sites.Sites[siteID] for siteID in self.Sites.Sites}
+        changed = {siteID:values for siteID,values in self.Sites.items()
+                   if siteID in newSites or recordHash(values) != state['Sites'].get(siteID,{}).get('record')}
+        rebuilt = {}
+        if changed:
+            inventory = siteInventory(Sites=changed,headless=self.headless)
+            rebuilt = inventory.Sites
+            self.Sites = {siteID:values for siteID,values in self.Sites.items() if siteID not in changed} | rebuilt
+            for siteID,geojson in inventory.spatialInventory.get('geodataframes',{}).items():
+                state['Sites'].setdefault(siteID,{})['geojson'] = geojson
+        # the map is put together from the geojson kept for each site
+        geojson,self.webMap = siteMap([state['Sites'][siteID]['geojson'] for siteID in self.Sites if state['Sites'].get(siteID,{}).get('geojson')])
+        self.spatialInventory = {'geojson':geojson} if geojson else {}
 
         # save the inventory and make a webmap of sites
-        siteDF = pd.DataFrame()
-        for siteID,values in self.Sites.items():
+        for siteID,values in rebuilt.items():
             self.projectInfo['Sites'][siteID] = {
                 'Name':values['Name'],
                 'description':values['description'],
@@ -110,121 +375,692 @@ class database:
                 'longitude':values['longitude'],
             }
             self.save(values,os.path.join(self.projectPath,'Sites',siteID,f"{siteID}_metadata.yml"))
-            if self.loadNew:
-                for measurementID in values['Measurements']:
+        if self.loadNew:
+            jobs = [(siteID,measurementID) for siteID,values in self.Sites.items() for measurementID in values['Measurements']
+                    if self.searchNeeded(state,siteID,measurementID)]
+            failed = {}
+            if self.enableParallel and len(jobs)>1:
+                failed = ingestScheduler(db=self).run(jobs)
+            else:
+                for siteID,measurementID in jobs:
                     self.rawFileSearch(siteID,measurementID)
+            for siteID,measurementID in jobs:
+                # failed chains, files that failed to load, and sources that were never scanned keep the measurement on the list for the next inventory
+                measurementState = state['Sites'].setdefault(siteID,{}).setdefault('Measurements',{})
+                # files of a fileType without a parser can't be loaded, so they are summarized as they are now rather than as loaded
+                parsable = rawDataFile.parserRegistry.available(self.Sites[siteID]['Measurements'][measurementID]['fileType'])
+                if (siteID,measurementID) in failed or (parsable and self.catalog.pending(siteID,measurementID)) or not self.indexed(siteID,measurementID):
+                    measurementState.pop(measurementID,None)
+                else:
+                    indexes = self.discoveryIndexes(siteID,measurementID)
+                    measurementState[measurementID] = {'record':recordHash(self.Sites[siteID]['Measurements'][measurementID]),
+                                                       'discovery':self.discoveryHash(siteID,measurementID,indexes=indexes),
+                                                       'files':self.fileSummary(siteID,measurementID,self.catalog.load(siteID,measurementID) if parsable else None,indexes)}
+            if jobs:
+                self.reportMemory()
+        self.flush()
+        for siteID,values in self.Sites.items():
+            state['Sites'].setdefault(siteID,{})['record'] = recordHash(values)
+        self.saveInventoryState(state)
+        if not self.headless and (changed or not os.path.isfile(os.path.join(self.projectPath,'fieldSiteMap.html'))):
+            self.writeMap()
 
+    def writeMap(self):
+        # webmap of the sites, from the geojson of the last inventory
         with open(os.path.join(self.projectPath,'fieldSiteMap.html'),'w+') as out:
             out.write(self.webMap)
 
+    def inventoryState(self):
+        # content hashes of each site record, and of each measurement record and its discovery state, from the last inventory
+        fname = os.path.join(self.projectPath,'Sites','.inventoryState.json')
+        if os.path.isfile(fname):
+            with open(fname) as f:
+                return(json.load(f))
+        return({'Sites':{}})
+
+    def saveInventoryState(self,state):
+        fname = os.path.join(self.projectPath,'Sites','.inventoryState.json')
+        with open(fname+'.tmp','w') as f:
+            json.dump(state,f)
+        os.replace(fname+'.tmp',fname)
+
+    def indexFile(self,siteID,measurementID,matchPattern):
+        return(os.path.join(self.projectPath,'Sites',siteID,measurementID,f".fileIndex_{safeFormat(matchPattern)}_{zlib.crc32(matchPattern.encode()):08x}.json"))
+
+    def discoveryIndexes(self,siteID,measurementID):
+        # the saved directory index of each source of a measurement
+        return({matchPattern:discoveryIndex(indexFile=self.indexFile(siteID,measurementID,matchPattern),matchPattern=matchPattern,rootPath=source.get('rootPath'))
+                for matchPattern,source in self.Sites[siteID]['Measurements'][measurementID]['sourceFiles'].items()})
+
+    def discoveryHash(self,siteID,measurementID,current=False,indexes=None):
+        # the settings of each source and the directory mtimes its last scan saw (or their mtimes now)
+        indexes = indexes or self.discoveryIndexes(siteID,measurementID)
+        sources = {}
+        # a source that can't be scanned (no rootPath, or an unmounted share) has no directory state until it can
+        for matchPattern,source in self.Sites[siteID]['Measurements'][measurementID]['sourceFiles'].items():
+            sources[matchPattern] = [source,indexes[matchPattern].state(current) if sourceAvailable(source) else None]
+        return(recordHash(sources))
+
+    def fileSummary(self,siteID,measurementID,sourceInventory=None,indexes=None):
+        # file count, newest mtime, total size, and summed mtimes of the matching files in each source's directory index
+        # from a stat of each file now, or from the fingerprints they were loaded with (sourceInventory), None if any of them was not loaded
+        indexes = indexes or self.discoveryIndexes(siteID,measurementID)
+        summary = {}
+        for matchPattern,index in indexes.items():
+            sizes,mtimes = [],[]
+            fileList = (sourceInventory or {}).get(matchPattern,{}).get('fileList') or {}
+            for dir,entry in index.directories.items():
+                for name in entry['files']:
+                    path = os.path.join(dir,name)
+                    if not fnmatch.fnmatch(path,matchPattern):
+                        continue
+                    if sourceInventory is not None:
+                        if not fileList.get(path,{}).get('loaded') or 'fingerprint' not in fileList[path]:
+                            return(None)
+                        size,mtime = fileList[path]['fingerprint']['size'],fileList[path]['fingerprint']['mtime']
+                    else:
+                        try:
+                            stat = os.stat(path)
+                            size,mtime = stat.st_size,stat.st_mtime_ns
+                        except OSError:
+                            size,mtime = -1,-1
+                    sizes.append(size)
+                    mtimes.append(mtime)
+            summary[matchPattern] = [len(sizes),max(mtimes,default=0),sum(sizes),sum(mtimes)]
+        return(summary)
+
+    def indexed(self,siteID,measurementID):
+        # every source of a measurement that can be scanned has been, and its directory index saved
+        return(all(os.path.isfile(self.indexFile(siteID,measurementID,matchPattern)) or not sourceAvailable(source)
+                   for matchPattern,source in self.Sites[siteID]['Measurements'][measurementID]['sourceFiles'].items()))
+
+    def sourcesChanged(self,siteID,measurementID):
+        # loaded files that were appended to or modified, which doesn't change the mtime of their directory
+        sourceInventory = self.catalog.load(siteID,measurementID)
+        return(any(self.fileChanged(path,info)
+                   for source in sourceInventory.values() for path,info in (source.get('fileList') or {}).items()))
+
+    def searchNeeded(self,state,siteID,measurementID):
+        last = state['Sites'].get(siteID,{}).get('Measurements',{}).get(measurementID,{})
+        indexes = self.discoveryIndexes(siteID,measurementID)
+        if (last.get('record') != recordHash(self.Sites[siteID]['Measurements'][measurementID]) or
+            last.get('discovery') != self.discoveryHash(siteID,measurementID,current=True,indexes=indexes)):
+            return(True)
+        # the catalog is only loaded when the files under the sources no longer match the summary of the last inventory
+        files = self.fileSummary(siteID,measurementID,indexes=indexes)
+        if last.get('files') == files:
+            return(False)
+        if self.sourcesChanged(siteID,measurementID):
+            return(True)
+        # nothing changed (e.g., a state saved without a summary), so the files are as they were loaded
+        last['files'] = files
+        return(False)
+
+    def read(self,siteID,measurementIDs,variables=None,start=None,end=None,parallel=False):
+        # Read variables from one or more measurements of a site between start and end (UTC)
+        # variables can be a list (applied to every measurement) or a dict of lists by measurementID, measurements it leaves out are read in full
+        # the output arrays are sized from the grid rows between start/end, then each partition's rows are read into them in place
+        # with parallel, the partitions are read and copied in a thread pool
+        if type(measurementIDs) is str:
+            measurementIDs = [measurementIDs]
+        if type(variables) is str:
+            variables = [variables]
+        if type(variables) is not dict:
+            variables = {measurementID:variables for measurementID in measurementIDs}
+        elif unknown := [measurementID for measurementID in variables if measurementID not in measurementIDs]:
+            raise ValueError(f'variables given for {unknown}, which are not read, measurementIDs: {measurementIDs}')
+        frames = {}
+        for measurementID in measurementIDs:
+            started = time.perf_counter()
+            path = os.path.join(self.projectPath,'database',siteID,measurementID)
+            stored = storedSetting(path)
+            partitions = storedPartitions(path,stored['partition'],start,end) if stored else []
+            pooled = parallel and len(partitions)>1
+            with ThreadPoolExecutor(max_workers=min(len(partitions),self.nproc)) if pooled else contextlib.nullcontext() as executor:
+                mapped = executor.map if pooled else map
+                for attempt in range(10):
+                    dataOut,nRows = self.readPartitions(path,partitions,variables.get(measurementID),start,end,mapped)
+                    if dataOut is not None:
+                        break
+                else:
+                    raise RuntimeError(f'{path} kept changing while it was read')
+            index = pd.DatetimeIndex(pd.to_datetime(dataOut.pop('POSIX_timestamp',np.array([])),unit='s'),name='UTC')
+            frames[measurementID] = pd.DataFrame(dataOut,index=index)
+            self.metrics.emit('databaseRead',siteID=siteID,measurementID=measurementID,**rates(time.perf_counter()-started,{'rows':nRows,'bytesRead':sum(values.nbytes for values in dataOut.values())+index.nbytes}))
+        # join on the shared UTC index, prefixing any variable names that occur in more than one measurement
+        counts = pd.Series([c for frame in frames.values() for c in frame.columns]).value_counts()
+        for measurementID,frame in frames.items():
+            frame.columns = [f"{measurementID}.{c}" if counts[c]>1 else c for c in frame.columns]
+        if not frames:
+            return(pd.DataFrame())
+        dataOut = pd.concat(frames.values(),axis=1,join='outer').sort_index()
+        dataOut.index.name = 'UTC'
+        return(dataOut)
+
+    def readPartitions(self,path,partitions,variables,start,end,mapped=map):
+        # size the output from the rows each partition has between start and end, then read and copy each partition into it
+        # None if a partition changed size in between (a concurrent write re-gridded it)
+        layouts = list(mapped(partial(partitionRows,path,variables=variables,start=start,end=end),partitions))
+        # preallocate one array per variable, partitions missing a variable are left as NaN
+        dtypes = {}
+        for vm,columns,rows in layouts:
+            for var in columns:
+                dtypes.setdefault(var,np.dtype(vm[var]['dtype']))
+        offsets = np.cumsum([0]+[rows for _,_,rows in layouts])
+        dataOut = {var:np.full(offsets[-1],np.nan,dtype=dtype if dtype.kind == 'f' else 'float64') for var,dtype in dtypes.items()}
+        def fill(i):
+            vm,columns = partitionSlice(path,partitions[i],variables,start,end)
+            if len(columns['POSIX_timestamp']) != offsets[i+1]-offsets[i]:
+                return(False)
+            for var,values in columns.items():
+                if var in dataOut:
+                    dataOut[var][offsets[i]:offsets[i+1]] = values
+            return(True)
+        if not all(list(mapped(fill,range(len(partitions))))):
+            return(None,0)
+        return(dataOut,int(offsets[-1]))
+
+    def reportMemory(self):
+        # peak resident memory of this process and of the parser workers, and the most parsed data held at once
+        usage = {'peakRSS':peakRSS(),'workerPeakRSS':self.workerPeakRSS,'peakInflightBytes':self.budget.peak,'maxInflightBytes':self.maxInflightBytes}
+        self.metrics.emit('ingestMemory',**usage)
+        log(f"Peak RSS: {usage['peakRSS']/1e6:.0f} MB, parser workers: {usage['workerPeakRSS']/1e6:.0f} MB, parsed data held at once: {usage['peakInflightBytes']/1e6:.0f} MB",ln=False,verbose=self.verbose)
+        return(usage)
+
     def rawFileSearch(self,siteID=None,measurementID=None,kwargs={}):
-        soureFiles_alias = self.Sites[siteID]['Measurements'][measurementID]['sourceFiles']
-        sourceInventory = loadDict(
-            os.path.join(self.projectPath,'Sites',siteID,measurementID,'sourceFiles.yml'),
-            template={sourceRecord.matchPattern:asdict_repr(sourceRecord(),repr=None)},
-            verbose=False
-            )
-        if 'matchPattern' in kwargs and kwargs['matchPattern'] not in sourceInventory:
-            sourceInventory[kwargs['matchPattern']] = kwargs
-        for result in map(lambda values: sourceRecord(**values),sourceInventory.values()):
-            result.__find_files__()
-            sourceInventory[result.matchPattern] = asdict_repr(result,repr=None)
-            soureFiles_alias[result.matchPattern] = asdict_repr(result)
-        if len(soureFiles_alias)>1 and sourceRecord.matchPattern in soureFiles_alias:
-            soureFiles_alias.pop(sourceRecord.matchPattern)
-        if len(sourceInventory)>1 and sourceRecord.matchPattern in sourceInventory:
-            sourceInventory.pop(sourceRecord.matchPattern)
-        addendum = ([k for k in soureFiles_alias.keys() if k not in sourceInventory.keys()])
-        for a in addendum:
-            sourceInventory[a] = copy.deepcopy(soureFiles_alias[a])
-        self.rawFileImport(siteID,measurementID,sourceInventory)
-        self.save(self.Sites[siteID],os.path.join(self.projectPath,'Sites',siteID,f"{siteID}_metadata.yml"))
-        self.save(sourceInventory,os.path.join(self.projectPath,'Sites',siteID,measurementID,'sourceFiles.yml'))
-
-    def rawFileImport(self,siteID,measurementID,sourceInventory):
+        with self.metrics.timed('rawFileSearch',siteID=siteID,measurementID=measurementID) as counts:
+            sourceInventory = self.rawFileDiscover(siteID,measurementID,kwargs)
+            self.rawFileImport(siteID,measurementID,sourceInventory,counts=counts)
+            self.save(self.Sites[siteID],os.path.join(self.projectPath,'Sites',siteID,f"{siteID}_metadata.yml"))
+            self.flush()
+
+    def rawFileDiscover(self,siteID=None,measurementID=None,kwargs={}):
+        # find new source files for a measurement and return its source inventory
+        with self.metrics.timed('rawFileDiscover',siteID=siteID,measurementID=measurementID) as counts:
+            soureFiles_alias = self.Sites[siteID]['Measurements'][measurementID]['sourceFiles']
+            # the file lists hold the files this search looks at, all of those on record for the yaml catalog (see sourceCatalog)
+            sourceInventory = self.catalog.sources(siteID,measurementID,
+                template={sourceRecord.matchPattern:asdict_repr(sourceRecord(),repr=None)},
+                )
+            if 'matchPattern' in kwargs and kwargs['matchPattern'] not in sourceInventory:
+                sourceInventory[kwargs['matchPattern']] = kwargs
+            for matchPattern,source in sourceInventory.items():
+                # a catalog can hold files for a source whose record was never saved
+                if 'rootPath' not in source and matchPattern in soureFiles_alias:
+                    sourceInventory[matchPattern] = {k:v for k,v in soureFiles_alias[matchPattern].items() if k != 'fileList'}|source
+            for result in map(lambda values: sourceRecord(**values),sourceInventory.values()):
+                newFiles = result.__find_files__(indexFile=self.indexFile(siteID,measurementID,result.matchPattern),known=self.catalog.known(siteID,measurementID,result.matchPattern))
+                self.catalog.upsertFiles(siteID,measurementID,result.matchPattern,{f:result.fileList[f] for f in newFiles})
+                result.fileList.update(self.catalog.candidates(siteID,measurementID,result.matchPattern,self.fileChanged))
+                addCounts(counts,{'files':len(newFiles)})
+                sourceInventory[result.matchPattern] = asdict_repr(result,repr=None)
+                with self.lock:
+                    soureFiles_alias[result.matchPattern] = asdict_repr(result)
+            with self.lock:
+                if len(soureFiles_alias)>1 and sourceRecord.matchPattern in soureFiles_alias:
+                    soureFiles_alias.pop(sourceRecord.matchPattern)
+            if len(sourceInventory)>1 and sourceRecord.matchPattern in sourceInventory:
+                sourceInventory.pop(sourceRecord.matchPattern)
+            addendum = ([k for k in soureFiles_alias.keys() if k not in sourceInventory.keys()])
+            for a in addendum:
+                sourceInventory[a] = copy.deepcopy(soureFiles_alias[a])
+        return(sourceInventory)
+
+    def fileChanged(self,path,sourceInfo):
+        # a file on record that is to be parsed: not loaded yet, appended to, or modified
+        return(rawDataFile.fileStatus(path,dict(sourceInfo),self.hashBlocks) in ['new','appended','modified'])
+
+    def rawFileImport(self,siteID,measurementID,sourceInventory,executor=None,counts=None,parseLimit=None):
+        # parse -> merge/write -> record, the one order of the ingest stages (see also ingestScheduler)
+        # parseLimit: a semaphore held while parsing only, the writes run after it is released
+        with self.metrics.timed('rawFileImport',siteID=siteID,measurementID=measurementID) as imported:
+            with parseLimit or contextlib.nullcontext():
+                batch,parsed,held = self.rawFileParse(siteID,measurementID,sourceInventory,imported,parseLimit)
+            # only flag the files as loaded once their data are written
+            self.batchWrite(siteID,measurementID,batch,executor)
+            self.saveSourceInventory(siteID,measurementID,sourceInventory,parsed)
+            # saved last, an interrupted run loses the held moments rather than counting a file twice
+            if held is not None:
+                self.saveHeldBlocks(siteID,measurementID,held)
+        if counts is not None:
+            addCounts(counts,imported)
+
+    def saveSourceInventory(self,siteID,measurementID,sourceInventory,updates=None):
+        # record the state of a measurement's source files in the catalog, updates are the sourceInfo of files that were written
+        for matchPattern,files in (updates or {}).items():
+            sourceInventory[matchPattern].setdefault('fileList',{}).update(files)
+            self.catalog.upsertFiles(siteID,measurementID,matchPattern,files)
+        self.catalog.save(siteID,measurementID,sourceInventory)
+        self.save()
+
+    def rawFileParse(self,siteID,measurementID,sourceInventory,counts=None,parseLimit=None):
+        # parse new and changed files, in batch mode the results are returned for batchWrite, otherwise each file is written as it is parsed
+        # files are parsed while the memory budget allows, staged results are written early when it runs out (see memoryBudget)
+        # parseLimit, held by the caller, is given up for any write made while parsing
         Measurement = self.Sites[siteID]['Measurements'][measurementID]
+        batch,parsed = [],{}
+        # high frequency measurements can be reduced to block statistics as the files come in
+        aggregator = blockAggregator(**Measurement['aggregation']) if Measurement.get('aggregation') else None
+        if aggregator is not None:
+            # intervals left incomplete by the last run, except those from a file that is now parsed again in full
+            # the first and last intervals each modified file had are completed again from the files it shared them with (see aggregateNeighbours)
+            modified = {path:info.get('aggregationEdges') or [] for source in sourceInventory.values() for path,info in (source.get('fileList') or {}).items()
+                        if rawDataFile.fileStatus(path,dict(info),self.hashBlocks) == 'modified'}
+            aggregator.restore(self.heldBlocks(siteID,measurementID),list(modified))
+        # first and last interval of the data in each file parsed
+        edges = {}
+        sourceMap = {}
+        # results are handed back in file order, so writing part of a batch early resolves overlaps as a single batchWrite would
+        def drain():
+            with released(parseLimit):
+                self.batchWrite(siteID,measurementID,batch)
+            batch.clear()
         for matchPattern, sourceFiles in sourceInventory.items():
+            parsed[matchPattern] = {}
             if 'fileList' not in sourceFiles:
                 log('No sourceFiles to import',ln=False,verbose=self.verbose)
-                pass
-            elif len(sourceFiles['fileList'])>3 and Measurement['fileType'] == 'TOB3' and self.enableParallel:
-                nproc = min(os.cpu_count()-2,len(sourceFiles))
-                with Pool(processes=nproc) as pool:
-                    results = pool.map(partial(rawDataFile.loadRawFile,fileType=Measurement['fileType'],parserSettings=sourceFiles['parserSettings']),sourceFiles['fileList'].items())
+                results = []
+            else:
+                # skip unchanged files with a stat call, before they are sent to a parser
+                fileList = sorted((k,v) for k,v in sourceFiles['fileList'].items() if rawDataFile.fileStatus(k,v,self.hashBlocks) in ['new','appended','modified'])
+                self.metrics.emit('rawFileParse',event='start',siteID=siteID,measurementID=measurementID,matchPattern=matchPattern,total=len(fileList))
+                loadRawFile = partial(rawDataFile.loadRawFile,fileType=Measurement['fileType'],parserSettings=sourceFiles['parserSettings'],hashBlocks=self.hashBlocks)
+                if Measurement.get('chunkRows'):
+                    # each file is parsed in pieces, which are held until their partitions are complete (see stagePiece)
+                    streamRawFile = partial(rawDataFile.streamRawFile,chunkRows=Measurement['chunkRows'],**loadRawFile.keywords)
+                    results = (piece for f in fileList for piece in streamRawFile(copy.deepcopy(f)))
+                elif len(fileList)>3 and self.nproc>1 and self.enableParallel:
+                    # parse in the worker pool, with the numeric columns passed back in shared memory
+                    loadRawFile = partial(rawDataFile.loadRawFileShared,**loadRawFile.keywords)
+                    pool = self.workerPool()
+                    results = self.budget.bounded(lambda f:pool.apply_async(loadRawFile,(f,)),fileList,drain,unpack=rawDataFile.fromSharedMemory,discard=rawDataFile.releaseSharedMemory)
+                else:
+                    results = self.budget.bounded(lambda f:deferred(call=partial(loadRawFile,copy.deepcopy(f))),fileList,drain)
+            try:
+                for result in results:
+                    with self.lock:
+                        self.workerPeakRSS = max(self.workerPeakRSS,result.pop('peakRSS',0))
+                    fileMetrics = {'files':1}|result.pop('metrics',{'seconds':0})
+                    self.metrics.emit('loadRawFile',siteID=siteID,measurementID=measurementID,file=result['filepath'],**rates(fileMetrics.pop('seconds'),fileMetrics))
+                    if counts is not None:
+                        addCounts(counts,fileMetrics)
+                    if aggregator is not None:
+                        sourceMap = sourceMap | result['variableMap']
+                        self.recordEdges(aggregator,result,edges)
+                        result['DataFrame'] = aggregator.update(result['DataFrame'],result['filepath'])
+                        result['variableMap'] = aggregator.variableMap(result['DataFrame'],sourceMap)
+                    if Measurement.get('chunkRows'):
+                        self.stagePiece(siteID,measurementID,result,batch,drain)
+                    else:
+                        self.stageResult(siteID,measurementID,result,batch,parseLimit=parseLimit)
+                        if not batch or batch[-1] is not result:
+                            # written straight away, or nothing to write
+                            self.budget.release(result.pop('heldBytes',0))
+                        elif self.budget.full():
+                            drain()
+                    symLink = [sourceFiles['fileList'][k]['parserSettings'] for k in sourceFiles['fileList'] if sourceFiles['fileList'][k]['parserSettings'] == result['sourceInfo']['parserSettings']]
+                    if symLink:
+                        result['sourceInfo']['parserSettings'] = symLink[0]
+                    # the inventory is only updated by saveSourceInventory, once the data are written
+                    parsed[matchPattern][result['filepath']] = result['sourceInfo']
+            finally:
+                # a loop stopped by an error still releases the budget and the shared memory of results not yet collected
+                if hasattr(results,'close'):
+                    results.close()
+            if not self.batchImport:
+                # pieces still held are written before their files are recorded
+                drain()
+                self.catalog.upsertFiles(siteID,measurementID,matchPattern,parsed[matchPattern])
+        if aggregator is not None:
+            labels = {pd.Timestamp(label) for path,old in modified.items() for label in old+edges.get(path,[])}
+            self.aggregateNeighbours(siteID,measurementID,sourceInventory,aggregator,labels,{path for files in parsed.values() for path in files},sourceMap,batch,parseLimit)
+            # intervals held back because they could continue in another file, computed from every sample seen for them so far
+            remainder = aggregator.flush()
+            self.stageResult(siteID,measurementID,{'filepath':'','DataFrame':remainder,'variableMap':aggregator.variableMap(remainder,sourceMap),'status':'aggregated'},batch,parseLimit=parseLimit)
+        return(batch,parsed,aggregator.record() if aggregator is not None else None)
+
+    def heldBlocksFile(self,siteID,measurementID):
+        return(os.path.join(self.projectPath,'database',siteID,measurementID,'_heldBlocks.json'))
+
+    def heldBlocks(self,siteID,measurementID):
+        # moments of the aggregation intervals left incomplete by the last run, see blockAggregator.record
+        if os.path.isfile(self.heldBlocksFile(siteID,measurementID)):
+            with open(self.heldBlocksFile(siteID,measurementID)) as f:
+                return(json.load(f))
+        return(None)
+
+    def saveHeldBlocks(self,siteID,measurementID,held):
+        fname = self.heldBlocksFile(siteID,measurementID)
+        os.makedirs(os.path.dirname(fname),exist_ok=True)
+        with open(fname+'.tmp','w') as f:
+            json.dump(held,f)
+        os.replace(fname+'.tmp',fname)
+
+    def recordEdges(self,aggregator,result,edges):
+        # the first and last interval of a file's data, kept in its sourceInfo so the files sharing them can be found once it is modified
+        # the range grows with appends and with each piece of a chunked file, a modified file starts over
+        path = result['filepath']
+        if path not in edges:
+            known = result['sourceInfo'].get('aggregationEdges') if result.get('status') == 'appended' else None
+            edges[path] = [pd.Timestamp(label) for label in known] if known else []
+        if not result['DataFrame'].empty:
+            labels = aggregator.labels(result['DataFrame'])
+            edges[path] = [min(edges[path]+[labels.min()]),max(edges[path]+[labels.max()])]
+        if edges[path]:
+            result['sourceInfo']['aggregationEdges'] = [label.isoformat() for label in edges[path]]
+
+    def aggregateNeighbours(self,siteID,measurementID,sourceInventory,aggregator,labels,parsedPaths,sourceMap,batch,parseLimit=None):
+        # a modified file is parsed again on its own, so the intervals at its edges would only hold its own samples and overwrite
+        # those written from it and its neighbours. The files whose data span one of those intervals are read again and their rows
+        # in it are added, they are not recorded as loaded again. Files loaded before their edges were recorded are not found
+        if not labels:
+            return
+        Measurement = self.Sites[siteID]['Measurements'][measurementID]
+        # every file on record, the inventory of a search only holds the files it parses for some catalogs
+        for matchPattern,source in self.catalog.load(siteID,measurementID).items():
+            for path,info in sorted((source.get('fileList') or {}).items()):
+                span = info.get('aggregationEdges')
+                if path in parsedPaths or not span or not info.get('loaded') or not os.path.isfile(path):
+                    continue
+                # intervals restored with this file's moments already hold them
+                shared = [label for label in labels if pd.Timestamp(span[0]) <= label <= pd.Timestamp(span[1]) and path not in aggregator.sources.get(label,())]
+                if not shared:
+                    continue
+                DataFrame = rawDataFile.loadRawFile((path,copy.deepcopy(info)|{'loaded':False}),fileType=Measurement['fileType'],parserSettings=source['parserSettings'],hashBlocks=self.hashBlocks)['DataFrame']
+                if DataFrame.empty:
+                    continue
+                # intervals the modified file no longer reaches are complete with this file's rows alone
+                completed = aggregator.update(DataFrame.loc[aggregator.labels(DataFrame).isin(shared)],path)
+                self.stageResult(siteID,measurementID,{'filepath':path,'DataFrame':completed,'variableMap':aggregator.variableMap(completed,sourceMap),'status':'aggregated'},batch,parseLimit=parseLimit)
+
+    def gridFrequency(self,siteID,measurementID):
+        # storage grid of a measurement: the aggregation interval, else its frequency, else the project default
+        Measurement = self.Sites[siteID]['Measurements'][measurementID]
+        if Measurement.get('aggregation'):
+            return(Measurement['aggregation'].get('interval',blockAggregator.interval))
+        if Measurement.get('frequency'):
+            return(Measurement['frequency'])
+        return(self.projectInfo.get('database',{}).get('.defaultFormat',{}).get('POSIX_timestamp',{}).get('frequency','30min'))
+
+    def measurementPolicy(self,siteID,measurementID):
+        # conflict policy of a measurement, else the database default
+        return(self.Sites[siteID]['Measurements'][measurementID].get('mergePolicy') or self.mergePolicy)
+
+    def filePolicy(self,result,policy):
+        # a modified file was corrected at the source, its values replace what it wrote before (preferNewest already prefers them)
+        # aggregated intervals held to the end of a run replace the partial statistics an earlier run wrote for them
+        # the edges of a modified file are aggregated with the files it shares them with first (see aggregateNeighbours)
+        if result.get('status') == 'aggregated' or (result.get('status') == 'modified' and policy != 'preferNewest'):
+            return('overwrite')
+        return(policy)
+
+    def writeSettings(self,siteID,measurementID):
+        # databaseFolder arguments shared by every write to a measurement
+        defaultFormat = self.projectInfo.get('database',{}).get('.defaultFormat',{})
+        storage = self.Sites[siteID]['Measurements'][measurementID].get('storage') or defaultFormat.get('.storage')
+        partition = self.Sites[siteID]['Measurements'][measurementID].get('partition') or defaultFormat.get('POSIX_timestamp',{}).get('partition')
+        return({'frequency':self.gridFrequency(siteID,measurementID),'mergePolicy':self.measurementPolicy(siteID,measurementID),'storage':storage,'partition':partition,'metrics':self.metrics,'budget':self.budget})
+
+    def stagePiece(self,siteID,measurementID,piece,batch,drain):
+        # hold a piece of a chunked file in the batch, so each partition is rewritten once rather than once per piece
+        # pieces come in time order, so the staged partitions are complete once a piece starts past the last of them
+        # they are written then, when the budget is full, past maxStagedBytes, or (outside batch mode) when the next file starts
+        # an early write merges the pieces staged so far into their partitions, the rest are merged into them by later writes
+        if piece['DataFrame'].empty:
+            return
+        settings = self.writeSettings(siteID,measurementID)
+        partitions = gridPartition(piece['DataFrame'].index,settings['frequency'],settings['partition'] or defaultPartition(settings['frequency']))
+        stagedBytes = sum(result.get('heldBytes',0) for result in batch)
+        if batch and (self.budget.full() or (self.maxStagedBytes is not None and stagedBytes >= self.maxStagedBytes)
+                      or partitions.min() > max(staged['lastPartition'] for staged in batch)
+                      or (not self.batchImport and batch[-1]['filepath'] != piece['filepath'])):
+            drain()
+        self.stageResult(siteID,measurementID,piece,batch,hold=True)
+        piece['lastPartition'] = partitions.max()
+        piece['heldBytes'] = self.budget.settle(piece['filepath'],0,piece['DataFrame'])
+
+    def stageResult(self,siteID,measurementID,result,batch,hold=False,parseLimit=None):
+        # hold a parsed result for batchWrite, or write it straight away, without parseLimit (see rawFileParse)
+        if not result['DataFrame'].empty:
+            settings = self.writeSettings(siteID,measurementID)
+            if settings['mergePolicy'] == 'preferNewest':
+                # tag each record with the modification time of its source file
+                mtime = result.get('sourceInfo',{}).get('fingerprint',{}).get('mtime')
+                result['DataFrame']['sourceModified'] = mtime/1e9 if mtime is not None else np.nan
+                result['variableMap'] = result['variableMap'] | {'sourceModified':dict(mergeEngine.sourceModified)}
+            if self.batchImport or hold:
+                batch.append(result)
+            else:
+                settings['mergePolicy'] = self.filePolicy(result,settings['mergePolicy'])
+                with released(parseLimit):
+                    databaseFolder(path=os.path.join(self.projectPath,'database',siteID,measurementID),dataIn=result['DataFrame'],variableMap=result['variableMap'],**settings)
+
+    def batchWrite(self,siteID,measurementID,results,executor=None):
+        # Merge a set of parsed files and write them with a single read-merge-write per partition
+        if not results:
+            return
+        try:
+            self.writeBatch(siteID,measurementID,results,executor)
+        finally:
+            # hand the memory of the written results back to the budget
+            self.budget.release(sum(result.pop('heldBytes',0) for result in results))
+
+    def writeBatch(self,siteID,measurementID,results,executor=None):
+        # given an executor, each partition is written concurrently
+        # results can arrive in any order from the pool, sort so overlaps resolve the same way every run
+        results = sorted(results,key=lambda result:result['filepath'])
+        log(f'Writing {len(results)} files to {siteID}/{measurementID}',ln=False,verbose=self.verbose)
+        path = os.path.join(self.projectPath,'database',siteID,measurementID)
+        settings = self.writeSettings(siteID,measurementID)
+        # runs of files merged with the same policy are written together, one after the other (see filePolicy)
+        for policy,run in itertools.groupby(results,key=lambda result:self.filePolicy(result,settings['mergePolicy'])):
+            run = list(run)
+            variableMap = {}
+            for result in run:
+                variableMap = variableMap | result['variableMap']
+            # duplicate timestamps are kept, the merge engine resolves them in this (file) order
+            dataIn = pd.concat([result['DataFrame'] for result in run])
+            if executor is None:
+                databaseFolder(path=path,dataIn=dataIn,variableMap=variableMap,**settings|{'mergePolicy':policy})
             else:
-                results = map(partial(rawDataFile.loadRawFile,fileType=Measurement['fileType'],parserSettings=sourceFiles['parserSettings']),(copy.deepcopy(f) for f in sourceFiles['fileList'].items()))
-            for result in results:
-                if not result['DataFrame'].empty:
-                    databaseFolder(path=os.path.join(self.projectPath,'database',siteID,measurementID),dataIn=result['DataFrame'],variableMap=result['variableMap'])
-                symLink = [sourceFiles['fileList'][k]['parserSettings'] for k in sourceFiles['fileList'] if sourceFiles['fileList'][k]['parserSettings'] == result['sourceInfo']['parserSettings']]
-                if symLink:
-                    result['sourceInfo']['parserSettings'] = symLink[0]
-                sourceFiles['fileList'][result['filepath']] = result['sourceInfo']
-            self.save(sourceInventory,os.path.join(self.projectPath,'Sites',siteID,measurementID,'sourceFiles.yml'),anchors=True)
+                partitions = gridPartition(dataIn.index,settings['frequency'],settings['partition'] or defaultPartition(settings['frequency']))
+                writes = [executor.submit(databaseFolder,path=path,dataIn=dataIn.loc[partitions==part],variableMap=copy.deepcopy(variableMap),**settings|{'mergePolicy':policy})
+                          for part in partitions.unique()]
+                for write in writes:
+                    write.result()
 
 @dataclass(kw_only=True)
 class databaseFolder:
-    POSIX_timestamp: dict = field(default_factory=lambda:{'dtype': 'float64','frequency': '30min','timezone': 'UTC','ignore':False,'variableDescription': 'the POSIX_timestamp is stored as a 64-bit floating point number representing the seconds elapsed since 1970-01-01 00:00 UTC time'})
+    POSIX_timestamp: dict = field(default_factory=lambda:{'dtype': 'float64','frequency': '30min','partition':'year','timezone': 'UTC','ignore':False,'variableDescription': 'the POSIX_timestamp is stored as a 64-bit floating point number representing the seconds elapsed since 1970-01-01 00:00 UTC time'})
     path: str
     Years: list = None
     verbose: bool = True
     dataIn: pd.DataFrame = field(default_factory=lambda:pd.DataFrame())
     dataOut: pd.DataFrame = field(default_factory=lambda:pd.DataFrame())
     variableMap: dict = field(default_factory=lambda:{})
+    # storage grid, e.g., 30min, 1min, 24h (defaults to POSIX_timestamp['frequency'])
+    frequency: str = None
+    # files per column: year, month, or day (defaults to POSIX_timestamp['partition']), e.g., day for 20 Hz data
+    partition: str = None
+    # how incoming data resolve against stored values, see mergeEngine.mergePolicies
+    mergePolicy: str = 'keepExisting'
+    # column storage, raw by default, e.g., {'format':'chunked','codec':'zlib'} (chunkRows defaults from the grid), see columnStore.storageBackend
+    storage: dict = None
+    metrics: ingestMetrics = field(default=None,repr=False)
+    # the partition blocks merged by a write are counted against the ingest's memory budget
+    budget: memoryBudget = field(default=None,repr=False)
+    # optional projection (variables) and time window (start/end, UTC) for memory-mapped reads
+    variables: list = None
+    start: str = None
+    end: str = None
 
     def __post_init__(self):
+        self.POSIX_timestamp = self.storedGrid()
         self.write = bool(self.variableMap) and not self.dataIn.empty
+        if self.write and partitionSlots(self.POSIX_timestamp['partition'],self.POSIX_timestamp['frequency']) > maxPartitionSlots:
+            raise ValueError(f"{self.POSIX_timestamp['frequency']} partitioned by {self.POSIX_timestamp['partition']} is more than {maxPartitionSlots} slots per partition, "
+                             f"use a partition of {defaultPartition(self.POSIX_timestamp['frequency'])} or less")
+        self.sliced = not self.write and (self.variables is not None or self.start is not None or self.end is not None)
+        if type(self.variables) == str:
+            self.variables = [self.variables]
         self.dataIn = self.dataIn.drop([col for col,val in self.variableMap.items() if val['ignore']],axis=1)
         self.variableMap = {key:values for key,values in self.variableMap.items() if not values['ignore']}
         self.variableMap = {'POSIX_timestamp':self.POSIX_timestamp} |self.variableMap
-        if self.Years is None:
-            if not self.dataIn.empty:
-                self.Years = list(self.dataIn.index.year.unique())
-            else:
-                log('Error, define years to read')
-                return()
-
-        elif type(self.Years) == int:
+        if type(self.Years) == int:
             self.Years = [self.Years]
         elif type(self.Years) == str:
             self.Years = [int(self.Years)]
+        frequency,partition = self.POSIX_timestamp['frequency'],self.POSIX_timestamp['partition']
+        if not self.dataIn.empty:
+            # the incoming rows are grouped by partition once, in a stable order so duplicates still resolve in file order
+            partitions = gridPartition(self.dataIn.index,frequency,partition)
+            order = np.argsort(partitions.asi8,kind='stable')
+            self.dataIn,partitions = self.dataIn.iloc[order],partitions[order]
+            self.Partitions = [part for part in partitions.unique() if self.Years is None or part.year in self.Years]
+            bounds = np.searchsorted(partitions.asi8,[part.ordinal for part in self.Partitions]+[np.iinfo('int64').max])
+            self.incoming = {part:(bounds[i],bounds[i+1]) for i,part in enumerate(self.Partitions)}
+        elif self.sliced:
+            self.Partitions = [part for part in storedPartitions(self.path,partition,self.start,self.end) if self.Years is None or part.year in self.Years]
+        elif self.Years is not None:
+            self.Partitions = yearPartitions(self.Years,partition)
+        else:
+            log('Error, define years to read')
+            return()
+        if self.Years is None:
+            self.Years = sorted(set(part.year for part in self.Partitions))
 
-        for year in self.Years:
-            if os.path.isfile(os.path.join(self.path,str(year),'_variableMap.yml')) and os.path.exists(os.path.join(self.path,str(year),'POSIX_timestamp')):
-                self.dataOut = pd.concat([self.dataOut,self.readYear(year)])
-            else:
-                self.dataOut = pd.concat([self.dataOut,self.emptyYear(year)])
-            if self.write:
-                self.writeYear(year)
+        if self.metrics is None:
+            self.metrics = ingestMetrics()
+        start = time.perf_counter()
+        if self.sliced:
+            Slices = [self.readSlice(part) for part in self.Partitions]
+            if Slices:
+                self.dataOut = pd.concat(Slices)
+                self.dataOut.index.name = 'UTC'
+            self.metrics.emit('databaseRead',path=self.path,years=self.Years,**rates(time.perf_counter()-start,{'rows':len(self.dataOut),'bytesRead':int(self.dataOut.memory_usage(index=False).sum())}))
+            return
+        # reads collect the partitions and concatenate once, rather than copying the accumulated frame every partition
+        # writes only hold the partition being merged, dataOut is left empty
+        dataOut = []
+        for part in self.Partitions:
+            folder = partitionFolder(self.path,part)
+            # writers hold the partition's lock from the read through to the write
+            with (columnStore.yearLock(path=folder,verbose=self.verbose) if self.write else contextlib.nullcontext(),
+                  self.budget.holding(self.blockBytes(folder,part)) if self.write and self.budget is not None else contextlib.nullcontext()):
+                if os.path.isfile(os.path.join(folder,'_variableMap.yml')) and os.path.exists(os.path.join(folder,'POSIX_timestamp')):
+                    dataset = self.readPartition(part)
+                else:
+                    dataset = self.emptyPartition(part)
+                if self.write:
+                    with self.metrics.timed('databaseWrite',path=self.path,partition=str(part)) as counts:
+                        counts['bytesWritten'] = self.writePartition(part,dataset)
+                        counts['rows'] = len(dataset)
+                else:
+                    dataOut.append(dataset)
+        if not self.write:
+            self.dataOut = pd.concat(dataOut)
             self.dataOut.index.name = 'UTC'
-            saveDict(self.variableMap,os.path.join(self.path,str(year),'_variableMap.yml'))
-
-    def emptyYear(self,year):
-        dataset = pd.DataFrame(index=pd.date_range(str(year),str(year+1),freq=self.POSIX_timestamp['frequency'],inclusive='right'))
-        dataset['POSIX_timestamp'] = (dataset.index - pd.Timestamp("1970-01-01")) / pd.Timedelta('1s')
-        for col in set(list(self.dataIn.columns)+list(dataset.columns)):
-            if col in dataset.columns and col in self.dataIn.columns:
-                dataset[col] = dataset[col].fillna(self.dataIn.loc[self.dataIn.index.year==year,col])
-            elif col in self.dataIn.columns:
-                dataset = dataset.join(self.dataIn.loc[self.dataIn.index.year==year,[col]])
-        return(dataset)
+            self.metrics.emit('databaseRead',path=self.path,years=self.Years,**rates(time.perf_counter()-start,{'rows':len(self.dataOut),'bytesRead':int(self.dataOut.memory_usage(index=False).sum())}))
+
+    def blockBytes(self,folder,part):
+        # size of the float64 block a partition is merged in, with a column for each column file in its folder and each incoming column
+        stored = {name for name in os.listdir(folder) if name[0] not in '._'} if os.path.isdir(folder) else set()
+        return(int(gridSize(part,self.POSIX_timestamp['frequency'])*8*len(stored|set(self.dataIn.columns)|{'POSIX_timestamp'})))
+
+    def storedGrid(self):
+        # the grid and partitioning of existing data take precedence, a folder cannot mix frequencies or partitions
+        POSIX_timestamp = dict(self.POSIX_timestamp)
+        if self.partition not in [None]+list(partitionPeriods):
+            raise ValueError(f'Unknown partition: {self.partition}, use one of {list(partitionPeriods)}')
+        requested = {key:value for key,value in [('frequency',self.frequency),('partition',self.partition)] if value}
+        stored = storedSetting(self.path)
+        if not stored and not self.partition:
+            # a new folder is partitioned so each partition's grid fits maxPartitionSlots
+            requested['partition'] = defaultPartition(requested.get('frequency',POSIX_timestamp['frequency']))
+        if stored:
+            if self.frequency and pd.Timedelta(self.frequency) != pd.Timedelta(stored['frequency']):
+                raise ValueError(f"{self.path} is stored at {stored['frequency']}, cannot write at {self.frequency}")
+            if self.partition and self.partition != stored['partition']:
+                raise ValueError(f"{self.path} is partitioned by {stored['partition']}, cannot write by {self.partition}")
+            POSIX_timestamp = POSIX_timestamp | stored
+        return(POSIX_timestamp | requested)
+
+    def emptyPartition(self,part):
+        dataset = {'POSIX_timestamp':gridTimestamps(part,self.POSIX_timestamp['frequency'])}
+        return(self.mergePartition(part,dataset))
 
-    def readYear(self,year):
-        vm = loadDict(os.path.join(self.path,str(year),'_variableMap.yml'))
-        dataset = {f:np.fromfile(os.path.join(self.path,str(year),f),dtype=vm[f]['dtype']) for f in os.listdir(os.path.join(self.path,str(year))) if not f.endswith('.yml')}
+    def readPartition(self,part):
+        folder = partitionFolder(self.path,part)
+        def read():
+            vm = loadDict(os.path.join(folder,'_variableMap.yml'))
+            checksums = columnStore.readChecksums(folder)
+            return(vm,{f:columnStore.readColumn(folder,f,vm[f]['dtype'],checksums) for f in vm if os.path.isfile(os.path.join(folder,f))})
+        # writers already hold the lock, readers retry a read that overlapped a commit
+        vm,dataset = read() if self.write else columnStore.consistentRead(folder,read)
         self.variableMap = vm|self.variableMap
-        dataset = pd.DataFrame(data = dataset)
+        grid = gridTimestamps(part,self.POSIX_timestamp['frequency'])
+        if len(dataset['POSIX_timestamp']) != len(grid) or dataset['POSIX_timestamp'][0] != grid[0]:
+            # files written before the grid was fixed to (year, year+1] are re-gridded by slot
+            log(f'Re-gridding {self.path} {part}',ln=False,verbose=self.verbose)
+            slots = gridSlots(np.round(dataset.pop('POSIX_timestamp')*1e6).astype('int64')*1000,part,self.POSIX_timestamp['frequency'])
+            valid = slots>=0
+            regrid = {'POSIX_timestamp':grid}
+            for col,values in dataset.items():
+                regrid[col] = np.full(len(grid),np.nan,dtype=values.dtype if values.dtype.kind == 'f' else 'float64')
+                regrid[col][slots[valid]] = values[valid]
+            dataset = regrid
+        return(self.mergePartition(part,dataset))
+
+    def mergePartition(self,part,dataset):
+        # place the partition's columns in one 2-D block and merge all incoming columns at once, by slot rather than label alignment
+        nSlots = len(dataset['POSIX_timestamp'])
+        POSIX_timestamp = dataset.pop('POSIX_timestamp')
+        columns = list(dataset)+[col for col in self.dataIn.columns if col not in dataset and col != 'POSIX_timestamp']
+        block = np.full((nSlots,len(columns)),np.nan,order='F')
+        for i,col in enumerate(dataset):
+            block[:,i] = dataset[col]
+        if not self.dataIn.empty:
+            first,last = self.incoming[part]
+            dataIn = self.dataIn.iloc[first:last]
+            slots = gridSlots(toNanoseconds(dataIn.index),part,self.POSIX_timestamp['frequency'])
+            rows = slots>=0
+            incoming = [col for col in dataIn.columns if col not in ['POSIX_timestamp','sourceModified']]
+            values = dataIn.loc[rows,incoming]
+            values = values.apply(pd.to_numeric,errors='coerce') if any(values.dtypes == object) else values
+            stamps = dataIn.loc[rows,'sourceModified'].to_numpy(dtype='float64') if 'sourceModified' in dataIn else None
+            mergeEngine.mergeBlock(block,[columns.index(col) for col in incoming],slots[rows],values.to_numpy(dtype='float64'),
+                                   self.mergePolicy,stamps,columns.index('sourceModified') if 'sourceModified' in columns else None)
+        dataset = pd.DataFrame(block,columns=columns)
+        dataset.insert(0,'POSIX_timestamp',POSIX_timestamp)
         dataset.index=pd.to_datetime(dataset['POSIX_timestamp'],unit='s')
-        for col in set(list(self.dataIn.columns)+list(dataset.columns)):
-            if col in dataset.columns and col in self.dataIn.columns:
-                dataset[col] = dataset[col].fillna(self.dataIn.loc[self.dataIn.index.year==year,col])
-            elif col in self.dataIn.columns:
-                dataset = dataset.join(self.dataIn.loc[self.dataIn.index.year==year,[col]])
         return(dataset)
 
-    def writeYear(self,year):
-        for col in self.dataOut.columns:
-            if not os.path.isdir(os.path.join(self.path,str(year))): os.makedirs(os.path.join(self.path,str(year)))
-            fname = os.path.join(self.path,str(year),col)
-            log(f'Writing: {fname}',ln=False,verbose=self.verbose)
-            self.dataOut.loc[self.dataOut.index.year==year,col].astype(self.variableMap[col]['dtype']).values.tofile(fname)
+    def readSlice(self,part):
+        # memory-map the column files and copy out only the requested variables and time window
+        vm,columns = partitionSlice(self.path,part,self.variables,self.start,self.end)
+        for var in (self.variables or []):
+            if var not in columns:
+                log(f'{var} not in {self.path} for {part}',ln=False,verbose=self.verbose)
+        self.variableMap = {var:vm[var] for var in columns} | self.variableMap
+        dataset = pd.DataFrame(data = {var:np.array(values) for var,values in columns.items()})
+        dataset.index=pd.to_datetime(dataset['POSIX_timestamp'],unit='s')
+        return(dataset)
+
+    def writePartition(self,part,dataset):
+        inPartition = gridPartition(dataset.index,self.POSIX_timestamp['frequency'],self.POSIX_timestamp['partition'])==part
+        columns = {col:dataset.loc[inPartition,col].astype(self.variableMap[col]['dtype']).values for col in dataset.columns}
+        # the variable map is committed with the columns, chunked storage is recorded with the grid
+        storage = self.columnStorage()
+        POSIX_timestamp = {key:value for key,value in self.POSIX_timestamp.items() if key != 'storage'}
+        if storage.get('format','raw') != 'raw':
+            POSIX_timestamp['storage'] = storage
+        files = {'_variableMap.yml':yaml.safe_dump(self.variableMap|{'POSIX_timestamp':POSIX_timestamp},sort_keys=False)}
+        return(columnStore.writeColumns(partitionFolder(self.path,part),columns,storage,files,verbose=self.verbose))
+
+    def columnStorage(self):
+        # chunked columns without a chunk size keep the one recorded with the stored grid, else get one sized from the grid frequency
+        storage = dict(self.storage or {})
+        if storage.get('format','raw') == 'chunked' and not storage.get('chunkRows'):
+            stored = self.POSIX_timestamp.get('storage') or {}
+            storage['chunkRows'] = stored.get('chunkRows') or columnStore.gridChunkRows(pd.Timedelta(self.POSIX_timestamp['frequency']).value)
+        return(storage)
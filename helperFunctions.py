@@ -3,9 +3,7 @@ import re
 import sys
 import yaml
 import json
-import psutil
 import datetime
-import deepdiff
 import argparse
 import subprocess
 import pandas as pd
@@ -141,10 +139,66 @@ def exclude_ignore_callback(obj, path):
         return True
     return False
 
+scalarTypes = (str,int,bool,type(None))
+
+def subtreeHash(obj,memo):
+    # content hash of a nested dict/list, type aware so 1, 1.0, True and '1' differ, dict key order is ignored
+    # None for anything holding a nan, which never equals itself and is left to deepdiff
+    # containers are memoized by id, so shared (anchored) subtrees are hashed once per comparison
+    if type(obj) in scalarTypes:
+        return(hash((type(obj),obj)))
+    if id(obj) in memo:
+        return(memo[id(obj)][0])
+    if type(obj) is dict:
+        items = [(type(k),k,type(v),v) if type(v) in scalarTypes else (type(k),k,subtreeHash(v,memo)) for k,v in obj.items()]
+        h = None if any(i[-1] is None and len(i) == 3 for i in items) else hash((dict,frozenset(items)))
+    elif type(obj) in (list,tuple):
+        items = tuple(subtreeHash(v,memo) for v in obj)
+        h = None if None in items else hash((type(obj),items))
+    elif type(obj) is float and obj != obj:
+        h = None
+    else:
+        try:
+            h = hash((type(obj),obj))
+        except TypeError:
+            h = hash((type(obj),repr(obj)))
+    # keep a reference so the id is not reused while the memo is alive
+    memo[id(obj)] = (h,obj)
+    return(h)
+
+def differingBranches(new_dict,old_dict,memo,exclude_values=None,path='root'):
+    # copies of two nested dicts where every branch with matching hashes holds the same (old) object on both sides
+    # deepdiff skips identical objects at once, and still sees every key, so its output is unchanged
+    # dicts that exclude_values would skip are kept as they are
+    same = {}
+    for key,value in new_dict.items():
+        if key in old_dict:
+            h = subtreeHash(value,memo)
+            if h is not None and h == subtreeHash(old_dict[key],memo):
+                same[key] = old_dict[key]
+    new = {key:same[key] if key in same else value for key,value in new_dict.items()}
+    old = {key:same[key] if key in same else value for key,value in old_dict.items()}
+    for key,value in new_dict.items():
+        keyPath = f'{path}[{key!r}]'
+        if (key in old_dict and key not in same and type(value) is dict and type(old_dict[key]) is dict and
+            not (exclude_values and (exclude_values(value,keyPath) or exclude_values(old_dict[key],keyPath)))):
+            new[key],old[key] = differingBranches(value,old_dict[key],memo,exclude_values,keyPath)
+    return(new,old)
+
 def compareDicts(new_dict,old_dict,ignore_order=True,exclude_keys=[],exclude_values=exclude_ignore_callback):
     # a wrapper on the deepdiff algorithm 
     # outputs changes in a format which is easier to interpret as a yaml file
-    dd = deepdiff.DeepDiff(old_dict,new_dict,ignore_order=ignore_order,exclude_regex_paths=exclude_keys,exclude_obj_callback=exclude_values)
+    # unchanged branches are found by hash first and shared between both sides, so deepdiff only walks the parts that differ
+    if type(new_dict) is dict and type(old_dict) is dict:
+        memo = {}
+        h = subtreeHash(new_dict,memo)
+        if h is not None and h == subtreeHash(old_dict,memo):
+            return(False)
+        new,old = differingBranches(new_dict,old_dict,memo,exclude_values)
+    else:
+        new,old = new_dict,old_dict
+    import deepdiff
+    dd = deepdiff.DeepDiff(old,new,ignore_order=ignore_order,exclude_regex_paths=exclude_keys,exclude_obj_callback=exclude_values)
     if dd == {}:
         return(False)
     dDict = {}
@@ -189,31 +243,28 @@ def compareDicts(new_dict,old_dict,ignore_order=True,exclude_keys=[],exclude_val
     return(dDict)
     
 def unpackDict(Tree,format=os.path.sep,limit=None):
-    # recursive function to condense a nested dict by concatenating keys to a string
-    def unpack(child,parent=None,root=None,format=None,limit=None):
-        pth = {}
-        if type(child) is dict and (limit is None or limit >= 0) and child:
-            if limit is not None:
-                limit -= 1
-            for key,value in child.items():
-                if parent is None:
-                    pass
-                else:
-                    key = format.join([parent,key])
-                if type(value) is not dict or (limit is not None and limit < 0) or not value:
-                    pth[key] = unpack(value,key,root,format,limit)
-                else:
-                    pth = pth | unpack(value,key,root,format,limit)
-        else:
-            if type(child) is not dict or (limit is not None and limit < 0) or not child:
-                return(child)
+    # condense a nested dict by concatenating keys to a string
+    # walks the tree depth first with a stack of iterators and fills one output dict, so no level is copied
+    if type(Tree) is not dict or not Tree or (limit is not None and limit < 0):
+        return(Tree)
+    flat = {}
+    stack = [(iter(Tree.items()),None,None if limit is None else limit-1)]
+    while stack:
+        items,parent,limit = stack[-1]
+        for key,value in items:
+            if parent is not None:
+                key = format.join([parent,key])
+            if type(value) is not dict or (limit is not None and limit < 0) or not value:
+                flat[key] = value
             else:
-                sys.exit('Error in file tree unpack')
-        return(pth)
-    return(unpack(Tree,format=format,limit=limit))
+                stack.append((iter(value.items()),key,None if limit is None else limit-1))
+                break
+        else:
+            stack.pop()
+    return(flat)
 
 def packDict(itemList,format=os.path.sep,limit=None,order=-1,fill=None):
-    # recursive function to generate nested dict from list of strings, splitting by sep
+    # generate nested dict from list of strings, splitting by sep
     Tree = {}
     if type(itemList) is list:
         if fill == 'key':
@@ -226,6 +277,27 @@ def packDict(itemList,format=os.path.sep,limit=None,order=-1,fill=None):
         itemList = {itemList:fill}
     for key,value in itemList.items():
         b = key.split(format)
+        if order == -1 and limit is None:
+            # full depth: walk down the existing branches and only merge where the path leaves them
+            node = Tree
+            for i,k in enumerate(b[:-1]):
+                if k in node and type(node[k]) is dict:
+                    node = node[k]
+                    continue
+                subTree = value
+                for k_ in b[:i:-1]:
+                    subTree = {k_:subTree}
+                if k in node:
+                    updateDict(node,{k:subTree},overwrite='append')
+                else:
+                    node[k] = subTree
+                break
+            else:
+                if b[-1] in node:
+                    updateDict(node,{b[-1]:value},overwrite='append')
+                else:
+                    node[b[-1]] = value
+            continue
         if order == -1:
             if limit is None: lm = len(b)+order
             else: lm = limit
@@ -252,31 +324,45 @@ def packDict(itemList,format=os.path.sep,limit=None,order=-1,fill=None):
     return(Tree)
 
 def updateDict(base,new,overwrite=False,verbose=False):
-    if base == new: return(base)
     # more comprehensive way to update items in a nested dict
-    for key,value in new.items():
-        if type(base) is dict and key not in base.keys():
-            if verbose: log('setting: ',key,' = ',base,'\n to: ',key,' = ',value)
-            base[key]=value
-        elif type(value) is dict and type(base[key]) is dict:
-            base[key] = updateDict(base[key],value,overwrite,verbose)
-        elif overwrite == True and base[key]!= value:
-            if verbose: log('setting: ',key,' = ',base[key],'\n to: ',key,' = ',value)
-            base[key] = value
-        elif overwrite == 'append' and type(base[key]) is list:
-            if type(base[key][0]) is not list and type(value) is list:
-                base[key] = [base[key]]
-            if verbose: log('adding: ',value,'\n to: ',key,' = ',base[key])
-            base[key].append(value)
-        elif overwrite == 'append' and type(base[key]) is not list:
-            base[key] = [base[key]]
-            if verbose: log('adding: ',value,'\n to: ',key,' = ',base[key])
-            base[key].append(value)
-        elif base[key] is None and value is not None:
-            if verbose: log('setting: ',key,' = ',base[key],'\n to: ',key,' = ',value)
-            base[key] = value
-        elif base[key] != value:
-            if verbose: log(f'overwrite = {overwrite} will not update matching keys: ',base[key],value)
+    # base is updated in place, matching branches are walked depth first with a stack instead of recursion
+    # equal leaves are skipped as they are reached, rather than comparing whole branches before walking them,
+    # except when appending: equal leaves are appended, so only branches that are equal as a whole are left out
+    if overwrite == 'append' and base == new: return(base)
+    stack = [(base,iter(new.items()))]
+    while stack:
+        node,items = stack[-1]
+        for key,value in items:
+            if type(node) is dict and key not in node.keys():
+                if verbose: log('setting: ',key,' = ',node,'\n to: ',key,' = ',value)
+                node[key]=value
+            elif type(value) is dict and type(node[key]) is dict:
+                if node[key] is not value and not (overwrite == 'append' and node[key] == value):
+                    if len(stack) >= sys.getrecursionlimit():
+                        raise RecursionError('updateDict: nesting deeper than the recursion limit, a dict probably contains itself')
+                    stack.append((node[key],iter(value.items())))
+                    break
+            elif overwrite != 'append' and (node[key] is value or node[key] == value):
+                pass
+            elif overwrite == True:
+                if verbose: log('setting: ',key,' = ',node[key],'\n to: ',key,' = ',value)
+                node[key] = value
+            elif overwrite == 'append' and type(node[key]) is list:
+                if type(node[key][0]) is not list and type(value) is list:
+                    node[key] = [node[key]]
+                if verbose: log('adding: ',value,'\n to: ',key,' = ',node[key])
+                node[key].append(value)
+            elif overwrite == 'append' and type(node[key]) is not list:
+                node[key] = [node[key]]
+                if verbose: log('adding: ',value,'\n to: ',key,' = ',node[key])
+                node[key].append(value)
+            elif node[key] is None and value is not None:
+                if verbose: log('setting: ',key,' = ',node[key],'\n to: ',key,' = ',value)
+                node[key] = value
+            else:
+                if verbose: log(f'overwrite = {overwrite} will not update matching keys: ',node[key],value)
+        else:
+            stack.pop()
     return(base) 
 
 def lists2DataFrame(**kwargs):
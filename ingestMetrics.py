@@ -0,0 +1,98 @@
+######################################################################################################################
+# Per-stage metrics for the ingest pipeline
+######################################################################################################################
+# Stages report wall time and counts (files, rows, bytes) as flat records, tagged with site/measurement/file
+# Records go to any number of sinks: a callable taking the record, a JSON-lines file, or the live progress display
+# With no sinks nothing is recorded, so the hooks cost a clock read per stage
+# e.g., database(projectPath=...,metrics=ingestMetrics(sinks=[jsonLinesSink(path='ingest.jsonl'),progressDisplay()]))
+from dataclasses import dataclass,field
+from helperFunctions import progressbar
+import contextlib
+import threading
+import datetime
+import json
+import time
+import sys
+import os
+
+def rates(seconds,counts={}):
+    # a record's timing and counts with the throughput of each count
+    record = {'seconds':round(seconds,6)}|counts
+    if seconds > 0:
+        for count,rate in [('files','filesPerSecond'),('rows','rowsPerSecond')]:
+            if counts.get(count):
+                record[rate] = round(counts[count]/seconds,3)
+        for count,rate in [('bytesRead','MBReadPerSecond'),('bytesWritten','MBWrittenPerSecond')]:
+            if counts.get(count):
+                record[rate] = round(counts[count]/seconds/1e6,3)
+    return(record)
+
+def peakRSS():
+    # peak resident memory (bytes) of the calling process
+    try:
+        import resource
+    except ImportError:
+        import psutil
+        return(psutil.Process().memory_info().peak_wset)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macOS
+    return(peak if sys.platform == 'darwin' else peak*1024)
+
+def addCounts(counts,more):
+    for key,value in more.items():
+        counts[key] = counts.get(key,0)+value
+
+@dataclass(kw_only=True)
+class ingestMetrics:
+    sinks: list = field(default_factory=lambda:[])
+    lock: threading.Lock = field(default_factory=threading.Lock,repr=False)
+
+    def emit(self,stage,event='end',**fields):
+        if not self.sinks:
+            return
+        record = {'stage':stage,'event':event,'time':time.time(),'pid':os.getpid()}|fields
+        with self.lock:
+            for sink in self.sinks:
+                sink(record)
+
+    @contextlib.contextmanager
+    def timed(self,stage,**tags):
+        # time a block, the caller adds counts (files, rows, bytesRead, bytesWritten) to the dict it is given
+        counts = {}
+        start = time.perf_counter()
+        try:
+            yield counts
+        finally:
+            self.emit(stage,**tags,**rates(time.perf_counter()-start,counts))
+
+@dataclass(kw_only=True)
+class jsonLinesSink:
+    path: str
+
+    def __call__(self,record):
+        with open(self.path,'a') as f:
+            f.write(json.dumps(record,default=str)+'\n')
+
+@dataclass(kw_only=True)
+class progressDisplay:
+    # one bar over every file announced by rawFileParse, with the file and byte rates and the time remaining
+    out: object = field(default=sys.stdout,repr=False)
+    prefix: str = 'Parsing '
+    bar: progressbar = field(default=None,repr=False)
+
+    def __call__(self,record):
+        if record['stage'] == 'rawFileParse' and record['event'] == 'start' and record.get('total'):
+            if self.bar is None:
+                self.started,self.done,self.bytesRead = time.time(),0,0
+                self.bar = progressbar(record['total'],prefix=self.prefix,out=self.out)
+            else:
+                self.bar.nItems += record['total']
+        elif record['stage'] == 'loadRawFile' and self.bar is not None and record.get('files',1):
+            self.done += 1
+            self.bytesRead += record.get('bytesRead',0)
+            elapsed = max(time.time()-self.started,1e-9)
+            eta = datetime.timedelta(seconds=round((self.bar.nItems-self.done)*elapsed/self.done))
+            self.bar.step(msg=f'{self.done/elapsed:.1f} files/s {self.bytesRead/elapsed/1e6:.1f} MB/s ETA {eta}',L=60)
+            if self.done >= self.bar.nItems:
+                self.bar.close()
+                self.bar = None
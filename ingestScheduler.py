@@ -0,0 +1,56 @@
+######################################################################################################################
+# Concurrent ingest of a project
+######################################################################################################################
+# Each site/measurement is a chain of stages: discover -> parse -> merge/write (per year)
+# Chains are independent, so they run concurrently with separate limits for the I/O and CPU bound stages
+# The stages after discovery are database.rawFileImport, the same as for a single measurement, with the CPU limit held while parsing
+from dataclasses import dataclass,field
+from concurrent.futures import ThreadPoolExecutor,as_completed
+from parseFiles.helperFunctions.log import log
+import threading
+import os
+
+@dataclass(kw_only=True)
+class ingestScheduler:
+    db: object = field(repr=False)
+    # concurrent directory walks and concurrent year writes
+    ioWorkers: int = 4
+    # measurements parsing at once, the parsing itself is spread over the db worker pool
+    cpuWorkers: int = 2
+    # measurement chains in flight
+    maxChains: int = None
+    verbose: bool = False
+
+    def __post_init__(self):
+        if self.maxChains is None:
+            self.maxChains = self.ioWorkers+self.cpuWorkers
+        self.ioLimit = threading.BoundedSemaphore(self.ioWorkers)
+        self.cpuLimit = threading.BoundedSemaphore(self.cpuWorkers)
+
+    def run(self,jobs):
+        # jobs: list of (siteID,measurementID)
+        if self.db.enableParallel and self.db.nproc>1:
+            # start the process pool from the main thread, before any scheduler threads exist
+            self.db.workerPool()
+        failed = {}
+        with ThreadPoolExecutor(max_workers=self.ioWorkers,thread_name_prefix='write') as writer:
+            with ThreadPoolExecutor(max_workers=self.maxChains,thread_name_prefix='chain') as chains:
+                futures = {chains.submit(self.chain,siteID,measurementID,writer):(siteID,measurementID) for siteID,measurementID in jobs}
+                for future in as_completed(futures):
+                    try:
+                        future.result()
+                    except Exception as e:
+                        failed[futures[future]] = e
+                        log(f'Ingest failed for {futures[future]}: {e}',ln=False)
+        return(failed)
+
+    def chain(self,siteID,measurementID,writer):
+        db = self.db
+        with db.metrics.timed('rawFileSearch',siteID=siteID,measurementID=measurementID) as counts:
+            with self.ioLimit:
+                log(f'Discovering: {siteID}/{measurementID}',ln=False,verbose=self.verbose)
+                sourceInventory = db.rawFileDiscover(siteID,measurementID)
+            log(f'Importing: {siteID}/{measurementID}',ln=False,verbose=self.verbose)
+            # the cpu slot is held for the parse only, per-year writes go to the shared writer threads
+            db.rawFileImport(siteID,measurementID,sourceInventory,executor=writer,counts=counts,parseLimit=self.cpuLimit)
+            db.save(db.Sites[siteID],os.path.join(db.projectPath,'Sites',siteID,f"{siteID}_metadata.yml"))
@@ -0,0 +1,124 @@
+######################################################################################################################
+# Memory budget for parsed data waiting to be written
+######################################################################################################################
+# Bytes are reserved before a file is sent to a parser and released once its data are written, so the parsed data held
+# at once stay under maxBytes no matter how many files are queued. The budget is shared by every measurement being
+# ingested. Before a file is parsed its size is estimated from the file size, scaled by the largest in-memory to
+# on-disk ratio seen so far. Once parsed, the estimate is replaced by the actual size
+# A parse that doesn't fit waits for the oldest outstanding result to be handed to the writer. With nothing
+# outstanding, the caller's own staged data are written first (drain) and then it waits on the other measurements
+# A single file larger than the whole budget is still parsed, once nothing else is held
+# The partition blocks writers merge into are counted while they are held (see holding), they never wait, since writes are
+# what frees the budget, but parsing waits for them like it waits for parsed data
+from dataclasses import dataclass,field
+from collections import deque
+import contextlib
+import threading
+import os
+
+@dataclass(kw_only=True)
+class memoryBudget:
+    # None for no limit, the reservations are still counted so the peak can be reported
+    maxBytes: int = None
+    # in-memory to on-disk size of parsed files, until a file has been parsed
+    ratio: float = 2.0
+    inflight: int = 0
+    peak: int = 0
+    condition: threading.Condition = field(default_factory=threading.Condition,repr=False)
+
+    def reserve(self,size,wait=True):
+        with self.condition:
+            while self.maxBytes is not None and self.inflight > 0 and self.inflight+size > self.maxBytes:
+                if not wait:
+                    return(False)
+                self.condition.wait()
+            self.inflight += size
+            self.peak = max(self.peak,self.inflight)
+            return(True)
+
+    def release(self,size):
+        with self.condition:
+            self.inflight -= size
+            self.condition.notify_all()
+
+    @contextlib.contextmanager
+    def holding(self,size):
+        # count memory held by a writer for the duration of the block, without waiting
+        with self.condition:
+            self.inflight += size
+            self.peak = max(self.peak,self.inflight)
+        try:
+            yield
+        finally:
+            self.release(size)
+
+    def full(self):
+        return(self.maxBytes is not None and self.inflight >= self.maxBytes)
+
+    def estimate(self,filePath):
+        try:
+            return(int(os.path.getsize(filePath)*self.ratio))
+        except OSError:
+            return(0)
+
+    def settle(self,filePath,reserved,DataFrame):
+        # swap a file's estimate for the size of its parsed data, returns the bytes now held for it
+        actual = int(DataFrame.memory_usage(index=True).sum()) if len(DataFrame.columns) else 0
+        with self.condition:
+            try:
+                self.ratio = max(self.ratio,actual/os.path.getsize(filePath))
+            except (OSError,ZeroDivisionError):
+                pass
+            self.inflight += actual-reserved
+            self.peak = max(self.peak,self.inflight)
+            self.condition.notify_all()
+        return(actual)
+
+    def bounded(self,submit,items,drain=None,unpack=None,discard=None):
+        # submit(item) starts parsing a (filePath,sourceInfo) item and returns an object whose get() gives the result
+        # results are handed back in the order of items, each with the bytes it holds until released under 'heldBytes'
+        # unpack is applied to each result's DataFrame as it is collected, e.g., to take it out of shared memory
+        # discard is applied to the DataFrame of each result that is never collected, e.g., to free its shared memory
+        pending = deque()
+        def collect():
+            item,reserved,job = pending.popleft()
+            try:
+                result = job.get()
+                if unpack is not None:
+                    result['DataFrame'] = unpack(result['DataFrame'])
+            except BaseException:
+                self.release(reserved)
+                raise
+            result['heldBytes'] = self.settle(item[0],reserved,result['DataFrame'])
+            return(result)
+        try:
+            for item in items:
+                size = self.estimate(item[0])
+                while not self.reserve(size,wait=False):
+                    if pending:
+                        yield(collect())
+                    else:
+                        if drain is not None:
+                            drain()
+                        self.reserve(size)
+                        break
+                pending.append((item,size,submit(item)))
+            while pending:
+                yield(collect())
+        finally:
+            # the reservations of results that were never handed back, if the caller stopped early
+            self.release(sum(reserved for _,reserved,_ in pending))
+            if discard is not None:
+                for _,_,job in pending:
+                    try:
+                        discard(job.get()['DataFrame'])
+                    except Exception:
+                        pass
+
+@dataclass(kw_only=True)
+class deferred:
+    # a parse run in the calling thread when its result is collected, for bounded without a worker pool
+    call: object
+
+    def get(self):
+        return(self.call())
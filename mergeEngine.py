@@ -0,0 +1,62 @@
+######################################################################################################################
+# Slot-indexed merge of incoming data into a year block
+######################################################################################################################
+# Incoming rows are placed by slot (see dbPipeline.gridSlots) and all columns are merged in one vectorized pass
+# Conflict policies:
+#   keepExisting: stored values win, incoming data only fill gaps (first non-NaN wins among duplicates)
+#   overwrite: incoming rows replace stored rows, NaN included (last row wins among duplicates)
+#   preferNonNaN: incoming values replace stored values unless they are NaN (last non-NaN wins among duplicates)
+#   preferNewest: the value from the most recently modified source wins, using a sourceModified column
+#   a slot has one sourceModified stamp, the newest of the sources its values were taken from
+import numpy as np
+import pandas as pd
+
+mergePolicies = ['keepExisting','overwrite','preferNonNaN','preferNewest']
+sourceModified = {'dtype':'float64','ignore':False,'variableDescription':'modification time (POSIX seconds) of the source file each record was taken from'}
+
+def dedupe(slots,values,policy='keepExisting',stamps=None):
+    # reduce incoming rows to one per slot, ties are broken by row order (then by stamp for preferNewest)
+    # values of a slot can come from different rows, so stamps are returned per value (rows x columns): the stamp of the row each was taken from
+    if policy not in mergePolicies:
+        raise ValueError(f'Unknown merge policy: {policy}, use one of {mergePolicies}')
+    if policy == 'preferNewest' and stamps is not None:
+        order = np.lexsort((stamps,slots))
+    else:
+        order = np.argsort(slots,kind='stable')
+    slots,values = slots[order],values[order]
+    stamps = np.repeat(stamps[order][:,None],values.shape[1],axis=1) if stamps is not None else None
+    last = np.r_[slots[1:] != slots[:-1],True]
+    if last.all():
+        return(slots,values,stamps)
+    if policy == 'overwrite':
+        return(slots[last],values[last],stamps[last] if stamps is not None else None)
+    pick = (lambda grouped:grouped.first()) if policy == 'keepExisting' else (lambda grouped:grouped.last())
+    if stamps is not None:
+        # the stamps of missing values are masked, so they are picked from the same rows as the values
+        stamps = pick(pd.DataFrame(np.where(np.isnan(values),np.nan,stamps)).groupby(slots,sort=True)).to_numpy(dtype='float64')
+    values = pick(pd.DataFrame(values).groupby(slots,sort=True)).to_numpy(dtype='float64')
+    return(slots[last],values,stamps)
+
+def mergeBlock(block,columns,slots,values,policy='keepExisting',stamps=None,stampColumn=None):
+    # merge values (rows x len(columns)) into block (slots x variables) at the given slots, in place
+    # columns: block column of each incoming column, stampColumn: block column holding sourceModified
+    slots,values,stamps = dedupe(slots,values,policy,stamps)
+    target = np.ix_(slots,columns)
+    existing = block[target]
+    if policy == 'keepExisting':
+        merged = np.where(np.isnan(existing),values,existing)
+    elif policy == 'overwrite':
+        merged = values
+    elif policy == 'preferNonNaN':
+        merged = np.where(np.isnan(values),existing,values)
+    elif policy == 'preferNewest':
+        if stamps is None or stampColumn is None:
+            raise ValueError('preferNewest needs source modification times')
+        stored = block[slots,stampColumn]
+        newer = np.isnan(stored)[:,None] | (stamps >= stored[:,None])
+        take = ~np.isnan(values) & (newer | np.isnan(existing))
+        merged = np.where(take,values,existing)
+        # only the stamps of values that were taken, an older value filling a gap leaves the stamp as it was
+        block[slots,stampColumn] = np.fmax(stored,np.fmax.reduce(np.where(take,stamps,np.nan),axis=1))
+    block[target] = merged
+    return(block)
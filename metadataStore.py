@@ -0,0 +1,84 @@
+######################################################################################################################
+# Write-behind persistence for yaml metadata
+######################################################################################################################
+# Documents are staged in memory and marked dirty, then written once per stage (or at exit) with an atomic replace
+# Reads are served from the staged copy, so deferred writes are never read back stale
+# Each database has its own store, the stores still open at exit are flushed by one hook for the process
+from dataclasses import dataclass,field
+from parseFiles.helperFunctions.log import log
+import threading
+import weakref
+import atexit
+import copy
+import yaml
+import os
+
+# use the libyaml bindings when they are available
+try:
+    from yaml import CSafeLoader as SafeLoader, CSafeDumper as SafeDumper
+except ImportError:
+    from yaml import SafeLoader, SafeDumper
+
+class noAliasDumper(SafeDumper):
+    # write shared objects out in full instead of as anchors/aliases
+    def ignore_aliases(self,data):
+        return(True)
+
+@dataclass(kw_only=True)
+class metadataStore:
+    verbose: bool = False
+    documents: dict = field(default_factory=lambda:{},repr=False)
+    dirty: set = field(default_factory=lambda:set(),repr=False)
+    lock: threading.RLock = field(default_factory=threading.RLock,repr=False)
+
+    def __post_init__(self):
+        openStores[id(self)] = self
+
+    def load(self,filename,template=None):
+        # read a document, preferring the staged copy unless the file was edited since it was read or written
+        filename = os.path.abspath(filename)
+        with self.lock:
+            if filename in self.documents and (filename in self.dirty or self.documents[filename]['mtime'] == self.mtime(filename)):
+                return(self.documents[filename]['obj'])
+            if os.path.isfile(filename):
+                with open(filename) as f:
+                    obj = yaml.load(f,Loader=SafeLoader)
+                self.documents[filename] = {'obj':obj,'sort_keys':False,'anchors':False,'mtime':self.mtime(filename)}
+            else:
+                obj = copy.deepcopy(template) if template is not None else {}
+                self.stage(obj,filename)
+            return(obj)
+
+    def stage(self,obj,filename,sort_keys=False,anchors=False):
+        # hold a reference to obj and mark it for writing, the state at flush time is what gets written
+        filename = os.path.abspath(filename)
+        with self.lock:
+            self.documents[filename] = {'obj':obj,'sort_keys':sort_keys,'anchors':anchors,'mtime':None}
+            self.dirty.add(filename)
+
+    def flush(self):
+        with self.lock:
+            for filename in sorted(self.dirty):
+                doc = self.documents[filename]
+                log(('Saving: ',filename),ln=False,verbose=self.verbose)
+                text = yaml.dump(doc['obj'],Dumper=SafeDumper if doc['anchors'] else noAliasDumper,sort_keys=doc['sort_keys'])
+                os.makedirs(os.path.dirname(filename),exist_ok=True)
+                with open(filename+'.tmp','w') as f:
+                    f.write(text)
+                os.replace(filename+'.tmp',filename)
+                doc['mtime'] = self.mtime(filename)
+            self.dirty = set()
+
+    def mtime(self,filename):
+        try:
+            return(os.stat(filename).st_mtime_ns)
+        except OSError:
+            return(None)
+
+# stores flushed at exit, without keeping them alive
+openStores = weakref.WeakValueDictionary()
+
+@atexit.register
+def flushAll():
+    for store in list(openStores.values()):
+        store.flush()
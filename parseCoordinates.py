@@ -5,10 +5,20 @@
 # 3) get utmCoordinates zone and coordinates
 
 import re
-import utm
-from pyproj import CRS
-import geopandas as gpd
+from functools import lru_cache
 from dataclasses import dataclass,field
+import numpy as np
+import pandas as pd
+# utm, pyproj and geopandas are imported where they are used, so headless runs and pool workers don't load them
+
+datumCodes = {'WGS84':'4326','NAD83':'4269'}
+
+@lru_cache(maxsize=None)
+def utmCRS(zone,south,datum='WGS84'):
+    # building and matching a CRS is the slow part of a projection, so each zone/hemisphere/datum is resolved once
+    from pyproj import CRS
+    crs = CRS.from_dict({'proj': 'utm', 'zone': zone, 'south': south, 'datum': datum})
+    return(crs,crs.to_epsg(),crs.coordinate_operation.name)
 
 @dataclass
 class utmCoordinates:
@@ -23,10 +33,9 @@ class utmCoordinates:
 
     def __post_init__(self):
         if self.latitude and self.longitude:
+            import utm
             UTM_coords = utm.from_latlon(self.latitude,self.longitude)
-            crs = CRS.from_dict({'proj': 'utm', 'zone': UTM_coords[2], 'south': UTM_coords[3]<'N', 'datum': self.datum})
-            self.EPSG=crs.to_epsg()
-            self.name = crs.coordinate_operation.name
+            crs,self.EPSG,self.name = utmCRS(UTM_coords[2],UTM_coords[3]<'N',self.datum)
             self.x = round(UTM_coords[0],self.UTM_sig)
             self.y = round(UTM_coords[1],self.UTM_sig)
 
@@ -46,8 +55,7 @@ class geographicCoordinates:
     EPSG: str = None
 
     def __post_init__(self):
-        codes = {'WGS84':'4326','NAD83':'4269'}
-        self.EPSG = codes[self.datum]
+        self.EPSG = datumCodes[self.datum]
         self.latitude,self.latitudeDDM,self.latitudeDMS = self.getDD(str(self.latitude),'NS')
         self.longitude,self.longitudeDDM,self.longitudeDMS = self.getDD(str(self.longitude),'EW')
 
@@ -77,18 +85,19 @@ class parseCoordinates:
     attributes: dict = field(default_factory=lambda:{},repr=False)
     datum: str = field(default='WGS84',repr=False)
     geojson: dict = field(default_factory=lambda:{},repr=False)
-    geodataframe: gpd.GeoDataFrame = field(default_factory=lambda:gpd.GeoDataFrame(),repr=False)
+    geodataframe: object = field(default=None,repr=False)
+    # False skips the UTM projection and GeoDataFrame, see toGeoDataFrame
+    spatial: bool = field(default=True,repr=False)
     
     def __post_init__(self):
         if not self.latitude or not self.longitude:
+            if self.spatial:
+                self.toGeoDataFrame()
             return
         self.geographicCoordinates = geographicCoordinates(latitude=self.latitude,longitude=self.longitude,datum=self.datum)
         self.latitude,self.longitude=self.geographicCoordinates.latitude,self.geographicCoordinates.longitude
-        self.UTM = utmCoordinates(latitude=self.latitude,longitude=self.longitude,datum=self.datum)
-        self.geodataframe = gpd.GeoDataFrame(index=[self.ID],
-                                             data=self.attributes,
-                                             geometry=gpd.points_from_xy([self.UTM.x],[self.UTM.y]),
-                                             crs=self.UTM.EPSG)
+        if self.spatial:
+            self.toGeoDataFrame()
         self.geojson = {
             "type": "FeatureCollection",
             "features": [{
@@ -98,3 +107,99 @@ class parseCoordinates:
                 },
                 ]}
 
+    def toGeoDataFrame(self):
+        # project to UTM and build the GeoDataFrame on first use
+        import geopandas as gpd
+        if self.geodataframe is None and (not self.latitude or not self.longitude):
+            self.geodataframe = gpd.GeoDataFrame()
+        elif self.geodataframe is None:
+            self.UTM = utmCoordinates(latitude=self.latitude,longitude=self.longitude,datum=self.datum)
+            self.geodataframe = gpd.GeoDataFrame(index=[self.ID],
+                                                data=self.attributes,
+                                                geometry=gpd.points_from_xy([self.UTM.x],[self.UTM.y]),
+                                                crs=self.UTM.EPSG)
+        return(self.geodataframe)
+
+######################################################################################################################
+# Bulk versions for whole inventories
+######################################################################################################################
+
+def parseDegrees(values,hemisphere='NS',DD_sig=7,DDM_sig=5,DMS_sig=1,degreeString='°'):
+    # geographicCoordinates.getDD over an array of strings, returns DD, DDM and DMS arrays
+    if len(values) == 0:
+        return(np.array([]),np.array([],dtype=object),np.array([],dtype=object))
+    values = pd.Series(values,dtype=object).astype(str)
+    values = values.str.replace(r'\b(\d+)S\b|\bS\b|\bS(\d+)\b',r'-\1\2',regex=True)
+    values = values.str.replace(r'\b(\d+)W\b|\bW\b|\bW(\d+)\b',r'-\1\2',regex=True)
+    values = values.str.replace(r'[^0-9,.-]+',',',regex=True).str.replace(',,',',',regex=False)
+    sign = np.where(values.str.contains('-',regex=False),-1,1)
+    parts = values.str.replace('-','',regex=False).str.split(',',expand=True)
+    parts = parts.apply(pd.to_numeric).to_numpy(dtype='float64').reshape(len(values),-1)
+    # drop empty fields and keep the first three (degrees, minutes, seconds), left aligned
+    parts = np.take_along_axis(parts,np.argsort(np.isnan(parts),axis=1,kind='stable'),axis=1)[:,:3]
+    weights = np.array([1,1/60,1/3600])[:parts.shape[1]]
+    DD = np.array([round(v,DD_sig) for v in (np.nan_to_num(parts*sign[:,None])*weights).sum(axis=1).tolist()])
+    letters = np.where(sign<0,hemisphere[1],hemisphere[0])
+    minutes = (DD%1)*60
+    DDM = [f"{h}{int(abs(d))}{degreeString} {round(m,DDM_sig)}`" for h,d,m in zip(letters,DD.tolist(),minutes.tolist())]
+    DMS = [f"{h}{int(abs(d))}{degreeString} {int(m)}' {round(s,DMS_sig)}\"" for h,d,m,s in zip(letters,DD.tolist(),minutes.tolist(),((minutes%1)*60).tolist())]
+    return(DD,np.array(DDM,dtype=object),np.array(DMS,dtype=object))
+
+def utmZones(latitude,longitude):
+    # utm.latlon_to_zone_number for arrays, including the Norway and Svalbard exceptions
+    longitude = (longitude%360+540)%360-180
+    zone = ((longitude+180)/6).astype(int)+1
+    zone = np.where((latitude>=56)&(latitude<64)&(longitude>=3)&(longitude<12),32,zone)
+    svalbard = (latitude>=72)&(latitude<=84)&(longitude>=0)
+    for limit,svalbardZone in [(42,37),(33,35),(21,33),(9,31)]:
+        zone = np.where(svalbard&(longitude<limit),svalbardZone,zone)
+    return(zone)
+
+def utmBulk(latitude,longitude,datum='WGS84',UTM_sig=3):
+    # project points grouped by zone and hemisphere, one utm call and one (cached) CRS per group
+    import utm
+    latitude,longitude = np.asarray(latitude,dtype='float64'),np.asarray(longitude,dtype='float64')
+    zone,south = utmZones(latitude,longitude),latitude<0
+    x,y = np.full(len(latitude),np.nan),np.full(len(latitude),np.nan)
+    EPSG,name = np.zeros(len(latitude),dtype='int64'),np.empty(len(latitude),dtype=object)
+    for z,s in set(zip(zone.tolist(),south.tolist())):
+        group = (zone==z)&(south==s)
+        x[group],y[group] = utm.from_latlon(latitude[group],longitude[group],force_zone_number=z,force_northern=not s)[:2]
+        crs,EPSG[group],name[group] = utmCRS(z,s,datum)
+    return(pd.DataFrame({'x':np.round(x,UTM_sig),'y':np.round(y,UTM_sig),'zone':zone,'south':south,'EPSG':EPSG,'name':name}))
+
+def bulkCoordinates(ID,latitude,longitude,datum='WGS84',attributes={},spatial=True):
+    # standardized DD/DDM/DMS, UTM coordinates and EPSG codes for arrays of lat/lon in any of the supported formats
+    # points without a latitude or longitude are kept with empty coordinates
+    # spatial=False skips the UTM projection (as parseCoordinates does), so headless runs don't load utm or pyproj
+    frame = pd.DataFrame({'latitude':pd.Series(latitude,dtype=object).values,'longitude':pd.Series(longitude,dtype=object).values}|attributes,index=pd.Index(ID,name='ID'))
+    valid = (frame['latitude'].notna() & frame['longitude'].notna() & (frame['latitude'].astype(str) != '') & (frame['longitude'].astype(str) != '')).to_numpy()
+    for axis,hemisphere in [('latitude','NS'),('longitude','EW')]:
+        DD,DDM,DMS = parseDegrees(frame.loc[valid,axis].tolist(),hemisphere)
+        frame[axis] = np.nan
+        frame.loc[valid,axis],frame.loc[valid,axis+'DDM'],frame.loc[valid,axis+'DMS'] = DD,DDM,DMS
+    if not spatial:
+        return(frame)
+    UTM = utmBulk(frame.loc[valid,'latitude'],frame.loc[valid,'longitude'],datum)
+    for col in UTM.columns:
+        frame.loc[valid,col] = UTM[col].values
+    return(frame.astype({'zone':'Int64','EPSG':'Int64'}))
+
+def frameGeojson(frame,properties=[]):
+    # the parseCoordinates geojson for every point of a bulkCoordinates frame that has coordinates, in frame order
+    frame = frame.loc[frame['latitude'].notna() & frame['longitude'].notna()]
+    if frame.empty:
+        return({})
+    return({
+        "type": "FeatureCollection",
+        "features": [{
+            "type": "Feature",
+            "properties": {"ID": ID}|dict(zip(properties,values)),
+            "geometry": {"type": "Point","coordinates": [longitude, latitude]}
+            } for ID,longitude,latitude,*values in zip(frame.index.tolist(),frame['longitude'].tolist(),frame['latitude'].tolist(),*[frame[p].tolist() for p in properties])
+            ]})
+
+def toGeoDataFrame(frame,datum='WGS84'):
+    # one GeoDataFrame for a bulkCoordinates frame, points are in geographic coordinates so different UTM zones can share it
+    import geopandas as gpd
+    return(gpd.GeoDataFrame(frame,geometry=gpd.points_from_xy(frame['longitude'],frame['latitude']),crs=f"EPSG:{datumCodes[datum]}"))
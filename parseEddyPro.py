@@ -0,0 +1,65 @@
+######################################################################################################################
+# EddyPro full output files
+######################################################################################################################
+# Three header rows (variable group, variable name, units) are read once into the variableMap
+# The body is read in one pass with a fixed dtype, fill values become NaN, and the timestamps (end of each averaging
+# period, like the database grid) are assembled from the unique dates and times rather than parsed row by row
+# sourceFile can also be a binary buffer (a chunk replayed by parserRegistry), which is read from its start
+from dataclasses import dataclass,field
+from parseFiles.helperFunctions.log import log
+import numpy as np
+import pandas as pd
+import csv
+import io
+import re
+
+@dataclass(kw_only=True)
+class EddyPro:
+    sourceFile: str = field(repr=False)
+    verbose: bool = field(default=False,repr=False)
+    # timezone of the date/time columns, the timestamps are left naive if not set
+    timezone: str = None
+    fillValue: float = -9999
+    # storage dtype of every variable
+    dtype: str = 'float32'
+    encoding: str = 'utf-8'
+    # text columns that are not stored
+    dropColumns: list = field(default_factory=lambda:['filename'])
+
+    def __post_init__(self):
+        buffer = hasattr(self.sourceFile,'read')
+        f = (io.TextIOWrapper if buffer else open)(self.sourceFile,encoding=self.encoding,errors='replace',newline='')
+        reader = csv.reader(f)
+        groups,names,units = [next(reader,[]) for i in range(3)]
+        # the buffer is left open for the body, at its start
+        f.detach().seek(0) if buffer else f.close()
+        date,time = names.index('date'),names.index('time')
+        body = [i for i,name in enumerate(names) if i not in [date,time] and name not in self.dropColumns]
+        self.variableMap = {}
+        group = ''
+        for i,name in enumerate(names):
+            group = groups[i] if i < len(groups) and groups[i] else group
+            if i not in body:
+                continue
+            # names become column file names in the database
+            safeName = re.sub(r'[\\/:*?"<>|]','_',name)
+            self.variableMap[safeName] = {'dtype':self.dtype,'ignore':False,'unit':units[i].strip('[]') if i < len(units) else '','group':group}
+            if safeName != name:
+                self.variableMap[safeName]['originalName'] = name
+        DataFrame = pd.read_csv(self.sourceFile,header=None,names=range(len(names)),skiprows=3,encoding=self.encoding,
+                                dtype={i:('float64' if i in body else str) for i in range(len(names))},keep_default_na=False,na_values={i:[''] for i in body})
+        values = DataFrame[body].to_numpy()
+        values[values == self.fillValue] = np.nan
+        self.DataFrame = pd.DataFrame(values,columns=list(self.variableMap),index=self.timestamps(DataFrame[date],DataFrame[time]))
+        log(f'{self.sourceFile}: {len(self.DataFrame)} records of {len(self.variableMap)} variables',ln=False,verbose=self.verbose)
+
+    def timestamps(self,date,time):
+        # a few thousand rows share each date and a day has 48 times, so only the unique values are converted
+        dateCodes,dates = pd.factorize(date)
+        timeCodes,times = pd.factorize(time)
+        dates = pd.to_datetime(dates,format='%Y-%m-%d').to_numpy()
+        times = pd.to_timedelta([t+':00' for t in times]).to_numpy()
+        index = pd.DatetimeIndex(dates[dateCodes]+times[timeCodes],name='TIMESTAMP')
+        if self.timezone:
+            index = index.tz_localize(self.timezone)
+        return(index)
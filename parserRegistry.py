@@ -0,0 +1,214 @@
+######################################################################################################################
+# Raw file parsers by fileType
+######################################################################################################################
+# Parsers are registered as 'module:attribute' strings and only imported the first time their fileType is used,
+# so pool workers load nothing they don't parse. Third party parsers can be added with registerParser, or by a
+# package that declares an entry point in the 'ecDataPipeline.parsers' group (name = fileType, value = module:attribute)
+# A parser is a class taking sourceFile, verbose and its parserSettings that sets .DataFrame and .variableMap
+# Streaming contract, used by readChunks:
+#   - a parser with streaming = True is constructed with chunkRows, reads only its header (so .variableMap is set),
+#     and its chunks() method yields DataFrames of at most chunkRows rows
+#   - text formats with a fixed header (headerLines) are streamed for any parser, by replaying the header in front of
+#     each run of chunkRows data lines; a line starting with headerPrefix starts a new header (concatenated files)
+#   - framed binary formats (TOB3) are streamed the same way, by replaying the header in front of each run of frames
+#   - anything else is parsed whole and handed out in slices of chunkRows rows
+# A replayed chunk is handed to the parser as an in-memory binary buffer (io.BytesIO) if its entry is fileLike,
+# otherwise it is written to a file of the same name in a temporary folder
+# Text formats can also be read from a byte offset (e.g., the size of a file when it was last read), only the lines
+# from there on are parsed, behind a copy of the header they follow
+from dataclasses import dataclass
+from importlib import import_module
+from itertools import islice
+import contextlib
+import tempfile
+import csv
+import io
+import os
+
+@dataclass(kw_only=True)
+class parserEntry:
+    # a parser class, or 'module:attribute' to import it on first use
+    parser: object
+    # number of header lines of a line-oriented text format, None if the format can't be split by lines
+    headerLines: int = None
+    # first bytes of a header, to find the headers of files that were concatenated
+    headerPrefix: bytes = None
+    # the data behind the header are fixed size frames (TOB3), see frameChunks
+    framed: bool = False
+    # the parser takes a binary buffer as sourceFile, so chunks are not written out to be parsed
+    fileLike: bool = False
+
+parsers = {
+    'TOA5':parserEntry(parser='parseFiles.parseCSI:TOA5',headerLines=4,headerPrefix=b'"TOA5"'),
+    'TOB3':parserEntry(parser='parseFiles.parseCSI:TOB3',headerLines=6,framed=True),
+    'HOBOcsv':parserEntry(parser='parseFiles.parseCSV:HOBO',headerLines=2),
+    'EddyPro':parserEntry(parser='parseEddyPro:EddyPro',headerLines=3,fileLike=True),
+    }
+
+# bytes per value of the TOB3 data types, ASCII(n) fields are n bytes
+frameTypes = {'IEEE4':4,'IEEE4B':4,'IEEE4L':4,'IEEE8':8,'IEEE8B':8,'IEEE8L':8,'FP2':2,'FP4':4,'ULONG':4,'LONG':4,'UINT4':4,'INT4':4,
+              'UINT2':2,'INT2':2,'BOOL':1,'BOOL2':2,'BOOL4':4,'NSec':8,'SecNano':8}
+# bytes of the header (time and record number) and footer (flags and validation stamp) of each TOB3 frame
+frameOverhead = 16
+
+entryPointGroup = 'ecDataPipeline.parsers'
+
+def registerParser(fileType,parser,headerLines=None,headerPrefix=None,framed=False,fileLike=False):
+    if type(headerPrefix) is str:
+        headerPrefix = headerPrefix.encode()
+    parsers[fileType] = parserEntry(parser=parser,headerLines=headerLines,headerPrefix=headerPrefix,framed=framed,fileLike=fileLike)
+
+def entryPoint(fileType):
+    # look for an installed third party parser, only when a fileType is not registered
+    from importlib.metadata import entry_points
+    for ep in entry_points(group=entryPointGroup):
+        if ep.name == fileType:
+            registerParser(fileType,ep.value)
+            return(parsers[fileType])
+    return(None)
+
+def available(fileType):
+    return(fileType in parsers or (fileType is not None and entryPoint(fileType) is not None))
+
+def getEntry(fileType):
+    entry = parsers.get(fileType) or entryPoint(fileType)
+    if entry is None:
+        raise KeyError(f'No parser registered for fileType: {fileType}, known types: {list(parsers)}')
+    if type(entry.parser) is str:
+        module,attribute = entry.parser.split(':')
+        entry.parser = getattr(import_module(module),attribute)
+    return(entry)
+
+def getParser(fileType):
+    return(getEntry(fileType).parser)
+
+def seekable(fileType):
+    # text formats that can be read from an offset by readChunks
+    entry = getEntry(fileType)
+    return(bool(entry.headerLines) and not entry.framed and not getattr(entry.parser,'streaming',False))
+
+def readChunks(fileType,sourceFile,chunkRows=100000,verbose=False,offset=0,**parserSettings):
+    # parse a file in pieces of at most chunkRows rows, yields parser objects with .DataFrame and .variableMap set
+    # offset only applies to seekable formats, the others are read from the start
+    entry = getEntry(fileType)
+    if getattr(entry.parser,'streaming',False):
+        parsed = entry.parser(sourceFile=sourceFile,verbose=verbose,chunkRows=chunkRows,**parserSettings)
+        for DataFrame in parsed.chunks():
+            parsed.DataFrame = DataFrame
+            yield(parsed)
+    elif entry.framed:
+        yield from frameChunks(entry,sourceFile,chunkRows,verbose,**parserSettings)
+    elif entry.headerLines:
+        yield from textChunks(entry,sourceFile,chunkRows,verbose,offset,**parserSettings)
+    else:
+        parsed = entry.parser(sourceFile=sourceFile,verbose=verbose,**parserSettings)
+        DataFrame = parsed.DataFrame
+        for i in range(0,max(len(DataFrame),1),chunkRows):
+            parsed.DataFrame = DataFrame.iloc[i:i+chunkRows]
+            yield(parsed)
+
+def chunkParser(entry,sourceFile,tmp,verbose=False,**parserSettings):
+    # parse(header,rows) parses a chunk of sourceFile from its header and data as bytes, which are copied as they are,
+    # so encodings, byte order marks and line endings are left as they were
+    def parse(header,rows):
+        if entry.fileLike:
+            chunk = io.BytesIO(b''.join(header+rows))
+        else:
+            chunk = os.path.join(tmp,os.path.basename(sourceFile))
+            with open(chunk,'wb') as out:
+                out.writelines(header)
+                out.writelines(rows)
+        parsed = entry.parser(sourceFile=chunk,verbose=verbose,**parserSettings)
+        if getattr(parsed,'sourceFile',None) is chunk:
+            parsed.sourceFile = sourceFile
+        return(parsed)
+    return(parse)
+
+def chunkFolder(entry):
+    # a temporary folder for the chunks of parsers that only read files
+    return(contextlib.nullcontext() if entry.fileLike else tempfile.TemporaryDirectory(prefix='chunks_'))
+
+def frameChunks(entry,sourceFile,chunkRows,verbose=False,**parserSettings):
+    # a TOB3 file is headerLines of text (the frame size on the second, the data types on the last) followed by fixed size frames
+    # each run of whole frames holding at most chunkRows records (at least one frame) is parsed behind a copy of the header
+    # a partly written frame at the end is left for the next read
+    with chunkFolder(entry) as tmp, open(sourceFile,'rb') as f:
+        parse = chunkParser(entry,sourceFile,tmp,verbose,**parserSettings)
+        header = list(islice(f,entry.headerLines))
+        table = next(csv.reader([header[1].decode('ascii','replace')]))
+        types = next(csv.reader([header[-1].decode('ascii','replace').strip()]))
+        frameSize = int(table[2])
+        sizes = [frameTypes.get(t,int(t[6:-1]) if t.startswith('ASCII(') else None) for t in types]
+        # records per frame, from the size of a record, one if a type is unknown
+        perFrame = max(1,(frameSize-frameOverhead)//sum(sizes)) if None not in sizes and sum(sizes) else 1
+        nFrames = max(1,chunkRows//perFrame) if chunkRows else None
+        parsedAny = False
+        while True:
+            frames = f.read(frameSize*nFrames) if nFrames else f.read()
+            frames = frames[:len(frames)-len(frames)%frameSize]
+            if not frames:
+                break
+            yield(parse(header,[frames]))
+            parsedAny = True
+        if not parsedAny:
+            yield(parse(header,[]))
+
+def textChunks(entry,sourceFile,chunkRows,verbose=False,offset=0,**parserSettings):
+    # each chunk is parsed with a copy of its header, see chunkParser
+    # chunkRows None for no limit, from an offset nothing is yielded if there are no lines past it
+    with chunkFolder(entry) as tmp, open(sourceFile,'rb') as f:
+        parse = chunkParser(entry,sourceFile,tmp,verbose,**parserSettings)
+        header = list(islice(f,entry.headerLines))
+        rows,parsedAny = [],offset>0
+        headerEnd = f.tell()
+        if offset > headerEnd:
+            start = lineStart(f,offset,headerEnd)
+            # a concatenated file continues behind the last header before the offset
+            found = lastHeader(f,entry.headerPrefix,headerEnd-1,start) if entry.headerPrefix else None
+            if found is not None:
+                f.seek(found)
+                header = list(islice(f,entry.headerLines))
+            f.seek(max(start,f.tell()))
+        for line in f:
+            if entry.headerPrefix and line.startswith(entry.headerPrefix):
+                if rows:
+                    yield(parse(header,rows))
+                    rows,parsedAny = [],True
+                header = [line]+list(islice(f,entry.headerLines-1))
+                continue
+            rows.append(line)
+            if chunkRows and len(rows) >= chunkRows:
+                yield(parse(header,rows))
+                rows,parsedAny = [],True
+        if rows or not parsedAny:
+            yield(parse(header,rows))
+
+def lineStart(f,offset,floor=0,blockSize=65536):
+    # position of the start of the line holding byte offset, not before floor
+    pos = offset
+    while pos > floor:
+        start = max(floor,pos-blockSize)
+        f.seek(start)
+        i = f.read(pos-start).rfind(b'\n')
+        if i >= 0:
+            return(start+i+1)
+        pos = start
+    return(floor)
+
+def lastHeader(f,prefix,start,end,blockSize=1<<20):
+    # position of the last line starting with prefix between start and end, None if there is none
+    # the file is scanned as bytes, which is much faster than parsing the lines
+    found,tail = None,b''
+    f.seek(start)
+    pos = start
+    while pos < end:
+        block = f.read(min(blockSize,end-pos))
+        if not block:
+            break
+        data = tail+block
+        i = data.rfind(b'\n'+prefix)
+        if i >= 0:
+            found = pos-len(tail)+i+1
+        tail = data[-len(prefix):]
+        pos += len(block)
+    return(found)
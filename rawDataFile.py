@@ -1,33 +1,205 @@
 
 import os
+import time
+import hashlib
+import numpy as np
 import pandas as pd
-from parseFiles import parseCSI,parseCSV
-import importlib
+from multiprocessing import shared_memory,resource_tracker
 from parseFiles.helperFunctions.asdict_repr import asdict_repr
+import parserRegistry
+from ingestMetrics import peakRSS
 
-importlib.reload(parseCSI)
-importlib.reload(parseCSV)
 
+def fileFingerprint(filePath,hashBlocks=False,blockSize=65536,edgeSize=4096):
+    # size and mtime identify a file version, hashes of the first and last blocks can detect in place edits
+    # without them the last edgeSize bytes are still hashed, so a file that grew is only read as an append if its old end is intact
+    stat = os.stat(filePath)
+    fingerprint = {'size':stat.st_size,'mtime':stat.st_mtime_ns}
+    if hashBlocks:
+        fingerprint['blockSize'] = blockSize
+        fingerprint['headHash'] = hashBlock(filePath,0,blockSize)
+        fingerprint['tailHash'] = hashBlock(filePath,max(0,stat.st_size-blockSize),blockSize)
+    else:
+        fingerprint['edgeSize'] = min(edgeSize,stat.st_size)
+        fingerprint['edgeHash'] = hashBlock(filePath,stat.st_size-fingerprint['edgeSize'],fingerprint['edgeSize'])
+    return(fingerprint)
 
-def loadRawFile(source,fileType=None,parserSettings={},verbose=False):
-    Processor = {
-        'HOBOcsv':parseCSV.HOBO,
-        'TOB3':parseCSI.TOB3,
-        'TOA5':parseCSI.TOA5,
-    }
+def hashBlock(filePath,offset,blockSize):
+    with open(filePath,'rb') as f:
+        f.seek(offset)
+        return(hashlib.md5(f.read(blockSize)).hexdigest())
+
+def fileStatus(filePath,sourceInfo,hashBlocks=False):
+    # classify a file against its fingerprint: new, unchanged, appended, modified, or missing
+    if not os.path.isfile(filePath):
+        return('missing')
+    if not sourceInfo['loaded']:
+        return('new')
+    if 'fingerprint' not in sourceInfo:
+        # loaded before fingerprints were recorded, assume unchanged
+        sourceInfo['fingerprint'] = fileFingerprint(filePath,hashBlocks)
+        return('unchanged')
+    old = sourceInfo['fingerprint']
+    stat = os.stat(filePath)
+    if stat.st_size == old['size'] and stat.st_mtime_ns == old['mtime']:
+        return('unchanged')
+    if stat.st_size > old['size']:
+        # a grown file is only an append if the previously seen bytes are intact
+        # edits before the last edgeSize bytes are only caught with hashBlocks (head and tail blocks)
+        if 'headHash' in old:
+            headSize = min(old['blockSize'],old['size'])
+            tailStart = max(0,old['size']-old['blockSize'])
+            if (hashBlock(filePath,0,headSize) == old['headHash'] and
+                hashBlock(filePath,tailStart,old['size']-tailStart) == old['tailHash']):
+                return('appended')
+        elif 'edgeHash' in old:
+            if hashBlock(filePath,old['size']-old['edgeSize'],old['edgeSize']) == old['edgeHash']:
+                return('appended')
+        else:
+            # fingerprinted before the edge hash was recorded
+            return('appended')
+    return('modified')
+
+def loadRawFile(source,fileType=None,parserSettings={},hashBlocks=False,verbose=False):
+    start = time.perf_counter()
     filePath,sourceInfo = source[0],source[1]
     ID = os.path.split(filePath)[-1].split('.')[0]
-    out = {'filepath':filePath, 'sourceInfo':sourceInfo, 'variableMap':{}, 'DataFrame':pd.DataFrame()}
-    if not sourceInfo['loaded'] and fileType in Processor:
-        loadedFile = Processor[fileType](sourceFile=filePath,verbose=False,**parserSettings)
-        out['sourceInfo']['parserSettings'] = asdict_repr(loadedFile)
+    status = fileStatus(filePath,sourceInfo,hashBlocks)
+    # the status decides how the data are merged, see database.filePolicy
+    out = {'filepath':filePath, 'sourceInfo':sourceInfo, 'variableMap':{}, 'DataFrame':pd.DataFrame(), 'status':status}
+    if status in ['new','appended','modified'] and parserRegistry.available(fileType):
+        lastRecord = sourceInfo.get('lastRecord') if status == 'appended' else None
+        if lastRecord is not None and parserRegistry.seekable(fileType):
+            # only the lines written since the last import are parsed, the fingerprint is taken first so anything
+            # written while the file is read is picked up as the next append
+            fingerprint = fileFingerprint(filePath,hashBlocks)
+            pieces = list(parserRegistry.readChunks(fileType,filePath,chunkRows=None,offset=sourceInfo['fingerprint']['size'],**parserSettings))
+            for loadedFile in pieces:
+                out['variableMap'] = out['variableMap'] | loadedFile.variableMap
+                out['sourceInfo']['parserSettings'] = asdict_repr(loadedFile)
+            DataFrame = pd.concat([loadedFile.DataFrame for loadedFile in pieces]) if pieces else pd.DataFrame()
+        else:
+            loadedFile = parserRegistry.getParser(fileType)(sourceFile=filePath,verbose=False,**parserSettings)
+            fingerprint = fileFingerprint(filePath,hashBlocks)
+            out['sourceInfo']['parserSettings'] = asdict_repr(loadedFile)
+            out['variableMap'] = loadedFile.variableMap
+            DataFrame = loadedFile.DataFrame
         out['sourceInfo']['loaded'] = True
-        out['variableMap'] = loadedFile.variableMap
-        out['DataFrame'] = loadedFile.DataFrame
+        out['sourceInfo']['fingerprint'] = fingerprint
+        out['DataFrame'] = DataFrame
+        if lastRecord is not None and not DataFrame.empty:
+            # only merge the records written since the last import, an append without data rows (e.g., a header) still updates the fingerprint
+            out['DataFrame'] = DataFrame.loc[DataFrame.index > pd.Timestamp(lastRecord)]
+        if not DataFrame.empty:
+            out['sourceInfo']['lastRecord'] = str(DataFrame.index.max())
+    # timed in the worker, the parent process reports it
+    out['metrics'] = {'seconds':time.perf_counter()-start,'rows':len(out['DataFrame']),'bytesRead':out['sourceInfo'].get('fingerprint',{}).get('size',0) if out['sourceInfo'].get('loaded') else 0}
     return(out)
 
+def streamRawFile(source,fileType=None,parserSettings={},hashBlocks=False,chunkRows=100000,verbose=False):
+    # loadRawFile in pieces of at most chunkRows rows, so memory doesn't grow with the size of a file
+    # yields the same dict as loadRawFile for each piece (at least one), only the last updates sourceInfo and counts the file
+    # the others carry a copy that is not marked as loaded, each piece is looked ahead by one so at most two are held
+    start = time.perf_counter()
+    filePath,sourceInfo = source[0],source[1]
+    status = fileStatus(filePath,sourceInfo,hashBlocks)
+    lastRecord = sourceInfo.get('lastRecord') if status == 'appended' else None
+    pending,newest,fingerprint,parsedSettings = None,None,None,None
+    if status in ['new','appended','modified'] and parserRegistry.available(fileType):
+        # taken before reading, anything written while the file is parsed is picked up as an append
+        fingerprint = fileFingerprint(filePath,hashBlocks)
+        # appends to text formats are read from where the last import stopped
+        offset = sourceInfo['fingerprint']['size'] if lastRecord is not None else 0
+        for loadedFile in parserRegistry.readChunks(fileType,filePath,chunkRows=chunkRows,offset=offset,**parserSettings):
+            if pending is not None:
+                pending['metrics'] = {'seconds':time.perf_counter()-start,'files':0,'rows':len(pending['DataFrame']),'bytesRead':0}
+                yield(pending)
+                start = time.perf_counter()
+            DataFrame = loadedFile.DataFrame
+            if not DataFrame.empty:
+                newest = max(newest,DataFrame.index.max()) if newest is not None else DataFrame.index.max()
+            if lastRecord is not None and not DataFrame.empty:
+                DataFrame = DataFrame.loc[DataFrame.index > pd.Timestamp(lastRecord)]
+            pending = {'filepath':filePath, 'sourceInfo':sourceInfo|{'loaded':False,'fingerprint':fingerprint}, 'variableMap':loadedFile.variableMap, 'DataFrame':DataFrame, 'status':status}
+            parsedSettings = asdict_repr(loadedFile)
+    if pending is None:
+        # nothing past the offset (e.g., only a header was appended), the new fingerprint is still recorded below
+        pending = {'filepath':filePath, 'sourceInfo':sourceInfo, 'variableMap':{}, 'DataFrame':pd.DataFrame(), 'status':status}
+    if fingerprint is None:
+        bytesRead = 0
+    else:
+        if parsedSettings is not None:
+            sourceInfo['parserSettings'] = parsedSettings
+        sourceInfo['loaded'] = True
+        sourceInfo['fingerprint'] = fingerprint
+        if newest is not None:
+            sourceInfo['lastRecord'] = str(newest)
+        pending['sourceInfo'] = sourceInfo
+        bytesRead = fingerprint['size']
+    pending['metrics'] = {'seconds':time.perf_counter()-start,'rows':len(pending['DataFrame']),'bytesRead':bytesRead}
+    yield(pending)
+
+def loadRawFileShared(source,**kwargs):
+    # run loadRawFile in a worker and hand the DataFrame back through shared memory rather than pickle
+    out = loadRawFile(source,**kwargs)
+    out['DataFrame'] = toSharedMemory(out['DataFrame'])
+    out['peakRSS'] = peakRSS()
+    return(out)
+
+def toSharedMemory(DataFrame):
+    # copy the numeric columns and a datetime index into one shared memory block
+    # anything else (e.g., string columns) is still sent with the pickled result
+    if DataFrame.empty or not isinstance(DataFrame.index,pd.DatetimeIndex):
+        return(DataFrame)
+    numeric = [col for col in DataFrame.columns if DataFrame[col].dtype.kind in 'biufc']
+    arrays = [('index',DataFrame.index.as_unit('ns').asi8)]+[(col,DataFrame[col].to_numpy()) for col in numeric]
+    shm = shared_memory.SharedMemory(create=True,size=max(1,sum(a.nbytes for _,a in arrays)))
+    # the block belongs to the parent, which unlinks it, so the worker's resource tracker must not clean it up
+    resource_tracker.unregister(shm._name,'shared_memory')
+    layout,offset = [],0
+    for col,array in arrays:
+        np.ndarray(array.shape,dtype=array.dtype,buffer=shm.buf,offset=offset)[:] = array
+        layout.append((col,array.dtype.str,offset,len(array)))
+        offset += array.nbytes
+    packed = {
+        'sharedMemory':shm.name,
+        'layout':layout,
+        'columns':list(DataFrame.columns),
+        'indexName':DataFrame.index.name,
+        'timezone':DataFrame.index.tz,
+        'objects':DataFrame[[col for col in DataFrame.columns if col not in numeric]],
+        }
+    shm.close()
+    return(packed)
+
+def fromSharedMemory(packed):
+    # rebuild a DataFrame from toSharedMemory output and release the block
+    if isinstance(packed,pd.DataFrame):
+        return(packed)
+    shm = shared_memory.SharedMemory(name=packed['sharedMemory'])
+    try:
+        data = {col:np.ndarray((n,),dtype=dtype,buffer=shm.buf,offset=offset).copy() for col,dtype,offset,n in packed['layout']}
+    finally:
+        shm.close()
+        shm.unlink()
+    index = pd.DatetimeIndex(data.pop('index').view('M8[ns]'),name=packed['indexName'])
+    if packed['timezone'] is not None:
+        index = index.tz_localize('UTC').tz_convert(packed['timezone'])
+    DataFrame = pd.DataFrame(data,index=index)
+    for col in packed['objects'].columns:
+        DataFrame[col] = packed['objects'][col].values
+    return(DataFrame[packed['columns']])
+
+def releaseSharedMemory(packed):
+    # unlink the block of a toSharedMemory result that won't be read
+    if isinstance(packed,pd.DataFrame):
+        return
+    shm = shared_memory.SharedMemory(name=packed['sharedMemory'])
+    shm.close()
+    shm.unlink()
+
 # for debuging:
 
 if __name__ == '__main__':
     print('debug: example_data/20240912/Flux_Data2629.dat')
-    TOB3(sourceFile=r'example_data\20240912\Flux_Data2629.dat')
\ No newline at end of file
+    parserRegistry.getParser('TOB3')(sourceFile=r'example_data\20240912\Flux_Data2629.dat')
\ No newline at end of file
@@ -3,16 +3,17 @@
 ######################################################################################################################
 from dataclasses import dataclass,field
 # import helperFunctions as helper
-from parseCoordinates import parseCoordinates
+from parseCoordinates import parseCoordinates,bulkCoordinates,toGeoDataFrame,frameGeojson
 from parseFiles.helperFunctions.updateDict import updateDict
 from parseFiles.helperFunctions.asdict_repr import asdict_repr
 from parseFiles.helperFunctions.log import log
 from pathlib import Path
-import geopandas as gpd
 import pandas as pd
 import datetime
+import copy
 import fnmatch
 import json
+import time
 import yaml
 import os
 import re
@@ -20,6 +21,108 @@ import re
 def safeFormat(string,safeCharacters='[^0-9a-zA-Z]+',safeFill='_'):
     return(re.sub(safeCharacters,safeFill, str(string)))
 
+def siteMap(geojsons,verbose=False):
+    # the web map page for a set of per-site geojsons, as rendered by siteInventory
+    mapTemplate = Path(os.path.join(os.path.dirname(os.path.abspath(__file__)),'config_files','MapTemplate.html')).read_text()
+    combined = {}
+    for geojson in geojsons:
+        if combined == {}:
+            combined = copy.deepcopy(geojson)
+        else:
+            combined = updateDict(combined,geojson,overwrite='append',verbose=verbose)
+    if combined == {}:
+        return(combined,mapTemplate)
+    return(combined,mapTemplate.replace('fieldSitesJson',json.dumps(combined)))
+
+@dataclass(kw_only=True)
+class discoveryIndex:
+    # persistent record of directory mtimes and file stats under a rootPath
+    # directories whose mtime is unchanged are not re-listed, so a rescan only costs a stat per directory
+    # unless they were listed within racyWindow of their mtime: a file added in the same timestamp tick (1-2 s on
+    # some SMB/NFS shares) after the listing leaves the mtime as it was, so they are listed again until the mtime is settled
+    indexFile: str = None
+    matchPattern: str = None
+    rootPath: str = None
+    racyWindow: float = 2.0
+    directories: dict = field(default_factory=lambda:{},repr=False)
+
+    def __post_init__(self):
+        if self.indexFile and os.path.isfile(self.indexFile):
+            with open(self.indexFile) as f:
+                index = json.load(f)
+            # the index is only valid for the search it was built from
+            if index.get('matchPattern') == self.matchPattern and index.get('rootPath') == self.rootPath:
+                self.directories = index['directories']
+
+    def literalPrefix(self):
+        # the part of the pattern before the first wildcard, any matching path must start with it
+        prefix = re.split(r'[*?\[]',self.matchPattern,maxsplit=1)[0]
+        return(os.path.normcase(prefix))
+
+    def scan(self):
+        # walk the tree and return the paths of files in new or modified directories that match the pattern
+        prefix = self.literalPrefix()
+        found = []
+        visited = set()
+        stack = [self.rootPath]
+        while stack:
+            dir = stack.pop()
+            visited.add(dir)
+            try:
+                mtime = os.stat(dir).st_mtime_ns
+            except OSError:
+                continue
+            entry = self.directories.get(dir)
+            if entry is None or entry['mtime'] != mtime or self.racy(entry):
+                entry = {'mtime':mtime,'scanned':time.time_ns(),'files':{},'subdirs':[]}
+                with os.scandir(dir) as contents:
+                    for item in contents:
+                        if item.is_dir(follow_symlinks=False):
+                            entry['subdirs'].append(item.name)
+                        elif item.is_file():
+                            stat = item.stat()
+                            entry['files'][item.name] = [stat.st_size,stat.st_mtime_ns]
+                self.directories[dir] = entry
+                found += [os.path.join(dir,f) for f in entry['files'] if fnmatch.fnmatch(os.path.join(dir,f),self.matchPattern)]
+            for sub in entry['subdirs']:
+                sub = os.path.join(dir,sub)
+                # prune directories that cannot contain a path starting with the literal prefix
+                subPath = os.path.normcase(os.path.join(sub,''))
+                if subPath.startswith(prefix) or prefix.startswith(subPath):
+                    stack.append(sub)
+        # forget directories that have been removed or pruned
+        for dir in [d for d in self.directories if d not in visited]:
+            self.directories.pop(dir)
+        return(found)
+
+    def racy(self,entry):
+        # listed too soon after its last change to be sure nothing was added in the same tick (entries without a scan time are too)
+        return(entry.get('scanned',entry['mtime'])-entry['mtime'] < self.racyWindow*1e9)
+
+    def matches(self):
+        # every file in the index that matches the pattern
+        return([os.path.join(dir,f) for dir,entry in self.directories.items() for f in entry['files'] if fnmatch.fnmatch(os.path.join(dir,f),self.matchPattern)])
+
+    def state(self,current=False):
+        # mtimes of the directories seen by the last scan, or their mtimes now
+        # the two only differ if files or directories were added, removed, or renamed since, or if a directory needs listing again (see racy)
+        if not current:
+            return({dir:entry['mtime'] for dir,entry in self.directories.items()})
+        state = {}
+        for dir,entry in self.directories.items():
+            try:
+                state[dir] = os.stat(dir).st_mtime_ns if not self.racy(entry) else None
+            except OSError:
+                state[dir] = None
+        return(state)
+
+    def save(self):
+        if self.indexFile:
+            os.makedirs(os.path.dirname(os.path.abspath(self.indexFile)),exist_ok=True)
+            with open(self.indexFile+'.tmp','w') as f:
+                json.dump({'matchPattern':self.matchPattern,'rootPath':self.rootPath,'directories':self.directories},f)
+            os.replace(self.indexFile+'.tmp',self.indexFile)
+
 @dataclass(kw_only=True)
 class sourceRecord:
     # executes a file search using wildcard pattern matching cross references against a list of exiting files
@@ -32,16 +135,25 @@ class sourceRecord:
         if self.rootPath and os.path.isdir(self.rootPath):
             self.rootPath = os.path.abspath(self.rootPath)
 
-    def __find_files__(self,fileList=None):
+    def __find_files__(self,fileList=None,indexFile=None,known=None):
+        # known: the paths on record if they are not all in fileList (e.g., looked up in a catalog), see sourceCatalog.knownFiles
         if fileList is not None:
             self.fileList = fileList            
+        if known is None:
+            known = self.fileList
         if self.rootPath and os.path.isdir(self.rootPath):
-            for dir,_,files in os.walk(self.rootPath):
-                self.fileList = self.fileList | {os.path.join(dir,f):{'loaded':False,'parserSettings':{}}
-                            for f in files if
-                            fnmatch.fnmatch(os.path.join(dir,f),self.matchPattern) and
-                            os.path.join(dir,f) not in self.fileList
-                }
+            index = discoveryIndex(indexFile=indexFile,matchPattern=self.matchPattern,rootPath=self.rootPath)
+            if not self.fileList and not known:
+                # nothing on record, so every directory needs to be listed
+                index.directories = {}
+            index.scan()
+            # checked against the whole index rather than the re-listed directories, so files missing from the record are found again
+            newFiles = [filePath for filePath in index.matches() if filePath not in self.fileList and filePath not in known]
+            for filePath in newFiles:
+                self.fileList[filePath] = {'loaded':False,'parserSettings':{}}
+            index.save()
+            return(newFiles)
+        return([])
 
 @dataclass(kw_only=True)
 class measurementRecord:
@@ -50,20 +162,40 @@ class measurementRecord:
     description: str = 'This is a template for defining measurement-level metadata which can be used as an example'
     fileType: str = None
     sampleFrequency: str = None
+    # storage grid in the database (e.g., 30min, 1min, 24h), the project default is used if not set
+    frequency: str = None
     description: str = None
     latitude: float = None
     longitude: float = None
     startDate: str = None
     stopDate: str = None
+    # optional block statistics applied before writing, e.g., {'interval':'30min','covariances':[['Uz','Ts']]}
+    aggregation: dict = None
+    # how incoming data resolve against stored values: keepExisting, overwrite, preferNonNaN, or preferNewest (project default if not set)
+    mergePolicy: str = None
+    # column storage (project default if not set), e.g., {'format':'chunked','codec':'lzma','chunkRows':1440} for mostly empty or high frequency channels
+    storage: dict = None
+    # parse files in pieces of at most this many rows (e.g., 100000), for concatenated or very long files
+    chunkRows: int = None
+    # files per database column: year, month, or day (project default if not set), e.g., day for 10 Hz data
+    partition: str = None
     sourceFiles: sourceRecord = field(default_factory=lambda:{k:v for k,v in sourceRecord.__dict__.items() if k[0:2] != '__'})
     template: bool = field(default=False,repr=False)
     dpath: str = field(default=None,repr=False)
+    # skip the UTM projection and GeoDataFrames
+    headless: bool = field(default=False,repr=False)
+    # bulkCoordinates rows of the site, from siteInventory, the point is not parsed again
+    standardized: object = field(default=None,repr=False)
 
     def __post_init__(self):
         if self.measurementID:
             self.measurementID = safeFormat(self.measurementID)
-            self.coordinates = parseCoordinates(ID=self.measurementID,latitude=self.latitude,longitude=self.longitude,attributes={'description':self.description,'pointClass':type(self).__name__})
-            self.latitude,self.longitude=self.coordinates.latitude,self.coordinates.longitude
+            if self.standardized is None:
+                self.coordinates = parseCoordinates(ID=self.measurementID,latitude=self.latitude,longitude=self.longitude,attributes={'description':self.description,'pointClass':type(self).__name__},spatial=not self.headless)
+                self.latitude,self.longitude=self.coordinates.latitude,self.coordinates.longitude
+            elif self.latitude and self.longitude:
+                point = self.standardized.loc[(self.standardized.index==self.measurementID)&(self.standardized['pointClass']==type(self).__name__)].iloc[-1]
+                self.latitude,self.longitude = float(point['latitude']),float(point['longitude'])
             if type(list(self.sourceFiles.values())[0]) is not dict:
                 self.sourceFiles = {'':self.sourceFiles}
             sobj = map(lambda values :sourceRecord(**values),self.sourceFiles.values())
@@ -83,19 +215,32 @@ class siteRecord:
     landCoverType: str = None
     latitude: float = None
     longitude: float = None
-    coordinates: parseCoordinates = field(default_factory=lambda:parseCoordinates(),repr=False)
+    coordinates: parseCoordinates = field(default_factory=lambda:parseCoordinates(spatial=False),repr=False)
     geojson: dict = field(default_factory=lambda:{},repr=False)
-    geodataframe: gpd.GeoDataFrame = field(default_factory=lambda:gpd.GeoDataFrame(),repr=False)
+    geodataframe: object = field(default=None,repr=False)
     Measurements: measurementRecord = field(default_factory=lambda:{k:v for k,v in measurementRecord.__dict__.items() if k[0:2] != '__'})
     dpath: str = field(default=None,repr=False)
+    # skip the UTM projection and GeoDataFrames, the geojson is still built
+    headless: bool = field(default=False,repr=False)
+    # bulkCoordinates frame from siteInventory, the site and its measurements are not parsed again
+    standardized: object = field(default=None,repr=False)
     
     def __post_init__(self):
+        if not self.headless and self.geodataframe is None:
+            import geopandas as gpd
+            self.geodataframe = gpd.GeoDataFrame()
         if self.siteID:
             if self.Name is None:
                 self.Name = self.siteID
             self.siteID = safeFormat(self.siteID)
-            if self.latitude and self.longitude:
-                self.coordinates = parseCoordinates(ID=self.siteID,latitude=self.latitude,longitude=self.longitude,attributes={'description':self.description,'pointClass':type(self).__name__})
+            if self.standardized is not None:
+                self.standardized = self.standardized.loc[self.standardized['siteID']==self.siteID]
+                if self.latitude and self.longitude:
+                    point = self.standardized.loc[(self.standardized.index==self.siteID)&(self.standardized['pointClass']==type(self).__name__)].iloc[0]
+                    self.latitude,self.longitude = float(point['latitude']),float(point['longitude'])
+                self.geojson = frameGeojson(self.standardized,['description','pointClass'])
+            elif self.latitude and self.longitude:
+                self.coordinates = parseCoordinates(ID=self.siteID,latitude=self.latitude,longitude=self.longitude,attributes={'description':self.description,'pointClass':type(self).__name__},spatial=not self.headless)
                 print(self.coordinates)
                 self.latitude,self.longitude=self.coordinates.latitude,self.coordinates.longitude
                 self.geojson = self.coordinates.geojson
@@ -103,17 +248,20 @@ class siteRecord:
             if type(list(self.Measurements.values())[0]) is not dict:
                 self.Measurements = {'':self.Measurements}
             # map the measurements and unpack to dict
-            Measurements = map(lambda key :measurementRecord(**self.Measurements[key]),self.Measurements)
+            Measurements = map(lambda key :measurementRecord(**self.Measurements[key]|{'headless':self.headless,'standardized':self.standardized}),self.Measurements)
             self.Measurements = {measurement.measurementID:measurement for measurement in Measurements}
             for measurementID in self.Measurements:
-                if self.Measurements[measurementID].coordinates == {}:
+                if self.standardized is not None:
+                    break
+                elif self.Measurements[measurementID].coordinates == {}:
                     pass
                 elif self.geojson == {}:
                     self.geojson = self.Measurements[measurementID].coordinates.geojson
                     self.geodataframe = self.Measurements[measurementID].coordinates.geodataframe
                 else:
                     self.geojson = updateDict(self.geojson,self.Measurements[measurementID].coordinates.geojson,overwrite='append')
-                    self.geodataframe = pd.concat([self.geodataframe,self.Measurements[measurementID].coordinates.geodataframe])
+                    if not self.headless:
+                        self.geodataframe = pd.concat([self.geodataframe,self.Measurements[measurementID].coordinates.geodataframe])
             self.Measurements = {measurementID:asdict_repr(self.Measurements[measurementID]) for measurementID in self.Measurements}
 
 @dataclass(kw_only=True)
@@ -122,14 +270,25 @@ class siteInventory:
     verbose: bool = False
     template: bool = False
     spatialInventory: dict = field(default_factory=lambda:{})
+    headless: bool = False
+    # every site and measurement point, projected in one pass
+    geodataframe: object = field(default=None,repr=False)
+    # the same points as a bulkCoordinates frame (not projected when headless)
+    coordinates: object = field(default=None,repr=False)
     mapTemplate: str = field(default_factory=lambda:Path(os.path.join(os.path.dirname(os.path.abspath(__file__)),'config_files','MapTemplate.html')).read_text())
 
     def __post_init__(self):
         if type(self.Sites) is str and os.path.isfile(self.Sites):
             with open(self.Sites) as f:
                 self.Sites = yaml.safe_load(f)
-        Sites = map(lambda key: siteRecord(**self.Sites[key]),self.Sites)
+        # every site and measurement point is parsed (and projected) in one bulkCoordinates call, the records take their coordinates from it
+        self.coordinates = self.bulkCoordinates()
+        Sites = map(lambda key: siteRecord(**self.Sites[key]|{'headless':True,'standardized':self.coordinates}),self.Sites)
         self.Sites = {site.siteID:site for site in Sites}
+        if not self.headless:
+            self.geodataframe = toGeoDataFrame(self.coordinates)
+            for siteID in self.Sites:
+                self.Sites[siteID].geodataframe = self.geodataframe.loc[self.geodataframe['siteID']==siteID]
         for siteID in self.Sites:
             if self.Sites[siteID].coordinates == {}:
                 pass
@@ -145,3 +304,23 @@ class siteInventory:
             self.mapTemplate = self.mapTemplate.replace('fieldSitesJson',json.dumps(self.spatialInventory['geojson']))
 
         self.Sites = {siteID:asdict_repr(self.Sites[siteID]) for siteID in self.Sites}
+
+    def bulkCoordinates(self):
+        # the points of the raw site records, with IDs formatted the way the records format them
+        points = []
+        for site in self.Sites.values():
+            siteID = site.get('siteID',siteRecord.siteID)
+            if not siteID:
+                continue
+            siteID = safeFormat(siteID)
+            if site.get('latitude') and site.get('longitude'):
+                points.append((siteID,siteID,siteRecord.__name__,site.get('description',siteRecord.description),site['latitude'],site['longitude']))
+            Measurements = site.get('Measurements',{})
+            if Measurements and type(list(Measurements.values())[0]) is not dict:
+                Measurements = {'':Measurements}
+            for measurement in Measurements.values():
+                if measurement.get('measurementID',measurementRecord.measurementID) and measurement.get('latitude') and measurement.get('longitude'):
+                    points.append((safeFormat(measurement.get('measurementID',measurementRecord.measurementID)),siteID,measurementRecord.__name__,measurement.get('description'),measurement['latitude'],measurement['longitude']))
+        ID,siteID,pointClass,description,latitude,longitude = zip(*points) if points else [()]*6
+        return(bulkCoordinates(ID=list(ID),latitude=list(latitude),longitude=list(longitude),spatial=not self.headless,
+                               attributes={'siteID':list(siteID),'pointClass':list(pointClass),'description':list(description)}))
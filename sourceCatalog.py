@@ -0,0 +1,239 @@
+######################################################################################################################
+# Raw file catalogs
+######################################################################################################################
+# Per-measurement inventory of source files, either as Sites/<siteID>/<measurementID>/sourceFiles.yml (default)
+# or as rows in a project level sqlite database, indexed by site, measurement, matchPattern, path and loaded state
+# A search starts from the source records (sources), checks found files against those on record (known), and parses
+# the files on record that are not loaded yet or changed since (candidates). The yaml inventory is one document, so
+# sources gives all of it, while the sqlite catalog answers each of these from its indexes
+from dataclasses import dataclass,field
+from metadataStore import metadataStore,SafeDumper
+import threading
+import hashlib
+import sqlite3
+import json
+import copy
+import yaml
+import os
+
+def sourceCatalog(backend='yaml',projectPath=None,store=None):
+    # pick a catalog backend by name
+    if backend == 'yaml':
+        return(yamlCatalog(projectPath=projectPath,store=store or metadataStore()))
+    elif backend == 'sqlite':
+        return(sqliteCatalog(projectPath=projectPath))
+    raise ValueError(f'Unknown catalog backend: {backend}')
+
+@dataclass(kw_only=True)
+class yamlCatalog:
+    projectPath: str
+    store: object = field(default=None,repr=False)
+
+    def filename(self,siteID,measurementID):
+        return(os.path.join(self.projectPath,'Sites',siteID,measurementID,'sourceFiles.yml'))
+
+    def load(self,siteID,measurementID,template={}):
+        return(self.store.load(self.filename(siteID,measurementID),template=template))
+
+    def sources(self,siteID,measurementID,template={}):
+        # the document holds the files with the source records
+        return(self.load(siteID,measurementID,template))
+
+    def known(self,siteID,measurementID,matchPattern):
+        # None: the files on record are those in the fileList given by sources
+        return(None)
+
+    def candidates(self,siteID,measurementID,matchPattern,changed):
+        # every file on record is in the fileList given by sources
+        return({})
+
+    def upsertFiles(self,siteID,measurementID,matchPattern,files):
+        # the yaml file is always written out in full by save
+        pass
+
+    def save(self,siteID,measurementID,sourceInventory):
+        self.store.stage(sourceInventory,self.filename(siteID,measurementID),anchors=True)
+
+    def pending(self,siteID,measurementID,matchPattern=None):
+        # paths of files that have not been loaded yet
+        sourceInventory = self.load(siteID,measurementID)
+        return([path for pattern,source in sourceInventory.items() if matchPattern in (None,pattern)
+                for path,info in (source.get('fileList') or {}).items() if not info.get('loaded')])
+
+    def export(self,siteID,measurementID,filename=None):
+        self.store.flush()
+        if filename is None:
+            return(self.filename(siteID,measurementID))
+        os.makedirs(os.path.dirname(os.path.abspath(filename)),exist_ok=True)
+        with open(filename,'w') as f:
+            yaml.dump(self.load(siteID,measurementID),f,Dumper=SafeDumper,sort_keys=False)
+        return(filename)
+
+    def close(self):
+        # staged documents are written by the store's owner
+        pass
+
+@dataclass(kw_only=True)
+class knownFiles:
+    # the paths on record for a source, answered by indexed lookups rather than by loading them all
+    catalog: object = field(repr=False)
+    siteID: str
+    measurementID: str
+    matchPattern: str
+
+    def __contains__(self,path):
+        return(self.catalog.lookup(path,self.siteID,self.measurementID,self.matchPattern) is not None)
+
+    def __len__(self):
+        return(self.catalog.count(self.siteID,self.measurementID,self.matchPattern))
+
+@dataclass(kw_only=True)
+class sqliteCatalog:
+    projectPath: str
+    dbFile: str = None
+    lock: threading.RLock = field(default_factory=threading.RLock,repr=False)
+
+    def __post_init__(self):
+        if self.dbFile is None:
+            self.dbFile = os.path.join(self.projectPath,'Sites','.sourceCatalog.sqlite')
+        os.makedirs(os.path.dirname(self.dbFile),exist_ok=True)
+        self.connection = sqlite3.connect(self.dbFile,check_same_thread=False)
+        with self.lock, self.connection as con:
+            con.execute('PRAGMA journal_mode=WAL')
+            con.execute('''CREATE TABLE IF NOT EXISTS sources (
+                siteID TEXT, measurementID TEXT, matchPattern TEXT, record TEXT,
+                PRIMARY KEY (siteID, measurementID, matchPattern))''')
+            # parser settings are shared by many files, so they are stored once and referenced by hash
+            con.execute('CREATE TABLE IF NOT EXISTS settings (hash TEXT PRIMARY KEY, settings TEXT)')
+            con.execute('''CREATE TABLE IF NOT EXISTS files (
+                siteID TEXT, measurementID TEXT, matchPattern TEXT, path TEXT,
+                loaded INTEGER, settingsHash TEXT, info TEXT,
+                PRIMARY KEY (siteID, measurementID, matchPattern, path))''')
+            con.execute('CREATE INDEX IF NOT EXISTS filesLoaded ON files (siteID, measurementID, matchPattern, loaded)')
+            con.execute('CREATE INDEX IF NOT EXISTS filesPath ON files (path)')
+
+    def settingsHash(self,settings):
+        text = json.dumps(settings,sort_keys=True,default=str)
+        return(hashlib.md5(text.encode()).hexdigest(),text)
+
+    def load(self,siteID,measurementID,template={}):
+        # rebuild the nested sourceInventory dict, files with identical parser settings share one dict
+        with self.lock:
+            sources = self.connection.execute('SELECT matchPattern, record FROM sources WHERE siteID=? AND measurementID=?',(siteID,measurementID)).fetchall()
+            files = self.connection.execute('SELECT matchPattern, path, loaded, settingsHash, info FROM files WHERE siteID=? AND measurementID=?',(siteID,measurementID)).fetchall()
+            if not sources and not files:
+                return(copy.deepcopy(template))
+            settings = {h:json.loads(s) for h,s in self.connection.execute('SELECT hash, settings FROM settings')}
+        # every source has a fileList, as in the yaml inventory
+        sourceInventory = {matchPattern:json.loads(record)|{'fileList':{}} for matchPattern,record in sources}
+        for matchPattern,path,loaded,settingsHash,info in files:
+            # files are upserted as they are found, before their source record is saved, so a run interrupted in between
+            # leaves files without a record, the rest of the record is filled in from the measurement by rawFileDiscover
+            source = sourceInventory.setdefault(matchPattern,{'matchPattern':matchPattern})
+            source.setdefault('fileList',{})[path] = {'loaded':bool(loaded),'parserSettings':settings.get(settingsHash,{})}|json.loads(info)
+        return(sourceInventory)
+
+    def sources(self,siteID,measurementID,template={}):
+        # the source records with empty file lists, the files are looked up as a search needs them (see known and candidates)
+        with self.lock:
+            sources = self.connection.execute('SELECT matchPattern, record FROM sources WHERE siteID=? AND measurementID=?',(siteID,measurementID)).fetchall()
+            patterns = self.connection.execute('SELECT DISTINCT matchPattern FROM files WHERE siteID=? AND measurementID=?',(siteID,measurementID)).fetchall()
+        if not sources and not patterns:
+            return(copy.deepcopy(template))
+        sourceInventory = {matchPattern:json.loads(record)|{'fileList':{}} for matchPattern,record in sources}
+        for matchPattern, in patterns:
+            sourceInventory.setdefault(matchPattern,{'matchPattern':matchPattern,'fileList':{}})
+        return(sourceInventory)
+
+    def known(self,siteID,measurementID,matchPattern):
+        return(knownFiles(catalog=self,siteID=siteID,measurementID=measurementID,matchPattern=matchPattern))
+
+    def candidates(self,siteID,measurementID,matchPattern,changed):
+        # {path: sourceInfo} of the files not loaded yet, and of loaded files for which changed(path,sourceInfo) is true
+        # only the fingerprints of loaded files are read to check them, full entries are looked up for the files returned
+        with self.lock:
+            loaded = self.connection.execute('SELECT path, info FROM files WHERE siteID=? AND measurementID=? AND matchPattern=? AND loaded=1',
+                                             (siteID,measurementID,matchPattern)).fetchall()
+        paths = self.pending(siteID,measurementID,matchPattern)+[path for path,info in loaded if changed(path,{'loaded':True}|json.loads(info))]
+        return({path:self.entry(self.lookup(path,siteID,measurementID,matchPattern)) for path in paths})
+
+    def entry(self,found):
+        # a lookup result as a fileList entry
+        return({k:v for k,v in found.items() if k not in ['siteID','measurementID','matchPattern']})
+
+    def writeFiles(self,con,siteID,measurementID,matchPattern,files):
+        # insert or update a set of {path: sourceInfo} entries in the caller's transaction
+        rows,settings = [],{}
+        for path,sourceInfo in files.items():
+            h,text = self.settingsHash(sourceInfo.get('parserSettings',{}))
+            settings[h] = text
+            info = {k:v for k,v in sourceInfo.items() if k not in ['loaded','parserSettings']}
+            rows.append((siteID,measurementID,matchPattern,path,int(sourceInfo.get('loaded',False)),h,json.dumps(info,default=str)))
+        con.executemany('INSERT OR IGNORE INTO settings VALUES (?,?)',settings.items())
+        con.executemany('''INSERT INTO files VALUES (?,?,?,?,?,?,?)
+            ON CONFLICT (siteID, measurementID, matchPattern, path) DO UPDATE SET
+            loaded=excluded.loaded, settingsHash=excluded.settingsHash, info=excluded.info''',rows)
+
+    def upsertFiles(self,siteID,measurementID,matchPattern,files):
+        # bulk insert or update a set of {path: sourceInfo} entries in one transaction
+        with self.lock, self.connection as con:
+            self.writeFiles(con,siteID,measurementID,matchPattern,files)
+
+    def save(self,siteID,measurementID,sourceInventory):
+        # file entries are kept current by upsertFiles, only the source records are written here, in one transaction
+        # entries that have never been upserted (e.g., from an older yaml inventory) are added
+        # sources left out of the inventory (e.g., the template's once real sources are added) are dropped with their files, as from a yaml inventory
+        with self.lock, self.connection as con:
+            for table in ['sources','files']:
+                con.execute(f'DELETE FROM {table} WHERE siteID=? AND measurementID=? AND matchPattern NOT IN ({",".join("?"*len(sourceInventory))})',
+                            [siteID,measurementID,*sourceInventory])
+            for matchPattern,record in sourceInventory.items():
+                con.execute('INSERT OR REPLACE INTO sources VALUES (?,?,?,?)',
+                    (siteID,measurementID,matchPattern,json.dumps({k:v for k,v in record.items() if k != 'fileList'},default=str)))
+                if len(record.get('fileList') or {}) > self.count(siteID,measurementID,matchPattern):
+                    self.writeFiles(con,siteID,measurementID,matchPattern,record['fileList'])
+
+    def count(self,siteID,measurementID,matchPattern=None,loaded=None):
+        query,args = 'SELECT COUNT(*) FROM files WHERE siteID=? AND measurementID=?',[siteID,measurementID]
+        if matchPattern is not None:
+            query,args = query+' AND matchPattern=?',args+[matchPattern]
+        if loaded is not None:
+            query,args = query+' AND loaded=?',args+[int(loaded)]
+        with self.lock:
+            return(self.connection.execute(query,args).fetchone()[0])
+
+    def lookup(self,path,siteID=None,measurementID=None,matchPattern=None):
+        # indexed lookup of a single file entry
+        query,args = 'SELECT siteID, measurementID, matchPattern, loaded, settingsHash, info FROM files WHERE path=?',[path]
+        if siteID is not None:
+            query,args = query+' AND siteID=? AND measurementID=?',args+[siteID,measurementID]
+        if matchPattern is not None:
+            query,args = query+' AND matchPattern=?',args+[matchPattern]
+        with self.lock:
+            row = self.connection.execute(query,args).fetchone()
+            if row is None:
+                return(None)
+            settings = self.connection.execute('SELECT settings FROM settings WHERE hash=?',(row[4],)).fetchone()
+        return({'siteID':row[0],'measurementID':row[1],'matchPattern':row[2],
+                'loaded':bool(row[3]),'parserSettings':json.loads(settings[0]) if settings else {}}|json.loads(row[5]))
+
+    def pending(self,siteID,measurementID,matchPattern=None):
+        # paths of files that have not been loaded yet
+        query,args = 'SELECT path FROM files WHERE siteID=? AND measurementID=? AND loaded=0',[siteID,measurementID]
+        if matchPattern is not None:
+            query,args = query+' AND matchPattern=?',args+[matchPattern]
+        with self.lock:
+            return([row[0] for row in self.connection.execute(query,args)])
+
+    def export(self,siteID,measurementID,filename=None):
+        # write the yaml form of a measurement's inventory for review
+        if filename is None:
+            filename = os.path.join(self.projectPath,'Sites',siteID,measurementID,'sourceFiles.yml')
+        os.makedirs(os.path.dirname(filename),exist_ok=True)
+        with open(filename,'w') as f:
+            yaml.dump(self.load(siteID,measurementID),f,Dumper=SafeDumper,sort_keys=False)
+        return(filename)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,30 @@
+import json
+import numpy as np
+import pandas as pd
+from blockAggregator import blockAggregator
+
+rng = np.random.default_rng(0)
+index = pd.date_range('2024-03-01 00:00:01',periods=5400,freq='1s')
+data = pd.DataFrame({'w':rng.normal(size=len(index)),'T':rng.normal(size=len(index))},index=index)
+
+def test_intervalSplitAcrossIngests():
+    # 00:40 splits the interval ending 01:00 between two runs, the second completes it from the moments the first held
+    reference = blockAggregator(covariances=[['w','T']])
+    single = pd.concat([reference.update(data),reference.flush()]).sort_index()
+    first = blockAggregator(covariances=[['w','T']])
+    written = pd.concat([first.update(data.iloc[:2400],'a.dat'),first.flush()])
+    assert written.loc['2024-03-01 01:00','w_count'] == 600
+    record = json.loads(json.dumps(first.record()))
+    second = blockAggregator(covariances=[['w','T']])
+    second.restore(record)
+    completed = pd.concat([second.update(data.iloc[2400:],'b.dat'),second.flush()]).sort_index()
+    assert np.allclose(completed.loc['2024-03-01 01:00'],single.loc['2024-03-01 01:00'])
+    assert second.record()['held'] == {}
+
+def test_restoreSkipsReparsedFiles():
+    first = blockAggregator()
+    first.update(data.iloc[:2400],'a.dat')
+    first.flush()
+    second = blockAggregator()
+    second.restore(first.record(),exclude=['a.dat'])
+    assert second.pending == {}
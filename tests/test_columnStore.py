@@ -0,0 +1,68 @@
+import os
+import threading
+import numpy as np
+import pytest
+import columnStore
+
+def write(path,value,**kwargs):
+    return(columnStore.writeColumns(str(path),{'x':np.full(4,value,dtype='float64')},**kwargs))
+
+def read(path):
+    return(columnStore.readColumn(str(path),'x','float64').tolist())
+
+def test_interruptedBeforeCommit(tmp_path,monkeypatch):
+    # a write stopped before its journal is in place is rolled back, the last committed columns are read
+    write(tmp_path,1.)
+    replace = os.replace
+    def crash(src,dst):
+        if dst.endswith(columnStore.journalFile):
+            raise KeyboardInterrupt
+        replace(src,dst)
+    monkeypatch.setattr(os,'replace',crash)
+    with pytest.raises(KeyboardInterrupt):
+        write(tmp_path,2.)
+    monkeypatch.undo()
+    assert read(tmp_path) == [1.]*4
+    with columnStore.yearLock(path=str(tmp_path)):
+        assert not [f for f in os.listdir(tmp_path) if f.endswith('.tmp')]
+    assert read(tmp_path) == [1.]*4
+
+def test_interruptedAfterCommit(tmp_path,monkeypatch):
+    # a write stopped after its journal is in place is completed by the next reader, through the lock
+    write(tmp_path,1.)
+    monkeypatch.setattr(columnStore,'rollForward',lambda path:False)
+    write(tmp_path,2.)
+    monkeypatch.undo()
+    assert os.path.exists(tmp_path/columnStore.journalFile)
+    assert columnStore.consistentRead(str(tmp_path),lambda:read(tmp_path)) == [2.]*4
+    assert not os.path.exists(tmp_path/columnStore.journalFile)
+
+def test_truncatedColumn(tmp_path):
+    write(tmp_path,1.)
+    with open(tmp_path/'x','r+b') as f:
+        f.truncate(16)
+    with pytest.raises(ValueError):
+        read(tmp_path)
+
+def test_writersSerialized(tmp_path):
+    # read-modify-write under the lock from several threads loses no update
+    write(tmp_path,0.)
+    def increment():
+        for i in range(10):
+            with columnStore.yearLock(path=str(tmp_path),poll=0.001):
+                write(tmp_path,read(tmp_path)[0]+1)
+    threads = [threading.Thread(target=increment) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert read(tmp_path) == [40.]*4
+
+def test_staleLockBroken(tmp_path,monkeypatch):
+    # a lock left by a process that no longer exists doesn't block the next writer
+    with open(tmp_path/'.lock','w') as f:
+        f.write(f'{columnStore.socket.gethostname()} 999999 1 0')
+    monkeypatch.setattr(columnStore,'pidExists',lambda pid:False)
+    with columnStore.yearLock(path=str(tmp_path),timeout=1) as lock:
+        assert lock.holder() == lock.token
+    assert not os.path.exists(tmp_path/'.lock')
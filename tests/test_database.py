@@ -0,0 +1,212 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import dbPipeline
+
+header = '"TOA5","x"\n"TIMESTAMP","RECORD","TA"\n"TS","RN","C"\n"","","Avg"\n'
+
+def writeTOA5(filePath,index,values,mtime=None):
+    with open(filePath,'w') as f:
+        f.write(header+''.join(f'"{t:%Y-%m-%d %H:%M:%S}",{i},{v}\n' for i,(t,v) in enumerate(zip(index,values))))
+    if mtime is not None:
+        os.utime(filePath,ns=(mtime,mtime))
+
+def settle(folder):
+    # move a folder's mtime out of the window in which discoveryIndex lists it again
+    mtime = os.stat(folder).st_mtime_ns-10**10
+    os.utime(folder,ns=(mtime,mtime))
+
+def makeProject(tmp_path,project='project',options={},**measurement):
+    # a project with one TOA5 measurement (S1/Met) reading raw/*.dat, nothing is ingested yet
+    raw = tmp_path/'raw'
+    raw.mkdir(exist_ok=True)
+    pattern = os.path.join(str(raw),'*.dat')
+    sites = {'S1':{'siteID':'S1','Measurements':{'Met':{'measurementID':'Met','fileType':'TOA5','sourceFiles':{pattern:{'matchPattern':pattern,'rootPath':str(raw)}}}|measurement}}}
+    db = dbPipeline.database(projectPath=str(tmp_path/project),template=False,headless=True,enableParallel=False,loadNew=False,**options)
+    db.projectInventory(newSites=sites)
+    db.close()
+    return(raw)
+
+def ingest(tmp_path,project='project',**kwargs):
+    db = dbPipeline.database(projectPath=str(tmp_path/project),headless=True,enableParallel=False,**kwargs)
+    db.rawFileSearch('S1','Met')
+    db.close()
+    return(db)
+
+def test_modifiedFileKeepsNeighbourInBoundary(tmp_path):
+    # 1 s data split at 00:40, so the interval ending 01:00 takes samples from both files
+    raw = makeProject(tmp_path,aggregation={'interval':'30min'})
+    index = pd.date_range('2024-03-01 00:00:01',periods=5400,freq='1s')
+    values = np.arange(len(index),dtype='float64')
+    writeTOA5(raw/'a.dat',index[:2400],values[:2400])
+    writeTOA5(raw/'b.dat',index[2400:],values[2400:])
+    db = ingest(tmp_path)
+    first = db.read('S1','Met')
+    assert first.loc['2024-03-01 01:00','TA_count'] == 1800
+    assert 'RECORD_mean' not in first.columns
+    # a value in the first file is corrected, the boundary interval still holds the second file's samples
+    values[2000] = -1000
+    writeTOA5(raw/'a.dat',index[:2400],values[:2400],mtime=os.stat(raw/'a.dat').st_mtime_ns+10**9)
+    db = ingest(tmp_path)
+    second = db.read('S1','Met')
+    assert second.loc['2024-03-01 01:00','TA_count'] == 1800
+    assert np.isclose(second.loc['2024-03-01 01:00','TA_mean'],values[1800:3600].mean())
+    assert np.isclose(second.loc['2024-03-01 01:30','TA_mean'],first.loc['2024-03-01 01:30','TA_mean'])
+
+def countSearches(monkeypatch):
+    searched = []
+    search = dbPipeline.database.rawFileSearch
+    monkeypatch.setattr(dbPipeline.database,'rawFileSearch',lambda self,siteID=None,measurementID=None,kwargs={}:searched.append((siteID,measurementID)) or search(self,siteID,measurementID,kwargs))
+    return(searched)
+
+def test_templateProjectNotSearchedAgain(tmp_path,monkeypatch):
+    # the template measurement has no rootPath, once searched it is skipped until something changes
+    searched = countSearches(monkeypatch)
+    for i in range(3):
+        dbPipeline.database(projectPath=str(tmp_path/'project'),headless=True,enableParallel=False).close()
+    assert searched == [('siteID','measurementID')]
+
+def test_unparsableFilesNotSearchedAgain(tmp_path,monkeypatch):
+    # files of a fileType without a parser stay unloaded, which doesn't bring the measurement back until they change
+    raw = makeProject(tmp_path,fileType='notAParser')
+    writeTOA5(raw/'a.dat',pd.date_range('2024-01-01',periods=4,freq='30min'),range(4))
+    settle(raw)
+    searched = countSearches(monkeypatch)
+    for i in range(4):
+        db = dbPipeline.database(projectPath=str(tmp_path/'project'),headless=True,enableParallel=False)
+        db.close()
+    assert db.catalog.pending('S1','Met') == [str(raw/'a.dat')]
+    # sources are added by the first search and scanned by the second
+    assert searched == [('S1','Met')]*2
+    writeTOA5(raw/'b.dat',pd.date_range('2024-01-02',periods=4,freq='30min'),range(4))
+    dbPipeline.database(projectPath=str(tmp_path/'project'),headless=True,enableParallel=False).close()
+    assert searched == [('S1','Met')]*3
+
+def test_projectsDontShareStores(tmp_path):
+    # flushing one project doesn't write what another staged
+    first = dbPipeline.database(projectPath=str(tmp_path/'first'),headless=True,enableParallel=False)
+    second = dbPipeline.database(projectPath=str(tmp_path/'second'),headless=True,enableParallel=False)
+    assert first.store is not second.store
+    second.save({'x':1},str(tmp_path/'second'/'staged.yml'))
+    first.flush()
+    assert not (tmp_path/'second'/'staged.yml').exists()
+    second.close()
+    assert (tmp_path/'second'/'staged.yml').exists()
+
+def test_schedulerWritesWithoutCpuSlot(tmp_path,monkeypatch):
+    # the scheduler imports as rawFileImport does, the cpu slot is given up for every write, also those made while parsing
+    from ingestScheduler import ingestScheduler
+    raw = makeProject(tmp_path)
+    slots = []
+    writePartition = dbPipeline.databaseFolder.writePartition
+    for batchImport in [True,False]:
+        writeTOA5(raw/f'{batchImport}.dat',pd.date_range(f'2024-01-0{1+batchImport} 00:30',periods=4,freq='30min'),range(4))
+        db = dbPipeline.database(projectPath=str(tmp_path/'project'),headless=True,enableParallel=False,loadNew=False,batchImport=batchImport)
+        scheduler = ingestScheduler(db=db,cpuWorkers=1)
+        monkeypatch.setattr(dbPipeline.databaseFolder,'writePartition',lambda self,*args:slots.append(scheduler.cpuLimit._value) or writePartition(self,*args))
+        for i in range(2):
+            assert scheduler.run([('S1','Met')]) == {}
+        db.close()
+    assert len(slots) == 2 and set(slots) == {1}
+    assert len(db.read('S1','Met')['TA'].dropna()) == 8
+
+def test_readVariablesByMeasurement(tmp_path):
+    # a dict of variables only selects columns of the measurements it names, the others are read in full
+    db = dbPipeline.database(projectPath=str(tmp_path/'project'),headless=True,enableParallel=False,loadNew=False)
+    index = pd.date_range('2024-01-01 00:30',periods=4,freq='30min')
+    for measurementID in ['A','B']:
+        dataIn = pd.DataFrame({'x':np.arange(4.),'y':np.arange(4.)},index=index)
+        dbPipeline.databaseFolder(path=str(tmp_path/'project'/'database'/'S1'/measurementID),dataIn=dataIn,variableMap={c:{'dtype':'float64','ignore':False} for c in dataIn},verbose=False)
+    assert sorted(db.read('S1',['A','B'],variables={'A':['x']}).columns) == ['A.x','B.x','y']
+    with pytest.raises(ValueError):
+        db.read('S1',['A'],variables={'B':['x']})
+    db.close()
+
+def test_batchImportMergesOnce(tmp_path,monkeypatch):
+    # overlapping files across a year end are merged as they are one by one, with one write per year
+    raw = makeProject(tmp_path)
+    index = pd.date_range('2023-12-31 22:00',periods=8,freq='30min')
+    writeTOA5(raw/'a.dat',index[:5],[1.]*5)
+    writeTOA5(raw/'b.dat',index[3:],[2.]*5)
+    writePartition = dbPipeline.databaseFolder.writePartition
+    writes = []
+    monkeypatch.setattr(dbPipeline.databaseFolder,'writePartition',lambda self,part,dataset:writes.append(str(part)) or writePartition(self,part,dataset))
+    batched = ingest(tmp_path).read('S1','Met')['TA'].dropna()
+    assert sorted(writes) == ['2023','2024']
+    # the first file keeps the overlapping rows (keepExisting)
+    assert batched.tolist() == [1.]*5+[2.]*3
+    # the same files in a new project, written file by file
+    (tmp_path/'project').rename(tmp_path/'batched')
+    makeProject(tmp_path)
+    single = ingest(tmp_path,batchImport=False).read('S1','Met')['TA'].dropna()
+    pd.testing.assert_series_equal(single,batched)
+
+def test_catalogBackendsAgree(tmp_path,monkeypatch):
+    # the sqlite catalog records what the yaml catalog does, after the first ingest and after new, appended, and modified files
+    # its searches look files up rather than loading the measurement's inventory
+    from sourceCatalog import sqliteCatalog
+    searching,loads = [],[]
+    load,search = sqliteCatalog.load,dbPipeline.database.rawFileSearch
+    monkeypatch.setattr(sqliteCatalog,'load',lambda self,*args,**kwargs:(searching and loads.append(args)) or load(self,*args,**kwargs))
+    def rawFileSearch(self,*args,**kwargs):
+        searching.append(True)
+        try:
+            return(search(self,*args,**kwargs))
+        finally:
+            searching.pop()
+    monkeypatch.setattr(dbPipeline.database,'rawFileSearch',rawFileSearch)
+    index = pd.date_range('2024-01-01 00:30',periods=12,freq='30min')
+    for backend in ['yaml','sqlite']:
+        raw = makeProject(tmp_path,backend,{'catalogBackend':backend})
+    writeTOA5(raw/'a.dat',index[:4],range(4))
+    writeTOA5(raw/'b.dat',index[4:8],range(4,8))
+    def inventories():
+        found = {}
+        for backend in ['yaml','sqlite']:
+            db = ingest(tmp_path,backend,catalogBackend=backend)
+            with dbPipeline.database(projectPath=str(tmp_path/backend),headless=True,enableParallel=False,loadNew=False,catalogBackend=backend) as reader:
+                found[backend] = reader.catalog.load('S1','Met')
+            assert db.read('S1','Met')['TA'].dropna().tolist() == values
+        return(found)
+    values = list(range(8))
+    first = inventories()
+    assert first['yaml'] == first['sqlite'] and len(first['yaml'][str(raw/'*.dat')]['fileList']) == 2
+    with open(raw/'b.dat','a') as f:
+        f.write(f'"{index[8]:%Y-%m-%d %H:%M:%S}",8,8\n')
+    writeTOA5(raw/'a.dat',index[:4],[10,1,2,3],mtime=os.stat(raw/'a.dat').st_mtime_ns+10**9)
+    writeTOA5(raw/'c.dat',index[9:],range(9,12))
+    values = [10]+list(range(1,12))
+    second = inventories()
+    assert second['yaml'] == second['sqlite'] and len(second['yaml'][str(raw/'*.dat')]['fileList']) == 3
+    assert loads == []
+
+def test_sqliteCatalog(tmp_path,monkeypatch):
+    from sourceCatalog import sqliteCatalog
+    catalog = sqliteCatalog(projectPath=str(tmp_path))
+    inventory = {'*.dat':{'matchPattern':'*.dat','rootPath':'raw','fileList':{'a.dat':{'loaded':True,'parserSettings':{'x':1}},'b.dat':{'loaded':False,'parserSettings':{}}}}}
+    catalog.save('S1','Met',inventory)
+    assert catalog.load('S1','Met') == inventory and catalog.pending('S1','Met') == ['b.dat']
+    assert catalog.sources('S1','Met') == {'*.dat':{'matchPattern':'*.dat','rootPath':'raw','fileList':{}}}
+    assert 'a.dat' in catalog.known('S1','Met','*.dat') and 'c.dat' not in catalog.known('S1','Met','*.dat')
+    assert catalog.candidates('S1','Met','*.dat',lambda path,info:False) == {'b.dat':{'loaded':False,'parserSettings':{}}}
+    # a save that fails part way leaves the catalog as it was
+    writeFiles = catalog.writeFiles
+    def fail(*args):
+        writeFiles(*args)
+        raise RuntimeError
+    monkeypatch.setattr(catalog,'writeFiles',fail)
+    changed = {'*.dat':{'matchPattern':'*.dat','rootPath':'moved','fileList':inventory['*.dat']['fileList']|{'c.dat':{'loaded':False,'parserSettings':{}}}}}
+    with pytest.raises(RuntimeError):
+        catalog.save('S1','Met',changed)
+    assert catalog.load('S1','Met') == inventory
+    exported = catalog.export('S1','Met',str(tmp_path/'out'/'sourceFiles.yml'))
+    assert dbPipeline.loadDict(exported) == inventory
+    catalog.close()
+
+def test_yamlExport(tmp_path):
+    db = dbPipeline.database(projectPath=str(tmp_path/'project'),headless=True,enableParallel=False,loadNew=False)
+    db.catalog.save('S1','Met',{'*.dat':{'matchPattern':'*.dat','fileList':{'a.dat':{'loaded':True}}}})
+    exported = db.catalog.export('S1','Met',str(tmp_path/'out.yml'))
+    assert exported == str(tmp_path/'out.yml') and dbPipeline.loadDict(exported)['*.dat']['fileList'] == {'a.dat':{'loaded':True}}
+    db.close()
@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+import pytest
+import dbPipeline
+
+# 20:00 to 02:00 Mountain Standard Time is 03:00 to 09:00 UTC on Jan 1, so every row is in the 2024 (UTC) partitions
+index = pd.date_range('2023-12-31 20:00','2024-01-01 02:00',freq='30min',tz='America/Edmonton')
+
+@pytest.mark.parametrize('partition',['year','month','day'])
+def test_nonUTCPartitions(partition):
+    partitions = dbPipeline.gridPartition(index,'30min',partition)
+    assert list(partitions.unique()) == [pd.Period('2024-01-01',freq=dbPipeline.partitionPeriods[partition])]
+    slots = dbPipeline.gridSlots(dbPipeline.toNanoseconds(index),partitions[0],'30min')
+    assert (slots >= 0).all()
+
+@pytest.mark.parametrize('partition',['year','day'])
+def test_nonUTCWrite(tmp_path,partition):
+    dataIn = pd.DataFrame({'x':np.arange(len(index),dtype='float64')},index=index)
+    written = dbPipeline.databaseFolder(path=str(tmp_path),dataIn=dataIn,variableMap={'x':{'dtype':'float64','ignore':False}},partition=partition,verbose=False)
+    # a write doesn't keep the partitions it merged
+    assert written.dataOut.empty
+    dataOut = dbPipeline.databaseFolder(path=str(tmp_path),start='2024-01-01',end='2024-01-02',verbose=False).dataOut
+    assert dataOut['x'].dropna().tolist() == dataIn['x'].tolist()
+
+@pytest.mark.parametrize('start,end',[('2024-01-01 03:00','2024-01-01 03:00'),('2024-01-01 03:30','2024-01-02'),(None,'2024-01-01 04:00'),('2024-01-01',None)])
+def test_storedPartitionsBetween(tmp_path,start,end):
+    # the partitions computed from start/end match those found by walking the folders
+    dataIn = pd.DataFrame({'x':np.arange(len(index),dtype='float64')},index=index)
+    dbPipeline.databaseFolder(path=str(tmp_path),dataIn=dataIn,variableMap={'x':{'dtype':'float64','ignore':False}},partition='day',verbose=False)
+    assert dbPipeline.storedSetting(str(tmp_path))['partition'] == 'day'
+    walked = dbPipeline.storedPartitions(str(tmp_path),None,start,end)
+    assert dbPipeline.storedPartitions(str(tmp_path),'day',start,end) == walked == [pd.Period('2024-01-01',freq='D')]
+
+@pytest.mark.parametrize('frequency,chunkRows',[('30min',16368),('1min',15840)])
+def test_chunkRowsFromGrid(tmp_path,frequency,chunkRows):
+    # chunked columns are sized from the grid, recorded with the partition, and kept by later writes
+    dataIn = pd.DataFrame({'x':np.arange(len(index),dtype='float64')},index=index)
+    storage = {'format':'chunked','codec':'zlib'}
+    dbPipeline.databaseFolder(path=str(tmp_path),dataIn=dataIn,variableMap={'x':{'dtype':'float64','ignore':False}},frequency=frequency,storage=storage,verbose=False)
+    assert dbPipeline.storedSetting(str(tmp_path))['storage'] == storage|{'chunkRows':chunkRows}
+    dbPipeline.databaseFolder(path=str(tmp_path),dataIn=dataIn+1,variableMap={'x':{'dtype':'float64','ignore':False}},storage=storage,mergePolicy='overwrite',verbose=False)
+    folder = dbPipeline.partitionFolder(str(tmp_path),pd.Period('2024',freq='Y'))
+    assert dbPipeline.columnStore.readChecksums(folder)['x']['chunkRows'] == chunkRows
+    dataOut = dbPipeline.databaseFolder(path=str(tmp_path),start='2024-01-01',end='2024-01-02',verbose=False).dataOut
+    assert dataOut['x'].dropna().tolist() == (dataIn['x']+1).tolist()
+
+@pytest.mark.parametrize('start,end',[(None,None),('2024-01-01 03:00','2024-01-01 03:00'),('2024-01-01 03:10','2024-01-01 05:50'),
+                                      ('2023-06-01',None),(None,'2023-06-01'),('2024-01-02','2023-12-31'),(pd.Timestamp('2023-12-31 22:00',tz='America/Edmonton'),None)])
+def test_gridWindow(start,end):
+    # the slots found from the grid are those a binary search of the stored timestamps finds
+    part = pd.Period('2024-01-01',freq='D')
+    timestamp = dbPipeline.gridTimestamps(part,'30min')
+    first = 0 if start is None else np.searchsorted(timestamp,dbPipeline.utcTimestamp(start).timestamp(),side='left')
+    last = len(timestamp) if end is None else np.searchsorted(timestamp,dbPipeline.utcTimestamp(end).timestamp(),side='right')
+    assert timestamp[slice(*dbPipeline.gridWindow(part,'30min',start,end))].tolist() == timestamp[first:last].tolist()
+
+def test_chunkedWindowRead(tmp_path,monkeypatch):
+    # a window of a chunked partition only decompresses its chunks, and matches the same window of raw storage
+    dataIn = pd.DataFrame({'x':np.arange(len(index),dtype='float64')},index=index)
+    for storage in ['raw','chunked']:
+        dbPipeline.databaseFolder(path=str(tmp_path/storage),dataIn=dataIn,variableMap={'x':{'dtype':'float64','ignore':False}},storage={'format':storage,'chunkRows':24} if storage == 'chunked' else None,verbose=False)
+    decompressed = []
+    compress,decompress = dbPipeline.columnStore.codecs['zlib']
+    monkeypatch.setitem(dbPipeline.columnStore.codecs,'zlib',(compress,lambda data:decompressed.append(data) or decompress(data)))
+    vm,raw = dbPipeline.partitionSlice(str(tmp_path/'raw'),pd.Period('2024',freq='Y'),['x'],'2024-01-01 03:30','2024-01-01 08:00')
+    vm,chunked = dbPipeline.partitionSlice(str(tmp_path/'chunked'),pd.Period('2024',freq='Y'),['x'],'2024-01-01 03:30','2024-01-01 08:00')
+    assert len(chunked['POSIX_timestamp']) == 10
+    # timestamps are raw, x is decompressed from the one chunk holding the window
+    assert len(decompressed) == 1
+    assert all(np.array_equal(raw[col],chunked[col]) for col in raw)
+    assert chunked['x'].tolist() == dataIn['x'].iloc[1:11].tolist()
+
+def test_highFrequencyPartition(tmp_path):
+    # a 50ms (20 Hz) grid is partitioned by day unless told otherwise, so a write merges a day long block rather than a year
+    from memoryBudget import memoryBudget
+    dataIn = pd.DataFrame({'x':np.arange(100,dtype='float64')},index=pd.date_range('2024-07-25 00:00:00.05',periods=100,freq='50ms'))
+    budget = memoryBudget()
+    dbPipeline.databaseFolder(path=str(tmp_path/'day'),dataIn=dataIn,variableMap={'x':{'dtype':'float64','ignore':False}},frequency='50ms',budget=budget,verbose=False)
+    assert dbPipeline.storedSetting(str(tmp_path/'day'))['partition'] == 'day'
+    assert budget.peak == 24*3600*20*8*2
+    with pytest.raises(ValueError):
+        dbPipeline.databaseFolder(path=str(tmp_path/'year'),dataIn=dataIn,variableMap={'x':{'dtype':'float64','ignore':False}},frequency='50ms',partition='year',verbose=False)
+    assert not (tmp_path/'year').exists()
@@ -0,0 +1,44 @@
+import os
+import sys
+import json
+import subprocess
+import pytest
+
+spatialModules = ['geopandas','shapely','pyproj','utm','folium','matplotlib','plotly','bokeh']
+
+script = '''
+import os,sys,json
+import dbPipeline
+projectPath,raw,headless = sys.argv[1],sys.argv[2],sys.argv[3] == 'True'
+pattern = os.path.join(raw,'*.dat')
+sites = {'S1':{'siteID':'S1','latitude':'49.129','longitude':'-122.985','Measurements':{'Met':{'measurementID':'Met','latitude':49.13,'longitude':-122.98,
+    'fileType':'TOA5','sourceFiles':{pattern:{'matchPattern':pattern,'rootPath':raw}}}}}}
+db = dbPipeline.database(projectPath=projectPath,template=False,headless=headless,enableParallel=False)
+db.projectInventory(newSites=sites)
+db.rawFileSearch('S1','Met')
+db.rawFileSearch('S1','Met')
+rows = len(db.read('S1','Met'))
+db.close()
+print(json.dumps({'rows':rows,'modules':sorted({m.split('.')[0] for m in sys.modules if m.split('.')[0] in %r})}))
+''' % spatialModules
+
+def run(tmp_path,headless):
+    # a fresh interpreter, so modules imported by other tests don't count
+    raw = tmp_path/'raw'
+    raw.mkdir()
+    with open(raw/'a.dat','w') as f:
+        f.write('"TOA5","x"\n"TIMESTAMP","RECORD","TA"\n"TS","RN","C"\n"","","Avg"\n'+''.join(f'"2024-03-01 0{i}:00:00",{i},{i}\n' for i in range(1,6)))
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = os.environ|{'PYTHONPATH':os.pathsep.join([root]+[p for p in os.environ.get('PYTHONPATH','').split(os.pathsep) if p])}
+    out = subprocess.run([sys.executable,'-c',script,str(tmp_path/'project'),str(raw),str(headless)],capture_output=True,text=True,env=env,cwd=root)
+    assert out.returncode == 0,out.stderr
+    return(json.loads(out.stdout.strip().splitlines()[-1]))
+
+def test_headlessLoadsNoSpatialModules(tmp_path):
+    # importing dbPipeline, building the inventory of a site with coordinates and ingesting it never loads the spatial or plotting stack
+    result = run(tmp_path,headless=True)
+    assert result['rows'] > 0 and result['modules'] == []
+
+def test_spatialModulesLoadedOtherwise(tmp_path):
+    # the same run with headless=False does use them, so the site above reaches the spatial code
+    assert {'geopandas','pyproj','utm'} <= set(run(tmp_path,headless=False)['modules'])
@@ -0,0 +1,96 @@
+import copy
+import random
+import pytest
+import helperFunctions
+
+def recursiveUpdateDict(base,new,overwrite=False):
+    # the recursive updateDict that the iterative one replaced, as the reference for its outputs
+    if base == new: return(base)
+    for key,value in new.items():
+        if type(base) is dict and key not in base.keys():
+            base[key]=value
+        elif type(value) is dict and type(base[key]) is dict:
+            base[key] = recursiveUpdateDict(base[key],value,overwrite)
+        elif overwrite == True and base[key]!= value:
+            base[key] = value
+        elif overwrite == 'append' and type(base[key]) is list:
+            if type(base[key][0]) is not list and type(value) is list:
+                base[key] = [base[key]]
+            base[key].append(value)
+        elif overwrite == 'append' and type(base[key]) is not list:
+            base[key] = [base[key]]
+            base[key].append(value)
+        elif base[key] is None and value is not None:
+            base[key] = value
+    return(base)
+
+def randomTree(rng,depth):
+    # few keys and values, so the trees share branches and leaves
+    tree = {}
+    for key in rng.sample('abcd',rng.randint(1,3)):
+        kind = rng.random()
+        if depth and kind < 0.4:
+            tree[key] = randomTree(rng,depth-1)
+        elif kind < 0.5:
+            tree[key] = None
+        elif kind < 0.6:
+            tree[key] = [rng.randint(0,2) for i in range(rng.randint(1,2))]
+        else:
+            tree[key] = rng.randint(0,2)
+    return(tree)
+
+@pytest.mark.parametrize('overwrite',[False,True,'append'])
+def test_updateDictMatchesRecursive(overwrite):
+    rng = random.Random(0)
+    for i in range(3000):
+        base = randomTree(rng,3)
+        new = copy.deepcopy(base) if i%10 == 0 else randomTree(rng,3)
+        # the branches of new can be shared with the result, so each version gets its own copy
+        expected = recursiveUpdateDict(copy.deepcopy(base),copy.deepcopy(new),overwrite)
+        assert helperFunctions.updateDict(copy.deepcopy(base),copy.deepcopy(new),overwrite) == expected,(base,new)
+
+def site(**changes):
+    # a nested metadata tree, with one branch replaced by each keyword
+    tree = {
+        'siteID':'SCL',
+        'coordinates':{'latitude':69.2,'longitude':-135.3,'altitude':1.0},
+        'measurements':{
+            'met':{'frequency':'30min','variables':{'TA':{'unit':'C','ignore':False},'RH':{'unit':'%','ignore':False}},'files':['a.dat','b.dat','c.dat']},
+            'flux':{'frequency':'30min','variables':{'FC':{'unit':'umol','ignore':False}},'files':[]},
+            },
+        }
+    for key,value in changes.items():
+        helperFunctions.updateDict(tree,helperFunctions.packDict(key,format='~',fill=value),overwrite=True)
+    return(tree)
+
+cases = {
+    'identical':(site(),site(),{}),
+    'valueChanged':(site(**{'measurements~met~variables~TA~unit':'K'}),site(),{}),
+    'typeChanged':(site(**{'coordinates~altitude':1}),site(),{}),
+    'keyAdded':(site(**{'measurements~flux~variables~LE':{'unit':'W'}}),site(),{}),
+    'keyRemoved':(site(),site(**{'measurements~flux~variables~LE':{'unit':'W'}}),{}),
+    'itemAdded':(site(**{'measurements~flux~files':['d.dat']}),site(),{}),
+    'reordered':(site(**{'measurements~met~files':['c.dat','a.dat','b.dat']}),site(),{}),
+    'excludedKey':(site(**{'measurements~met~frequency':'1min'}),site(),{'exclude_keys':[r"root\['measurements'\]\['met'\]\['frequency'\]"]}),
+    'excludedAndChanged':(site(**{'measurements~met~frequency':'1min','siteID':'BB'}),site(),{'exclude_keys':[r"\['frequency'\]"]}),
+    'ignoredVariable':(site(**{'measurements~met~variables~TA':{'unit':'K','ignore':True}}),site(),{}),
+    }
+
+@pytest.mark.parametrize('case',cases)
+def test_compareDictsMatchesDeepDiff(case,monkeypatch):
+    # the hash prefilter changes what deepdiff walks, not what it finds
+    import deepdiff
+    new,old,kwargs = cases[case]
+    before = copy.deepcopy((new,old))
+    options = {'ignore_order':kwargs.get('ignore_order',True),'exclude_regex_paths':kwargs.get('exclude_keys',[]),'exclude_obj_callback':helperFunctions.exclude_ignore_callback}
+    expected = deepdiff.DeepDiff(copy.deepcopy(old),copy.deepcopy(new),**options)
+    memo = {}
+    helperFunctions.subtreeHash(new,memo),helperFunctions.subtreeHash(old,memo)
+    shared = helperFunctions.differingBranches(new,old,memo,helperFunctions.exclude_ignore_callback)
+    assert deepdiff.DeepDiff(shared[1],shared[0],**options) == expected
+    result = helperFunctions.compareDicts(copy.deepcopy(new),copy.deepcopy(old),**kwargs)
+    assert (result is False) == (expected == {})
+    # with every hash unknown nothing is shared, which is the plain deepdiff path
+    monkeypatch.setattr(helperFunctions,'subtreeHash',lambda obj,memo:None)
+    assert helperFunctions.compareDicts(copy.deepcopy(new),copy.deepcopy(old),**kwargs) == result
+    assert (new,old) == before
@@ -0,0 +1,32 @@
+import io
+import json
+import pandas as pd
+import ingestMetrics
+from test_database import makeProject,ingest,writeTOA5
+
+def test_stagesRecorded(tmp_path):
+    # every record goes to every sink, file records carry their counts and rates, tagged with the site and measurement
+    raw = makeProject(tmp_path)
+    index = pd.date_range('2024-03-01 00:30',periods=48,freq='30min')
+    writeTOA5(raw/'a.dat',index[:24],range(24))
+    writeTOA5(raw/'b.dat',index[24:],range(24))
+    records,out = [],io.StringIO()
+    metrics = ingestMetrics.ingestMetrics(sinks=[records.append,ingestMetrics.jsonLinesSink(path=str(tmp_path/'ingest.jsonl')),ingestMetrics.progressDisplay(out=out)])
+    ingest(tmp_path,metrics=metrics)
+    stages = {record['stage'] for record in records}
+    assert {'rawFileSearch','rawFileDiscover','rawFileParse','loadRawFile','rawFileImport','databaseWrite'} <= stages
+    with open(tmp_path/'ingest.jsonl') as f:
+        assert [json.loads(line) for line in f] == json.loads(json.dumps(records,default=str))
+    files = [record for record in records if record['stage'] == 'loadRawFile']
+    assert sorted(record['file'] for record in files) == [str(raw/'a.dat'),str(raw/'b.dat')]
+    for record in files:
+        assert (record['siteID'],record['measurementID'],record['rows']) == ('S1','Met',24)
+        assert record['bytesRead'] == (raw/record['file']).stat().st_size and record['rowsPerSecond'] > 0
+    # the write covers the whole year partition on the 30 min grid
+    assert [record['rows'] for record in records if record['stage'] == 'databaseWrite'] == [366*48]
+    assert 'Parsing' in out.getvalue() and 'files/s' in out.getvalue()
+
+def test_rates():
+    # throughput for the counts that were given, none for a block that took no time
+    assert ingestMetrics.rates(0,{'rows':10}) == {'seconds':0,'rows':10}
+    assert ingestMetrics.rates(2,{'rows':10,'bytesWritten':4e6}) == {'seconds':2,'rows':10,'bytesWritten':4e6,'rowsPerSecond':5.,'MBWrittenPerSecond':2.}
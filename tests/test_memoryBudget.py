@@ -0,0 +1,30 @@
+import threading
+import numpy as np
+import pandas as pd
+import dbPipeline
+from memoryBudget import memoryBudget
+
+index = pd.date_range('2024-01-01 00:30','2024-01-03',freq='30min')
+
+def test_mergeBlocksCounted(tmp_path):
+    # each day partition's block is held while it is merged and handed back once it is written
+    budget = memoryBudget(maxBytes=10**6)
+    dataIn = pd.DataFrame({'x':np.arange(len(index),dtype='float64'),'y':1.0},index=index)
+    dbPipeline.databaseFolder(path=str(tmp_path),dataIn=dataIn,variableMap={var:{'dtype':'float64','ignore':False} for var in dataIn},partition='day',budget=budget,verbose=False)
+    assert budget.peak == 48*8*3
+    assert budget.inflight == 0
+
+def test_holdingDoesNotWait():
+    # a writer holding a block past the budget makes parsing wait, but is never held up itself
+    budget = memoryBudget(maxBytes=100)
+    budget.reserve(80)
+    with budget.holding(50):
+        assert budget.full()
+        assert not budget.reserve(10,wait=False)
+        waiting = threading.Thread(target=budget.reserve,args=(10,))
+        waiting.start()
+        waiting.join(0.1)
+        assert waiting.is_alive()
+    budget.release(80)
+    waiting.join(1)
+    assert not waiting.is_alive() and budget.inflight == 10
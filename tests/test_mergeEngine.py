@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+import mergeEngine
+
+nan = np.nan
+
+def merge(policy,block,slots,values,stamps=None):
+    block = np.array(block,dtype='float64')
+    return(mergeEngine.mergeBlock(block,[0,1],np.array(slots),np.array(values,dtype='float64'),policy,
+                                  None if stamps is None else np.array(stamps,dtype='float64'),2 if stamps is not None else None))
+
+@pytest.mark.parametrize('policy,expected',[
+    ('keepExisting',[[1,5],[3,4]]),
+    ('overwrite',[[nan,6],[3,4]]),
+    ('preferNonNaN',[[2,6],[3,4]]),
+    ])
+def test_policies(policy,expected):
+    # slot 0 holds 1 and a gap, two incoming rows for it: (2,5) then (NaN,6)
+    block = merge(policy,[[1,nan],[nan,nan]],[0,0,1],[[2,5],[nan,6],[3,4]])
+    assert np.array_equal(block,np.array(expected,dtype='float64'),equal_nan=True)
+
+def test_preferNewestStampsOfTakenValues():
+    # the newest row of slot 0 has no values, so the slot is stamped with the row its values came from
+    block = merge('preferNewest',[[nan,nan,nan]],[0,0],[[1,2],[nan,nan]],[1,5])
+    assert block[0].tolist() == [1,2,1]
+    # so a source newer than that row, but older than the empty one, still replaces them
+    block = merge('preferNewest',block,[0],[[7,nan]],[3])
+    assert block[0].tolist() == [7,2,3]
+    # an older source only fills gaps, and doesn't move the stamp
+    block = merge('preferNewest',block,[0],[[8,9]],[2])
+    assert block[0].tolist() == [7,2,3]
+
+def test_preferNewestValuesFromDifferentRows():
+    # x from the newest row, y from the older row that has it, the slot keeps the newest stamp taken
+    block = merge('preferNewest',[[nan,nan,nan]],[0,0],[[1,2],[3,nan]],[1,5])
+    assert block[0].tolist() == [3,2,5]
@@ -0,0 +1,26 @@
+import gc
+import yaml
+import metadataStore
+
+def test_noHookPerStore(monkeypatch):
+    # stores are flushed at exit by the one module hook, which doesn't keep them alive
+    registered = []
+    monkeypatch.setattr(metadataStore.atexit,'register',registered.append)
+    gc.collect()
+    count = len(metadataStore.openStores)
+    store = metadataStore.metadataStore()
+    assert registered == [] and len(metadataStore.openStores) == count+1
+    del store
+    gc.collect()
+    assert len(metadataStore.openStores) == count
+
+def test_flushAll(tmp_path):
+    # staged documents of every open store are written at exit, each by its own store
+    first,second = metadataStore.metadataStore(),metadataStore.metadataStore()
+    first.stage({'a':1},str(tmp_path/'a.yml'))
+    second.stage({'b':2},str(tmp_path/'b.yml'))
+    first.flush()
+    assert not (tmp_path/'b.yml').exists()
+    metadataStore.flushAll()
+    assert yaml.safe_load((tmp_path/'b.yml').read_text()) == {'b':2}
+    assert second.dirty == set()
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+import parseCoordinates
+
+points = {
+    # degrees as numbers and strings, DMS and DDM strings with hemisphere letters, and points in special zones
+    'SCL':(69.2235,-135.2596),
+    'BB':('49.129','-122.985'),
+    'dms':('52° 10\' 4.6" N','106° 7\' 28.1" W'),
+    'ddm':('S33° 52.5`','E151° 12.6`'),
+    'letters':('45 30 15 N','73 34 0 W'),
+    'south':(-3.1190,-60.0217),
+    'norway':(60.39,5.32),
+    'svalbard':(78.22,15.65),
+    'svalbardEast':(79.5,35.0),
+    'dateline':(-17.7134,178.065),
+    }
+
+@pytest.mark.parametrize('spatial',[False,True])
+def test_bulkMatchesScalar(spatial):
+    ID = list(points)
+    latitude,longitude = zip(*points.values())
+    frame = parseCoordinates.bulkCoordinates(ID+['missing'],list(latitude)+[None],list(longitude)+[''],spatial=spatial)
+    assert frame.loc['missing'].drop(['latitude','longitude']).isna().all() and np.isnan(frame.loc['missing','latitude'])
+    for ID,(lat,lon) in points.items():
+        scalar = parseCoordinates.parseCoordinates(ID=ID,latitude=lat,longitude=lon,spatial=False)
+        geographic = scalar.geographicCoordinates
+        row = frame.loc[ID]
+        assert (row['latitude'],row['longitude']) == (scalar.latitude,scalar.longitude),ID
+        for col in ['latitudeDDM','latitudeDMS','longitudeDDM','longitudeDMS']:
+            assert row[col] == getattr(geographic,col),(ID,col)
+        if spatial:
+            UTM = parseCoordinates.utmCoordinates(latitude=scalar.latitude,longitude=scalar.longitude)
+            assert (row['x'],row['y'],row['EPSG'],row['name']) == (UTM.x,UTM.y,UTM.EPSG,UTM.name),ID
+    if spatial:
+        assert frame.loc[['norway','svalbard','svalbardEast','south'],'zone'].tolist() == [32,33,37,20]
+        assert frame['EPSG'].nunique() == len(points)
@@ -0,0 +1,21 @@
+import os
+import numpy as np
+import pandas as pd
+from parseEddyPro import EddyPro
+
+eddyPro = os.path.join(os.path.dirname(__file__),'..','example_data','eddypro_t_full_output_2025-05-02T224906_exp.csv')
+
+def test_header():
+    # groups carry over blank cells, units lose their brackets, names that can't be file names are kept as originalName
+    parsed = EddyPro(sourceFile=eddyPro)
+    assert 'filename' not in parsed.variableMap and list(parsed.variableMap)[:2] == ['DOY','daytime']
+    assert parsed.variableMap['Tau'] == {'dtype':'float32','ignore':False,'unit':'kg+1m-1s-2','group':'corrected_fluxes_and_quality_flags'}
+    assert parsed.variableMap['u_']['originalName'] == 'u*'
+    assert list(parsed.DataFrame.columns) == list(parsed.variableMap)
+
+def test_values():
+    # fill values are NaN, the index is the end of each period, localized if a timezone is given
+    parsed = EddyPro(sourceFile=eddyPro,timezone='Etc/GMT+7')
+    assert parsed.DataFrame.index[0] == pd.Timestamp('2024-07-25 03:00',tz='Etc/GMT+7')
+    assert np.isnan(parsed.DataFrame['Tau'].iloc[0]) and parsed.DataFrame['DOY'].iloc[0] == 207.125
+    assert not (parsed.DataFrame == -9999).any().any()
@@ -0,0 +1,74 @@
+import os
+import tempfile
+from dataclasses import dataclass,field
+import pandas as pd
+import pytest
+import parserRegistry
+
+tob3 = os.path.join(os.path.dirname(__file__),'..','example_data','SCL','2024','20240912','Flux_Data2628.dat')
+eddyPro = os.path.join(os.path.dirname(__file__),'..','example_data','eddypro_t_full_output_2025-05-02T224906_exp.csv')
+
+@dataclass(kw_only=True)
+class rawBytes:
+    # keeps what it was given to parse
+    sourceFile: object = field(repr=False)
+    verbose: bool = False
+
+    def __post_init__(self):
+        if hasattr(self.sourceFile,'read'):
+            self.data = self.sourceFile.read()
+        else:
+            with open(self.sourceFile,'rb') as f:
+                self.data = f.read()
+        self.DataFrame = pd.DataFrame()
+
+def test_framesStreamed(monkeypatch):
+    # 12 records per 976 byte frame, each chunk is the header and the whole frames holding up to chunkRows records
+    monkeypatch.setitem(parserRegistry.parsers,'frames',parserRegistry.parserEntry(parser=rawBytes,headerLines=6,framed=True))
+    with open(tob3,'rb') as f:
+        data = f.read()
+    chunks = [parsed.data for parsed in parserRegistry.readChunks('frames',tob3,chunkRows=1200)]
+    assert len(chunks) == 34 and all(chunk[:1024] == data[:1024] for chunk in chunks)
+    assert {len(chunk) for chunk in chunks[:-1]} == {1024+100*976}
+    assert b''.join(chunk[1024:] for chunk in chunks) == data[1024:]
+    assert not parserRegistry.seekable('frames')
+
+def test_partialFrameLeft(tmp_path,monkeypatch):
+    # the end of a frame that is still being written is not parsed
+    monkeypatch.setitem(parserRegistry.parsers,'frames',parserRegistry.parserEntry(parser=rawBytes,headerLines=6,framed=True))
+    with open(tob3,'rb') as f:
+        data = f.read(1024+2*976+100)
+    (tmp_path/'partial.dat').write_bytes(data)
+    chunks = [parsed.data for parsed in parserRegistry.readChunks('frames',str(tmp_path/'partial.dat'),chunkRows=None)]
+    assert chunks == [data[:1024+2*976]]
+
+def test_bufferNotWritten(tmp_path,monkeypatch):
+    # chunks go to parsers that take buffers without a temporary file
+    monkeypatch.setitem(parserRegistry.parsers,'text',parserRegistry.parserEntry(parser=rawBytes,headerLines=1,fileLike=True))
+    monkeypatch.setattr(tempfile,'TemporaryDirectory',None)
+    (tmp_path/'a.csv').write_bytes(b'x\r\n1\r\n2\r\n3\r\n')
+    parsed = list(parserRegistry.readChunks('text',str(tmp_path/'a.csv'),chunkRows=2))
+    assert [p.data for p in parsed] == [b'x\r\n1\r\n2\r\n',b'x\r\n3\r\n']
+    assert parsed[-1].sourceFile == str(tmp_path/'a.csv')
+
+def test_eddyProStreamed():
+    whole = parserRegistry.getParser('EddyPro')(sourceFile=eddyPro)
+    chunks = []
+    for parsed in parserRegistry.readChunks('EddyPro',eddyPro,chunkRows=500):
+        assert parsed.sourceFile == eddyPro
+        chunks.append(parsed.DataFrame)
+    assert len(chunks) == 5
+    pd.testing.assert_frame_equal(pd.concat(chunks),whole.DataFrame)
+
+def test_lazyRegistry(monkeypatch):
+    # a parser's module is only imported when the parser is first asked for, unknown types raise KeyError
+    import sys
+    monkeypatch.delitem(sys.modules,'colorsys',raising=False)
+    monkeypatch.setattr(parserRegistry,'parsers',dict(parserRegistry.parsers))
+    parserRegistry.registerParser('lazy','colorsys:rgb_to_hls',headerLines=1,headerPrefix='{')
+    assert parserRegistry.available('lazy') and 'colorsys' not in sys.modules
+    assert parserRegistry.parsers['lazy'].headerPrefix == b'{'
+    assert parserRegistry.getParser('lazy') is sys.modules['colorsys'].rgb_to_hls
+    assert not parserRegistry.available('notAParser')
+    with pytest.raises(KeyError):
+        parserRegistry.getParser('notAParser')
@@ -0,0 +1,75 @@
+import copy
+from multiprocessing import Pool,shared_memory
+import numpy as np
+import pandas as pd
+import pytest
+import rawDataFile
+
+header = '"TOA5","x"\n"TIMESTAMP","RECORD","TA"\n"TS","RN","C"\n"","","Avg"\n'
+
+def rows(first,last):
+    return(''.join(f'"2024-01-01 {i:02d}:00:00",{i},{i}.5\n' for i in range(first,last)))
+
+def load(filePath,sourceInfo,streamed):
+    # the last piece carries the sourceInfo of the file
+    if streamed:
+        return(list(rawDataFile.streamRawFile((filePath,sourceInfo),fileType='TOA5',chunkRows=2))[-1])
+    return(rawDataFile.loadRawFile((filePath,sourceInfo),fileType='TOA5'))
+
+@pytest.mark.parametrize('streamed',[False,True])
+@pytest.mark.parametrize('appended',['\n',header])
+def test_appendWithoutRows(tmp_path,streamed,appended):
+    filePath = str(tmp_path/'Met.dat')
+    with open(filePath,'w') as f:
+        f.write(header+rows(0,4))
+    sourceInfo = {'loaded':False}
+    load(filePath,sourceInfo,streamed)
+    with open(filePath,'a') as f:
+        f.write(appended)
+    result = load(filePath,sourceInfo,streamed)
+    assert result['status'] == 'appended' and result['DataFrame'].empty
+    assert sourceInfo['fingerprint'] == rawDataFile.fileFingerprint(filePath)
+    # the next append is read from the new offset
+    with open(filePath,'a') as f:
+        f.write(rows(4,6))
+    result = load(filePath,copy.deepcopy(sourceInfo),streamed)
+    assert result['status'] == 'appended' and result['DataFrame']['RECORD'].tolist() == [4,5]
+
+def test_editThatGrows(tmp_path):
+    filePath = str(tmp_path/'Met.dat')
+    with open(filePath,'w') as f:
+        f.write(header+rows(0,4))
+    sourceInfo = {'loaded':False}
+    rawDataFile.loadRawFile((filePath,sourceInfo),fileType='TOA5')
+    # a value in the last row is corrected in place and the file gets longer
+    with open(filePath,'w') as f:
+        f.write(header+rows(0,3)+'"2024-01-01 03:00:00",3,3.25\n')
+    assert rawDataFile.fileStatus(filePath,sourceInfo) == 'modified'
+
+def test_sharedMemoryRoundTrip():
+    # numeric columns and a timezone-aware index come back through shared memory, the rest with the pickle, and the block is freed
+    index = pd.date_range('2024-01-01',periods=5,freq='30min',tz='America/Edmonton',name='TIMESTAMP')
+    DataFrame = pd.DataFrame({'TA':np.arange(5,dtype='float32'),'RECORD':np.arange(5),'flag':list('abcde')},index=index)
+    packed = rawDataFile.toSharedMemory(DataFrame)
+    result = rawDataFile.fromSharedMemory(packed)
+    # the index comes back in nanoseconds, without its freq
+    pd.testing.assert_frame_equal(result,DataFrame.set_axis(index.as_unit('ns')),check_freq=False)
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=packed['sharedMemory'])
+
+def test_sharedMemoryReleased():
+    packed = rawDataFile.toSharedMemory(pd.DataFrame({'TA':[1.,2.]},index=pd.date_range('2024-01-01',periods=2)))
+    rawDataFile.releaseSharedMemory(packed)
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=packed['sharedMemory'])
+
+def test_sharedMemoryFromWorker(tmp_path):
+    # the block outlives the worker that filled it, it belongs to the parent
+    filePath = str(tmp_path/'Met.dat')
+    with open(filePath,'w') as f:
+        f.write(header+rows(0,4))
+    with Pool(1) as pool:
+        result = pool.apply(rawDataFile.loadRawFileShared,((filePath,{'loaded':False}),),{'fileType':'TOA5'})
+    assert result['peakRSS'] > 0
+    DataFrame = rawDataFile.fromSharedMemory(result['DataFrame'])
+    pd.testing.assert_frame_equal(DataFrame,rawDataFile.loadRawFile((filePath,{'loaded':False}),fileType='TOA5')['DataFrame'],check_index_type=False)
@@ -0,0 +1,47 @@
+import os
+from siteInventory import sourceRecord,discoveryIndex
+
+def touch(filePath):
+    open(filePath,'w').close()
+
+def settle(folder):
+    # move a folder's mtime out of the window in which discoveryIndex lists it again
+    mtime = os.stat(folder).st_mtime_ns-10**10
+    os.utime(folder,ns=(mtime,mtime))
+
+def search(tmp_path):
+    # raw files under tmp_path/raw, indexed outside of it
+    raw = tmp_path/'raw'
+    raw.mkdir()
+    return(raw,str(tmp_path/'.index.json'),sourceRecord(matchPattern=str(raw/'*.dat'),rootPath=str(raw)))
+
+def test_sameTickAddition(tmp_path):
+    # a file added after a listing without changing the directory mtime (a coarse timestamp tick) is found by the next scan
+    raw,indexFile,source = search(tmp_path)
+    touch(raw/'a.dat')
+    assert source.__find_files__(indexFile=indexFile) == [str(raw/'a.dat')]
+    mtime = os.stat(raw).st_mtime_ns
+    touch(raw/'b.dat')
+    os.utime(raw,ns=(mtime,mtime))
+    assert discoveryIndex(indexFile=indexFile,matchPattern=source.matchPattern,rootPath=source.rootPath).state(current=True) == {str(raw):None}
+    assert source.__find_files__(indexFile=indexFile) == [str(raw/'b.dat')]
+
+def test_settledDirectoryNotListed(tmp_path,monkeypatch):
+    raw,indexFile,source = search(tmp_path)
+    touch(raw/'a.dat')
+    settle(raw)
+    source.__find_files__(indexFile=indexFile)
+    listed = []
+    scandir = os.scandir
+    monkeypatch.setattr(os,'scandir',lambda path:listed.append(path) or scandir(path))
+    assert source.__find_files__(indexFile=indexFile) == [] and listed == []
+
+def test_lostEntriesFoundAgain(tmp_path):
+    # files dropped from a non-empty record are found again from the index, though their directory is unchanged
+    raw,indexFile,source = search(tmp_path)
+    for name in ['a.dat','b.dat']:
+        touch(raw/name)
+    settle(raw)
+    assert sorted(source.__find_files__(indexFile=indexFile)) == [str(raw/'a.dat'),str(raw/'b.dat')]
+    source.fileList.pop(str(raw/'b.dat'))
+    assert source.__find_files__(indexFile=indexFile) == [str(raw/'b.dat')]